@@ -3,3 +3,5 @@ __author__ = 'Tadeas Soucek'
 __email__ = 'tadeas.soucek@gmail.com'
 __license__ = 'MIT'
 __version__ = '0.1.0'
+
+from aidapdf.api import open, Document
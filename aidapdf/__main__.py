@@ -2,15 +2,20 @@ import argparse
 import sys
 from argparse import BooleanOptionalAction
 
-from aidapdf import commands
+from aidapdf import commands, impose, stamp, util
 from aidapdf.config import Config
 from aidapdf.log import Logger
+from aidapdf.pageselector import PageSelectorParserException
 
 
 _logger = Logger(__name__)
 
+ENCRYPT_ALGORITHMS = ["RC4-40", "RC4-128", "AES-128", "AES-256-R5", "AES-256"]
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the command line parser. Commands are dispatched by the `func` default of the parsed arguments."""
 
-def main():
     parser = argparse.ArgumentParser("aidapdf")
 
     parser.add_argument('--color', default=True, action=BooleanOptionalAction,
@@ -18,6 +23,20 @@ def main():
     parser.add_argument('-r', '--raw-filenames', default=False, action=BooleanOptionalAction,
                         help="treat filenames as raw, not as file specifiers")
 
+    parser.add_argument('--index', default=False, action=BooleanOptionalAction,
+                        help="keep a sidecar index of every input file (cross-reference tables and page list), so "
+                             "that opening it again skips parsing them")
+    parser.add_argument('--cache', default=False, action=BooleanOptionalAction,
+                        help="keep sidecar caches of what's worked out per page (e.g. the page digests of dedupe), "
+                             "so that running again on the same file only reads pages it hasn't seen")
+    parser.add_argument('--cache-dir', default=None, metavar='DIR',
+                        help="store sidecar files in DIR instead of next to the input files")
+
+    parser.add_argument('--progress', default=False, action=BooleanOptionalAction,
+                        help="show a progress bar with throughput and ETA (only if stderr is a terminal)")
+    parser.add_argument('--progress-json', default=None, metavar='FILE',
+                        help="periodically append progress records as JSON lines to FILE ('-' for stderr)")
+
     parser.add_argument('--platform', nargs='?', choices=["macos", "windows", "other", "auto"],
                         default="auto", help="platform override")
 
@@ -54,12 +73,18 @@ def main():
                                  help="show only the version number without the program name")
     version_command.set_defaults(func=commands.version)
 
-    info_command = sub.add_parser("info", aliases=['i'], help="print info about the PDF file")
-    info_command.add_argument("file", help="the PDF file")
+    info_command = sub.add_parser("info", aliases=['i'], help="print info about the PDF file(s)")
+    info_command.add_argument("file", nargs='+',
+                              help="the PDF file(s). glob patterns are expanded. when more than one file is given, "
+                                   "implies --jsonl")
     info_command.add_argument('--decrypt-password', '--dpass', nargs='?',
                               help="password used to decrypt the input file. overrides the 'password' part of the "
                                    "input file specifier. ignored if the input file is not encrypted.")
     info_command.add_argument('-t', '--terse', action='store_true')
+    info_command.add_argument('-J', '--jsonl', action='store_true',
+                              help="print one JSON record per file, in the order the files finish scanning")
+    info_command.add_argument('-j', '--jobs', type=int, default=None,
+                              help="number of worker processes used with --jsonl. defaults to the number of CPUs")
     group = info_command.add_mutually_exclusive_group(required=False)
     group.add_argument("-a", "--all", dest="targets", action="store_const",
                        const=["pages", "metadata"], default=["pages", "metadata", "permissions"],
@@ -73,7 +98,7 @@ def main():
 
     extract_command = sub.add_parser('extract', aliases=['x'],
                                      help="extract text, attachments and graphics from PDF file")
-    extract_command.add_argument('file', help='the PDF file')
+    extract_command.add_argument('file', help="the PDF file ('-' for the standard input)")
     extract_command.add_argument('--decrypt-password', '--dpass', nargs='?',
                                  help="password used to decrypt the input file. overrides the 'password' part of the "
                                       "input file specifier. ignored if the input file is not encrypted.")
@@ -83,17 +108,38 @@ def main():
     extract_command.add_argument('-i', '--images', action='store_true', help="extract images")
     extract_command.add_argument('--image-file-template', default=None, type=str, nargs='?',
                                  help="template for the extracted image files")
+    extract_command.add_argument('--dedup-images', action='store_true',
+                                 help="write every distinct image only once, no matter how many times it occurs, and "
+                                      "write a manifest mapping every occurrence to the stored file. implies -i")
+    extract_command.add_argument('--image-manifest', default=None, type=str, nargs='?',
+                                 help="template for the manifest file written with --dedup-images. defaults to "
+                                      "'{dir}{name}-images.json'")
+    extract_command.add_argument('-a', '--attachments', action='store_true',
+                                 help="extract the embedded files. with --shard, only the first shard does")
+    extract_command.add_argument('--attachment-file-template', default=None, type=str, nargs='?',
+                                 help="template for the extracted attachment files. '{att}' is the name of the "
+                                      "attachment and '{i}' its index. defaults to '{dir}{name}-{i:03}-{att}'")
+    extract_command.add_argument('-j', '--jobs', type=int, default=None, metavar='N',
+                                 help="number of threads writing attachments. defaults to the number of CPUs")
     extract_command.add_argument('-m', '--extract-mode', nargs='?', default='plain',
-                                 choices=['plain', 'layout'],
-                                 help="extraction mode. options are 'plain' (strip formatting) and 'layout' (preserve "
-                                      "the original layout to the best of your ability)")
+                                 choices=['plain', 'layout', 'fast'],
+                                 help="extraction mode. options are 'plain' (strip formatting), 'layout' (preserve "
+                                      "the original layout to the best of your ability) and 'fast' (only decode the "
+                                      "strings shown, in the order of the content; much faster than the others)")
+    extract_command.add_argument('--shard', type=util.parse_shard, metavar='K/N',
+                                 help="only process the K-th of N equal contiguous parts of the selected pages. "
+                                      "'{shard}' in --text-file and the templates is replaced by K")
+    extract_command.add_argument('--checkpoint', default=None, type=str, metavar='FILE',
+                                 help="record the completed pages in FILE. when rerun with the same checkpoint, pages "
+                                      "that are already done are skipped and only the rest is appended")
     extract_command.set_defaults(func=commands.extract)
 
     edit_command = sub.add_parser("edit", aliases=["e"],
                                   help="edit the PDF file")
-    edit_command.add_argument("file", help="the original PDF file")
-    edit_command.add_argument("-o", "--output-file", nargs='?', default='-',
-                              help="don't rewrite the input file and write the new PDF file here")
+    edit_command.add_argument("file", help="the original PDF file ('-' for the standard input)")
+    edit_command.add_argument("-o", "--output-file", nargs='?', default=None,
+                              help="don't rewrite the input file and write the new PDF file here ('-' for the "
+                                   "standard output)")
     edit_command.add_argument("-s", "--select", nargs="?", help="selected pages")
     # decryption/encryption commands
     edit_command.add_argument('--decrypt-password', '--dpass', nargs='?',
@@ -102,6 +148,8 @@ def main():
     edit_command.add_argument("--encrypt", action="store_true")
     edit_command.add_argument("--encrypt-password", "--epass", nargs='?')
     edit_command.add_argument("--encrypt-owner-password", "--eownpass", nargs='?')
+    edit_command.add_argument("--encrypt-algorithm", choices=ENCRYPT_ALGORITHMS,
+                              help="encryption algorithm. defaults to RC4-128")
     edit_command.add_argument('--copy-metadata', default=True, action=argparse.BooleanOptionalAction,
                               help="copy metadata from the original file to the new one. on by default")
     edit_command.add_argument('--reverse', action="store_true", help="reverse the order of the pages")
@@ -112,8 +160,43 @@ def main():
     pad_group.add_argument('--pad-to-odd', action='store_true', help="pad pages to odd")
     edit_command.add_argument('--pad-where', choices=['start', 'end'], default='end',
                               help="where to add blank pages when padding")
+    edit_command.add_argument('--drop-duplicates', action='store_true',
+                              help="drop pages that look exactly like a page before them (see the dedupe command)")
+    edit_command.add_argument('--drop-blank', action='store_true',
+                              help="drop blank pages, including scanned ones")
+    edit_command.add_argument('--blank-threshold', type=float, default=0.1, metavar='PERCENT',
+                              help="with --drop-blank, pages drawing only images are blank if less than this share of "
+                                   "their pixels is dark. defaults to 0.1")
+    edit_command.add_argument('-j', '--jobs', type=int, default=None, metavar='N',
+                              help="number of worker processes used to check pages with --drop-blank and "
+                                   "--drop-duplicates. defaults to the number of CPUs")
+    edit_command.add_argument('--nup', type=int, choices=impose.NUP,
+                              help="put this many pages on every page of the output, scaled to fit. two pages share "
+                                   "a page turned sideways, four share a page of the same size")
+    edit_command.add_argument('--booklet', action='store_true',
+                              help="arrange the pages two per side for printing double-sided, folding in the middle "
+                                   "and stapling. pads the pages to a multiple of 4 at --pad-where. implies --nup 2")
+    edit_command.add_argument('--stamp', metavar='FILE[:PAGE]',
+                              help="draw a page of another PDF file (the first selected one) over every page of the "
+                                   "output, e.g. a watermark or a logo. the stamp is stored in the output only once")
+    edit_command.add_argument('--stamp-position', choices=stamp.POSITIONS, default='center',
+                              help="where to put the stamp on the pages. defaults to center")
+    edit_command.add_argument('--stamp-opacity', type=float, default=1.0,
+                              help="opacity of the stamp, from 0 to 1. defaults to 1")
+    edit_command.add_argument('--stamp-scale', type=float, default=1.0,
+                              help="size of the stamp relative to its original size. defaults to 1")
     edit_command.add_argument('-w', '--preview', action="store_true",
                               help="open the created file in the default program")
+    output_group = edit_command.add_mutually_exclusive_group()
+    output_group.add_argument('--streaming', action='store_true',
+                              help="write pages to the output as they're added instead of keeping the whole output "
+                                   "in memory")
+    output_group.add_argument('--linearize', action='store_true',
+                              help="write the output file linearized (\"fast web view\"), so that viewers can show "
+                                   "the first page before the rest is downloaded")
+    edit_command.add_argument('--prune', action='store_true',
+                              help="leave out the fonts, images and other resources the written pages don't use, so "
+                                   "that a few pages of a large document make a small file")
     edit_command.set_defaults(func=commands.edit)
 
     split_command = sub.add_parser("split", aliases=["s"])
@@ -121,10 +204,31 @@ def main():
     split_command.add_argument('select', nargs="+", help="selected pages")
     split_command.add_argument("-o", "--output-file-template", nargs="?",
                                default="{dir}{name}-{i:03}.pdf")
-    split_command.add_argument("-p", "--password", nargs="?")
-    split_command.add_argument("-P", "--owner-password", nargs="?")
+    split_command.add_argument('--decrypt-password', '--dpass', nargs='?',
+                               help="password used to decrypt the input file. overrides the 'password' part of the "
+                                    "input file specifier. ignored if the input file is not encrypted.")
+    split_command.add_argument("--encrypt", action="store_true", help="encrypt the output files")
+    split_command.add_argument("-p", "--encrypt-password", "--epass", nargs="?")
+    split_command.add_argument("-P", "--encrypt-owner-password", "--eownpass", nargs="?",
+                               help="owner password of the output files. prompted for once if not provided")
+    split_command.add_argument("--encrypt-algorithm", choices=ENCRYPT_ALGORITHMS,
+                               help="encryption algorithm. defaults to RC4-128")
     split_command.add_argument('--copy-metadata', action=argparse.BooleanOptionalAction, default=True)
-    split_command.add_argument('--copy-password', action=argparse.BooleanOptionalAction, default=True)
+    split_command.add_argument('--copy-password', action=argparse.BooleanOptionalAction, default=True,
+                               help="encrypt the output files with the password of the input file if "
+                                    "--encrypt-password isn't provided")
+    split_command.add_argument('--shard', type=util.parse_shard, metavar='K/N',
+                               help="only write the K-th of N equal contiguous parts of the output files")
+    output_group = split_command.add_mutually_exclusive_group()
+    output_group.add_argument('--streaming', action='store_true',
+                              help="write pages to the output as they're added instead of keeping the whole output "
+                                   "in memory")
+    output_group.add_argument('--linearize', action='store_true',
+                              help="write the output files linearized (\"fast web view\"), so that viewers can show "
+                                   "the first page before the rest is downloaded")
+    split_command.add_argument('--prune', action='store_true',
+                               help="leave out the fonts, images and other resources the written pages don't use, so "
+                                    "that a few pages of a large document make a small file")
     split_command.set_defaults(func=commands.split)
 
     explode_command = sub.add_parser("explode", help="divide the PDF file into files of N pages each")
@@ -133,19 +237,115 @@ def main():
     explode_command.add_argument('-s', '--select', nargs="?", help="page selector")
     explode_command.add_argument("-o", "--output-file-template", nargs="?",
                                  default="{dir}{name}-{i:03}.pdf")
-    explode_command.add_argument("-p", "--password", nargs="?")
-    explode_command.add_argument("-P", "--owner-password", nargs="?")
+    explode_command.add_argument('--decrypt-password', '--dpass', nargs='?',
+                                 help="password used to decrypt the input file. overrides the 'password' part of the "
+                                      "input file specifier. ignored if the input file is not encrypted.")
+    explode_command.add_argument("--encrypt", action="store_true", help="encrypt the output files")
+    explode_command.add_argument("-p", "--encrypt-password", "--epass", nargs="?")
+    explode_command.add_argument("-P", "--encrypt-owner-password", "--eownpass", nargs="?",
+                                 help="owner password of the output files. prompted for once if not provided")
+    explode_command.add_argument("--encrypt-algorithm", choices=ENCRYPT_ALGORITHMS,
+                                 help="encryption algorithm. defaults to RC4-128")
     explode_command.add_argument('--copy-metadata', action=argparse.BooleanOptionalAction, default=True)
-    explode_command.add_argument('--copy-password', action=argparse.BooleanOptionalAction, default=True)
+    explode_command.add_argument('--copy-password', action=argparse.BooleanOptionalAction, default=True,
+                                 help="encrypt the output files with the password of the input file if "
+                                      "--encrypt-password isn't provided")
+    explode_command.add_argument('--shard', type=util.parse_shard, metavar='K/N',
+                                 help="only write the K-th of N equal contiguous parts of the output files")
+    output_group = explode_command.add_mutually_exclusive_group()
+    output_group.add_argument('--streaming', action='store_true',
+                              help="write pages to the output as they're added instead of keeping the whole output "
+                                   "in memory")
+    output_group.add_argument('--linearize', action='store_true',
+                              help="write the output files linearized (\"fast web view\"), so that viewers can show "
+                                   "the first page before the rest is downloaded")
+    explode_command.add_argument('--prune', action='store_true',
+                                 help="leave out the fonts, images and other resources the written pages don't use, so "
+                                      "that a few pages of a large document make a small file")
     explode_command.set_defaults(func=commands.explode)
 
     merge_command = sub.add_parser("merge", aliases=["m"], help="merge multiple PDF files into a single file")
-    merge_command.add_argument("file", nargs="+")
-    merge_command.add_argument("-o", "--output-file")
+    merge_command.add_argument("file", nargs="+", help="the input files. glob patterns are expanded; '-' is the "
+                                                       "standard input")
+    merge_command.add_argument("-o", "--output-file", required=True, help="the output file ('-' for the standard "
+                                                                           "output)")
+    merge_command.add_argument('--decrypt-password', '--dpass', nargs='?',
+                               help="password used to decrypt the input files whose file specifiers don't contain "
+                                    "one")
+    merge_command.add_argument('--prefetch', type=int, default=0, metavar='N',
+                               help="load and parse up to N upcoming input files concurrently while the current one "
+                                    "is being appended. encrypted inputs then need a password up front")
+    merge_command.add_argument('-j', '--jobs', type=int, default=0, metavar='N',
+                               help="parse, decrypt and select the pages of the inputs in N worker processes, which "
+                                    "serialize the pages for the output as --streaming does. merges up to N times "
+                                    "faster on N free CPUs; on one CPU, no faster than without. encrypted inputs then "
+                                    "need a password up front")
     merge_command.add_argument("-p", "--password", nargs="?")
     merge_command.add_argument("-P", "--owner-password", nargs="?")
+    output_group = merge_command.add_mutually_exclusive_group()
+    output_group.add_argument('--streaming', action='store_true',
+                              help="write pages to the output as they're added instead of keeping the whole output "
+                                   "in memory")
+    output_group.add_argument('--linearize', action='store_true',
+                              help="write the output file linearized (\"fast web view\"), so that viewers can show "
+                                   "the first page before the rest is downloaded")
+    merge_command.add_argument('--prune', action='store_true',
+                               help="leave out the fonts, images and other resources the written pages don't use, so "
+                                    "that a few pages of a large document make a small file")
     merge_command.set_defaults(func=commands.merge)
 
+    dedupe_command = sub.add_parser("dedupe", help="report pages that look exactly like other pages")
+    dedupe_command.add_argument("file", help="the PDF file ('-' for the standard input)")
+    dedupe_command.add_argument('--decrypt-password', '--dpass', nargs='?',
+                                help="password used to decrypt the input file. overrides the 'password' part of the "
+                                     "input file specifier. ignored if the input file is not encrypted.")
+    dedupe_command.add_argument('-j', '--jobs', type=int, default=None, metavar='N',
+                                help="number of worker processes. defaults to the number of CPUs")
+    dedupe_command.add_argument('-J', '--json', action='store_true',
+                                help="print the groups of equal pages as a JSON list of lists of page numbers")
+    dedupe_command.set_defaults(func=commands.dedupe)
+
+    unshard_command = sub.add_parser("unshard", help="concatenate the outputs of a job run with --shard K/N, in "
+                                                     "shard order")
+    unshard_command.add_argument("template", help="path of the shard outputs, with '{shard}' in place of K")
+    unshard_command.add_argument("-n", "--shards", type=int, required=True, help="number of shards (N)")
+    unshard_command.add_argument("-o", "--output-file", required=True,
+                                 help="file to write. PDF files are merged, JSON image manifests are combined and "
+                                      "anything else is concatenated byte by byte")
+    unshard_command.set_defaults(func=commands.unshard)
+
+    watch_command = sub.add_parser("watch", help="run a command on every PDF file written to a directory")
+    watch_command.add_argument("directory", help="the directory to watch")
+    watch_command.add_argument("--run", required=True, metavar='COMMAND',
+                               help="the aidapdf command to run on every file, e.g. \"edit -o out/{name}.pdf\". "
+                                    "'{file}' is replaced by the path of the file and '{dir}', '{name}' and '{ext}' "
+                                    "by its parts. without '{file}', the path is the first argument of the command. "
+                                    "don't write the outputs to the watched directory, or they're processed too")
+    watch_command.add_argument('--pattern', default="*.pdf",
+                               help="only process files whose names match this pattern. defaults to '*.pdf'")
+    watch_command.add_argument('-j', '--jobs', type=int, default=None, metavar='N',
+                               help="number of worker processes. defaults to the number of CPUs")
+    watch_command.add_argument('--retries', type=int, default=2, metavar='N',
+                               help="number of times a failed file is retried. defaults to 2")
+    watch_command.add_argument('--retry-delay', type=float, default=5.0, metavar='SECONDS',
+                               help="delay before the first retry; later retries wait longer. defaults to 5")
+    watch_command.add_argument('--settle', type=float, default=2.0, metavar='SECONDS',
+                               help="a file is complete once its size hasn't changed for this long. defaults to 2")
+    watch_command.add_argument('--interval', type=float, default=1.0, metavar='SECONDS',
+                               help="how often the directory is scanned. defaults to 1")
+    watch_command.add_argument('--status-log', default=None, metavar='FILE',
+                               help="append a JSON record for every file queued, done, retried or failed to FILE. "
+                                    "files it records as done aren't processed again unless they change. defaults "
+                                    "to '.aidapdf-watch.jsonl' in the watched directory")
+    watch_command.add_argument('--once', action='store_true',
+                               help="exit once the files in the directory are processed instead of watching")
+    watch_command.set_defaults(func=commands.watch)
+
+    return parser
+
+
+def main():
+    parser = build_parser()
     args = parser.parse_args()
 
     Config.load_from_args(args)
@@ -158,6 +358,9 @@ def main():
         except (KeyboardInterrupt, EOFError):
             print()
             sys.exit(1)
+        except PageSelectorParserException as e:
+            _logger.err(f"invalid page selector: {e}")
+            sys.exit(1)
     else:
         parser.print_help()
         sys.exit(1)
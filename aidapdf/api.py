@@ -0,0 +1,216 @@
+"""
+The library interface of aidapdf. A `Document` describes what to do with the pages of an input file; nothing is read
+until the result is written, and then the input is read and the output written in a single pass:
+
+    import aidapdf
+    aidapdf.open("in.pdf").select("1-5").reverse().write("out.pdf")
+
+Inputs and outputs can also be kept in memory, as `bytes` or binary streams:
+
+    data = aidapdf.open(request_body).select("1").to_bytes()
+
+Unlike the commands, nothing here prompts for passwords or exits the program. Errors are raised:
+`FileNotFoundError` for missing inputs, `pypdf.errors.WrongPasswordError` and `pypdf.errors.FileNotDecryptedError`
+for missing or incorrect passwords, other `pypdf.errors.PdfReadError`s for broken files,
+`PageSelectorParserException` and `PageSelectorBakeException` for invalid page selectors and `ValueError` for invalid
+arguments. Log messages are printed to stderr like the commands' are; set `Config.VERBOSITY_LEVEL` to 0 to silence
+everything but errors.
+"""
+
+from io import BytesIO
+from os import PathLike
+from typing import Any, Callable, Literal, Optional, BinaryIO
+
+from aidapdf.features import blank_features
+from aidapdf.file import PdfFile, check_filename, parse_file_specifier
+from aidapdf.pageselector import PageSelector
+
+
+_Sequence = list[Optional[int]]
+"""Indices of the input pages in output order; `None` stands for a blank page."""
+
+
+class _SequenceView:
+    """Lets page selectors select from a page sequence of a file instead of the file itself."""
+
+    def __init__(self, sequence: _Sequence, file: PdfFile):
+        self._sequence = sequence
+        self._file = file
+
+    def get_page_count(self) -> int:
+        return len(self._sequence)
+
+    def get_page_features(self, index: int) -> dict[str, Any]:
+        # a blank page has the size of the page before it, as it's written
+        source = next((i for i in reversed(self._sequence[:index + 1]) if i is not None), None)
+        if source is None:
+            source = next((i for i in self._sequence if i is not None), None)
+        if self._sequence[index] is not None:
+            return self._file.get_page_features(source)
+        if source is None:
+            return blank_features(0, 0)
+        features = self._file.get_page_features(source)
+        return blank_features(features["width"], features["height"])
+
+
+class Document:
+    """
+    The pages of an input file and the operations to apply to them. Documents are immutable; every operation returns
+    a new document, so a document can be shared and reused as the base of many others.
+    """
+
+    def __init__(self, source: str | PathLike | bytes | bytearray | memoryview | BinaryIO,
+                 selector: Optional[PageSelector] = None, password: Optional[str] = None):
+        self.source = source
+        self.password = password
+        self._selector = selector
+        self._steps: tuple[Callable[[_Sequence, PdfFile], _Sequence], ...] = ()
+        self._metadata = True
+        self._encryption: Optional[tuple[str, Optional[str], Optional[str]]] = None
+
+    def _then(self, step: Optional[Callable[[_Sequence, PdfFile], _Sequence]] = None, **attrs) -> 'Document':
+        doc = Document.__new__(Document)
+        doc.__dict__.update(self.__dict__)
+        if step is not None:
+            doc._steps = self._steps + (step,)
+        doc.__dict__.update(attrs)
+        return doc
+
+    def select(self, selector: str | PageSelector) -> 'Document':
+        """Keep the selected pages, in the order of the selector. Page numbers refer to the current pages."""
+
+        if isinstance(selector, str):
+            selector = PageSelector.parse(selector)
+        return self._then(lambda seq, file: [seq[i] for i in selector.bake(_SequenceView(seq, file))])
+
+    def reverse(self) -> 'Document':
+        """Reverse the order of the pages."""
+        return self._then(lambda seq, file: seq[::-1])
+
+    def add_blank(self, selector: str | PageSelector) -> 'Document':
+        """Insert a blank page before each selected page. Page numbers refer to the current pages."""
+
+        if isinstance(selector, str):
+            selector = PageSelector.parse(selector)
+
+        def step(seq: _Sequence, file: PdfFile) -> _Sequence:
+            res = list(seq)
+            for i in sorted(selector.bake(_SequenceView(seq, file)), reverse=True):
+                res.insert(i, None)
+            return res
+
+        return self._then(step)
+
+    def pad(self, to: int, where: Literal['start', 'end'] = 'end') -> 'Document':
+        """Add blank pages at the start or the end until there are at least `to` pages."""
+
+        if where not in ('start', 'end'):
+            raise ValueError(f"invalid padding position {repr(where)}")
+
+        def step(seq: _Sequence, file: PdfFile) -> _Sequence:
+            blank: _Sequence = [None] * max(to - len(seq), 0)
+            return blank + seq if where == 'start' else seq + blank
+
+        return self._then(step)
+
+    def copy_metadata(self, copy: bool = True) -> 'Document':
+        """Whether to copy the metadata of the input file to the output (done by default)."""
+        return self._then(_metadata=copy)
+
+    def encrypt(self, owner_password: str, password: Optional[str] = None,
+                algorithm: Optional[str] = None) -> 'Document':
+        """
+        Encrypt the output.
+        :param owner_password: Password to change the encryption and permissions of the file. Required.
+        :param password: Password to access the file. Defaults to the password of the input file.
+        :param algorithm: One of "RC4-40", "RC4-128", "AES-128", "AES-256-R5" and "AES-256". Defaults to "RC4-128".
+        """
+
+        if not owner_password:
+            raise ValueError("no owner password provided")
+        return self._then(_encryption=(owner_password, password, algorithm))
+
+    def _open(self) -> PdfFile:
+        source = self.source
+        if isinstance(source, (str, PathLike)):
+            source = check_filename(str(source))
+        return PdfFile(source, self._selector, self.password, interactive=False)
+
+    def _sequence(self, file: PdfFile) -> _Sequence:
+        seq: _Sequence = list(file.get_page_indices())
+        for step in self._steps:
+            seq = step(seq, file)
+        return seq
+
+    def page_count(self) -> int:
+        """Return the number of pages the output would have. Reads the input file."""
+
+        file = self._open()
+        with file.get_reader():
+            return len(self._sequence(file))
+
+    def write(self, target: str | PathLike | BinaryIO, streaming: bool = False, linearize: bool = False,
+              prune: bool = False) -> int:
+        """
+        Apply the operations and write the result to `target`: a path, which may be the path of the input file, or a
+        binary stream other than the input, which is written from its current position.
+        :param streaming: Write the pages as they're added (see `StreamingPdfWriter`).
+        :param linearize: Write the result linearized (see `linearize.write_linearized()`). Overrides `streaming`.
+        :param prune: Leave out the resources the written pages don't use (see `prune.ResourcePruner`).
+        :return: The number of pages written.
+        """
+
+        file = self._open()
+        out = PdfFile(target, source_file=file, interactive=False, streaming=streaming, linearize=linearize,
+                      prune=prune)
+        with file.get_reader() as reader:
+            # worked out before the writer is opened, so that invalid selectors don't leave an empty file behind
+            sequence = self._sequence(file)
+            with out.get_writer() as writer:
+                if self._encryption:
+                    out.encrypt(*self._encryption)
+
+                size = None
+                for i in sequence:
+                    if i is not None:
+                        page = reader.get_page(i)
+                        writer.add_page(page)
+                        size = (page.mediabox.width, page.mediabox.height)
+                        continue
+                    if size is None:
+                        # blank pages take the size of the page before them; leading ones that of the first page
+                        box = reader.get_page(next((j for j in sequence if j is not None), 0)).mediabox
+                        size = (box.width, box.height)
+                    writer.add_blank_page(*size)
+
+                if self._metadata:
+                    out.copy_metadata_from_owner()
+        return len(sequence)
+
+    def to_bytes(self, streaming: bool = False, linearize: bool = False, prune: bool = False) -> bytes:
+        """Apply the operations and return the resulting PDF file."""
+
+        buffer = BytesIO()
+        self.write(buffer, streaming, linearize, prune)
+        return buffer.getvalue()
+
+    def __repr__(self) -> str:
+        source = repr(str(self.source)) if isinstance(self.source, (str, PathLike)) else "<memory>"
+        return f"Document({source}, {len(self._steps)} operations)"
+
+
+def open(spec: str | PathLike | bytes | bytearray | memoryview | BinaryIO, password: Optional[str] = None,
+         raw: bool = False) -> Document:
+    """
+    Open a PDF file. Nothing is read until the document is written.
+    :param spec: A file specifier ("file.pdf", "file.pdf:1-5", "file.pdf:1-5:password"), a path, the contents of a
+    file or a binary stream to read it from.
+    :param password: Password to decrypt the file. Overrides the password in the file specifier.
+    :param raw: If `True`, `spec` is taken as a plain path even if it contains colons.
+    """
+
+    if raw or not isinstance(spec, str):
+        return Document(spec, password=password)
+    path, selector, spec_password = parse_file_specifier(spec, skip_check=True)
+    return Document(path, PageSelector.parse(selector) if selector else None, password or spec_password)
+
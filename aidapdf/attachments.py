@@ -0,0 +1,232 @@
+import re
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path, PureWindowsPath
+from typing import Any, BinaryIO, Iterator, Optional
+
+from pypdf import PdfReader
+from pypdf.errors import PyPdfError
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject, read_object
+
+from aidapdf import util
+from aidapdf.file import PdfFile
+from aidapdf.log import Logger
+from aidapdf.progress import Progress
+
+
+_logger = Logger(__name__)
+
+
+CHUNK_SIZE = 1 << 20
+"""Embedded files are read, decoded and written in chunks of this many bytes."""
+
+_HEADER_SIZE = 1 << 14
+"""How much of an object is read to find the start of its stream data."""
+
+_OBJECT_HEADER = re.compile(rb"\s*\d+\s+\d+\s+obj\s*")
+_STREAM_KEYWORD = re.compile(rb">>\s*stream(?:\r\n|\n|\r)")
+
+_MAX_NAME_TREE_DEPTH = 32
+
+
+class Attachment:
+    """A file embedded in a PDF file."""
+
+    def __init__(self, index: int, name: str, stream: IndirectObject):
+        self.index = index
+        """Position of the attachment in the name tree, from 1."""
+        self.name = name
+        """Name of the attachment, as it's stored in the PDF file; it may contain directories."""
+        self.stream = stream
+        """The embedded file stream."""
+
+    @property
+    def filename(self) -> str:
+        """The name of the attachment without any directories, safe to write to."""
+
+        name = PureWindowsPath(self.name).name
+        if name in ("", ".", ".."):
+            return f"attachment{self.index}"
+        return name
+
+    def __repr__(self) -> str:
+        return f"Attachment({self.index}, {repr(self.name)})"
+
+
+def _name_tree_values(node: DictionaryObject, seen: set[int], depth: int = 0) -> Iterator[tuple[str, Any]]:
+    if depth > _MAX_NAME_TREE_DEPTH:
+        return
+    if "/Names" in node:
+        names = node["/Names"]
+        for i in range(0, len(names) - 1, 2):
+            yield str(names[i]), names[i + 1].get_object()
+    for kid in node.get("/Kids", ArrayObject()):
+        if isinstance(kid, IndirectObject):
+            if kid.idnum in seen:
+                continue
+            seen.add(kid.idnum)
+        yield from _name_tree_values(kid.get_object(), seen, depth + 1)
+
+
+def list_attachments(reader: PdfReader) -> list[Attachment]:
+    """Return the files embedded in the document (in the `/EmbeddedFiles` name tree), without reading them."""
+
+    names = reader.root_object.get("/Names")
+    if names is None or "/EmbeddedFiles" not in names:
+        return []
+    attachments = []
+    for key, filespec in _name_tree_values(names["/EmbeddedFiles"], set()):
+        if not isinstance(filespec, DictionaryObject) or "/EF" not in filespec:
+            _logger.warn(f"attachment {repr(key)} has no embedded file")
+            continue
+        files = filespec["/EF"]
+        entry = "/UF" if "/UF" in files else "/F"
+        stream = files.raw_get(entry) if entry in files else None
+        if not isinstance(stream, IndirectObject):
+            _logger.warn(f"attachment {repr(key)} has no embedded file")
+            continue
+        name = filespec.get("/UF") or filespec.get("/F") or key
+        attachments.append(Attachment(len(attachments) + 1, str(name), stream))
+    return attachments
+
+
+def _stream_location(reader: PdfReader, path: Path, ref: IndirectObject) -> Optional[tuple[int, int, Any]]:
+    """
+    Return the offset and the length of the data of a stream in the file, and its dictionary, or `None` if the data
+    can't be read from the file as it is.
+    """
+
+    offset = reader.xref.get(ref.generation, {}).get(ref.idnum)
+    if offset is None or reader.is_encrypted:
+        return None
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        head = f.read(_HEADER_SIZE)
+    start = _OBJECT_HEADER.match(head)
+    end = _STREAM_KEYWORD.search(head)
+    if start is None or end is None:
+        return None
+    try:
+        # everything up to the end of the dictionary, so that pypdf doesn't read the stream data
+        obj = read_object(BytesIO(head[start.end():end.start() + 2]), reader)
+    except Exception as e:
+        _logger.debug(f"can't parse the dictionary of object {ref.idnum}: {e}")
+        return None
+    if not isinstance(obj, DictionaryObject) or "/Length" not in obj:
+        return None
+    return offset + end.end(), int(obj["/Length"]), obj
+
+
+def _decoder(stream: DictionaryObject) -> Optional[Any]:
+    """Return a decompressor for the data of `stream`, `False` if it isn't encoded, or `None` if it can't be decoded in
+    chunks."""
+
+    filters = stream.get("/Filter")
+    if filters is None or filters == []:
+        return False
+    if isinstance(filters, ArrayObject):
+        if len(filters) != 1:
+            return None
+        filters = filters[0]
+    params = stream.get("/DecodeParms")
+    if isinstance(params, ArrayObject):
+        params = params[0] if params else None
+    if filters == "/FlateDecode" and (params is None or params.get("/Predictor", 1) == 1):
+        return zlib.decompressobj()
+    return None
+
+
+def _copy(source: BinaryIO, length: int, decompressor: Any, out: BinaryIO) -> int:
+    """Copy `length` bytes from `source` to `out`, decoded in chunks. Return the number of bytes written."""
+
+    written = 0
+    while length > 0:
+        chunk = source.read(min(CHUNK_SIZE, length))
+        if not chunk:
+            break
+        length -= len(chunk)
+        if decompressor:
+            # bound the size of the decoded chunks too; a small chunk can decompress to a lot
+            chunk = decompressor.decompress(chunk, CHUNK_SIZE)
+            while chunk:
+                out.write(chunk)
+                written += len(chunk)
+                chunk = decompressor.decompress(decompressor.unconsumed_tail, CHUNK_SIZE)
+        else:
+            out.write(chunk)
+            written += len(chunk)
+    if decompressor:
+        chunk = decompressor.flush()
+        out.write(chunk)
+        written += len(chunk)
+    return written
+
+
+def _write_attachment(attachment: Attachment, fp: str, source: tuple[Path, int, int] | StreamObject,
+                      decompressor: Any) -> tuple[Attachment, str, int | Exception]:
+    try:
+        with open(fp, 'wb') as out:
+            if isinstance(source, StreamObject):
+                if decompressor is None:
+                    data = source.get_data()
+                    for i in range(0, len(data), CHUNK_SIZE):
+                        out.write(data[i:i + CHUNK_SIZE])
+                    return attachment, fp, len(data)
+                return attachment, fp, _copy(BytesIO(source._data), len(source._data), decompressor, out)
+            path, offset, length = source
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                return attachment, fp, _copy(f, length, decompressor, out)
+    except (OSError, zlib.error, PyPdfError) as e:
+        return attachment, fp, e
+
+
+def write_attachments(file: PdfFile, template: str, jobs: int, progress: Optional[Progress] = None,
+                      **fields: Any) -> tuple[list[str], int]:
+    """
+    Write the files embedded in `file` to the files named by `template`, by `jobs` threads. The reader has to be open.
+    The embedded file streams are decoded in chunks as they're written, and when the file is on the disk (and not
+    encrypted), they're copied from it without being read into memory at all, so even huge attachments take little
+    memory. Streams with other filters than `/FlateDecode` are decoded in memory.
+    :param template: Output file name template. Has the fields of `PdfFile.template_fields()`, `i` (the index of the
+                     attachment, from 1), `att` (the name of the attachment) and `fields`.
+    :param progress: Advanced for every attachment written.
+    :return: The names of the written files and the number of attachments that couldn't be written.
+    """
+
+    reader = file.get_reader_unsafe()
+    attachments = list_attachments(reader)
+    _logger.debug(f"found {util.pluralize(len(attachments), 'attachment')}")
+
+    def items() -> Iterator[tuple]:
+        for attachment in attachments:
+            fp = template.format(**file.template_fields(), i=attachment.index, att=attachment.filename, **fields)
+            location = _stream_location(reader, file.path, attachment.stream) if file.path is not None else None
+            if location is not None:
+                offset, length, stream = location
+                source = (file.path, offset, length)
+            else:
+                # reading objects isn't thread safe, so this is done here
+                stream = source = attachment.stream.get_object()
+            decompressor = _decoder(stream)
+            if decompressor is None:
+                _logger.debug(f"{attachment} can't be decoded in chunks; decoding it in memory")
+                source = attachment.stream.get_object()
+            yield attachment, fp, source, decompressor
+
+    written = []
+    failed = 0
+    with ThreadPoolExecutor(jobs, thread_name_prefix="attachments") as executor:
+        for future in util.as_completed_bounded(executor, _write_attachment, items(), jobs * 2):
+            attachment, fp, size = future.result()
+            if progress:
+                progress.advance()
+            if isinstance(size, Exception):
+                _logger.err(f"can't write attachment {repr(attachment.name)} to file {repr(fp)}: {size}")
+                failed += 1
+                continue
+            Progress.count_written(fp)
+            _logger.info(f"wrote attachment {repr(attachment.name)} ({size} bytes) to file {repr(fp)}")
+            written.append(fp)
+    return written, failed
@@ -0,0 +1,119 @@
+from io import BytesIO
+from typing import Callable, Optional
+
+from PIL import Image
+from pypdf import PageObject
+from pypdf.generic import ArrayObject, StreamObject
+
+from aidapdf.features import page_content, painting_operators, drawn_xobjects, IMAGE_OPS
+from aidapdf.file import PdfFile
+from aidapdf.log import Logger
+from aidapdf.pagemap import map_pages
+from aidapdf.progress import Progress
+
+
+_logger = Logger(__name__)
+
+
+BLANK_VERSION = 1
+"""Version of `ink_coverage()`. Cached results of other versions are ignored."""
+
+TIER_CONTENT = 1
+"""Decided by the size of the content, without decoding it."""
+TIER_OPERATORS = 2
+"""Decided by the operators of the content."""
+TIER_IMAGES = 3
+"""Decided by decoding the images the page draws."""
+
+TIER_NAMES = {TIER_CONTENT: "content size", TIER_OPERATORS: "operators", TIER_IMAGES: "images"}
+
+_SAMPLE_SIZE = 1024
+"""Images are scaled down to fit this size before their pixels are counted."""
+_INK_LEVEL = 192
+"""Gray levels below this count as ink."""
+
+
+def _image_coverage(image: Image.Image) -> float:
+    if image.format == "JPEG":
+        # decodes the JPEG at a fraction of its size, which is much faster
+        image.draft("L", (image.width // 8, image.height // 8))
+    image = image.convert("L")
+    image.thumbnail((_SAMPLE_SIZE, _SAMPLE_SIZE))
+    histogram = image.histogram()
+    return sum(histogram[:_INK_LEVEL]) / max(sum(histogram), 1)
+
+
+def _open_image(xobject: StreamObject) -> Image.Image:
+    filters = xobject.get("/Filter")
+    if filters in ("/DCTDecode", ["/DCTDecode"]) and xobject.get("/ColorSpace") in ("/DeviceGray", "/DeviceRGB") \
+            and "/Decode" not in xobject:
+        # a plain JPEG (as scanners make them) is opened as it is, so that it can be decoded at a smaller size
+        return Image.open(BytesIO(xobject._data))
+    return xobject.decode_as_image()
+
+
+def ink_coverage(page: PageObject) -> tuple[int, float]:
+    """
+    Return how much of a page is covered by ink, from 0 to 1, and the tier of the check that decided it. The checks go
+    from cheap to expensive and stop as soon as the page is decided:
+
+    1. A page without content (or only empty content streams) is blank.
+    2. A page whose content paints nothing is blank; one that paints paths or text or draws a form isn't (coverage 1).
+    3. Otherwise the page only draws images (a scanned page); they're decoded, scaled down, and the share of dark
+       pixels in the darkest one is the coverage.
+    """
+
+    if "/Contents" not in page:
+        return TIER_CONTENT, 0.0
+    contents = page.raw_get("/Contents").get_object()
+    streams = contents if isinstance(contents, ArrayObject) else [contents]
+    if all(not stream.get_object()._data for stream in streams):
+        return TIER_CONTENT, 0.0
+
+    content = page_content(page)
+    ops = painting_operators(content)
+    if not ops:
+        return TIER_OPERATORS, 0.0
+    if ops - IMAGE_OPS:
+        return TIER_OPERATORS, 1.0
+    resources = page.get("/Resources")
+    xobjects = resources.get("/XObject") if resources is not None else None
+    images = []
+    for name in drawn_xobjects(content):
+        if xobjects is None or name not in xobjects:
+            continue
+        xobject = xobjects[name]
+        if xobject.get("/Subtype") != "/Image":
+            return TIER_OPERATORS, 1.0
+        images.append(xobject)
+
+    coverage = 0.0
+    for xobject in images:
+        coverage = max(coverage, _image_coverage(_open_image(xobject)))
+    if b"BI" in ops:
+        for key in page.images.keys():
+            if key.startswith("~"):
+                coverage = max(coverage, _image_coverage(page.images[key].image))
+    return TIER_IMAGES, coverage
+
+
+def _make_ink_coverage() -> Callable[[PageObject], tuple[int, float]]:
+    return ink_coverage
+
+
+def find_blank_pages(file: PdfFile, indices: list[int], threshold: float, jobs: Optional[int] = None,
+                     progress: Optional[Progress] = None) -> list[int]:
+    """
+    Return the blank pages among the pages `indices` of `file`. The reader has to be open. Large files are checked by
+    a process pool; with `Config.CACHE`, the ink coverage of the pages is kept in a sidecar (see `map_pages()`).
+    :param threshold: Pages covered by less ink than this (from 0 to 1) are blank.
+    :param jobs: Number of worker processes. Defaults to the number of CPUs.
+    :param progress: Advanced for every page checked.
+    """
+
+    results = map_pages(file, indices, _make_ink_coverage, 'blank', BLANK_VERSION, jobs, progress)
+    tiers = {tier: 0 for tier in TIER_NAMES}
+    for tier, _ in results.values():
+        tiers[tier] += 1
+    _logger.debug("pages decided by " + ", ".join(f"{TIER_NAMES[tier]}: {n}" for tier, n in tiers.items()))
+    return [i for i in indices if results[i][1] < threshold]
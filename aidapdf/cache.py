@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+from os import PathLike
+from pathlib import Path
+from typing import Any, Optional
+
+from aidapdf.config import Config
+from aidapdf.log import Logger
+
+
+_logger = Logger(__name__)
+
+
+VERSION = 1
+"""Version of the sidecar format. Sidecars written by other versions are ignored."""
+
+_SAMPLE_SIZE = 64 * 1024
+
+
+def fingerprint(path: str | PathLike) -> dict[str, Any]:
+    """
+    Return what identifies the current contents of the file `path`: its size, its modification time and a hash of its
+    first and last 64 KiB. Hashing just the ends keeps this cheap for huge files; a PDF's header and its trailer (with
+    the last cross-reference table) are at the ends, so they change whenever the file is rewritten or updated.
+    """
+
+    st = os.stat(path)
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        h.update(f.read(_SAMPLE_SIZE))
+        if st.st_size > _SAMPLE_SIZE:
+            f.seek(max(st.st_size - _SAMPLE_SIZE, _SAMPLE_SIZE))
+            h.update(f.read())
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": h.hexdigest()}
+
+
+def sidecar_path(path: str | PathLike, kind: str) -> Path:
+    """
+    Return the path of the `kind` sidecar of the file `path`: a hidden file next to it or, if `Config.CACHE_DIR` is set,
+    a file in that directory named after the absolute path of the file.
+    """
+
+    path = Path(path)
+    if Config.CACHE_DIR:
+        key = hashlib.sha256(str(path.resolve()).encode()).hexdigest()[:32]
+        return Path(Config.CACHE_DIR) / f"{key}.{kind}.json"
+    return path.with_name(f".{path.name}.aidapdf-{kind}.json")
+
+
+def load(path: str | PathLike, kind: str) -> Optional[Any]:
+    """Return the data of the `kind` sidecar of the file `path`, or `None` if there's none or it's out of date."""
+
+    sidecar = sidecar_path(path, kind)
+    try:
+        with open(sidecar) as f:
+            content = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        _logger.warn(f"ignoring unreadable {kind} sidecar {repr(str(sidecar))}: {e}")
+        return None
+
+    if content.get("version") != VERSION or content.get("file") != fingerprint(path):
+        _logger.debug(f"{kind} sidecar {repr(str(sidecar))} is out of date")
+        return None
+    _logger.debug(f"loaded {kind} sidecar {repr(str(sidecar))}")
+    return content["data"]
+
+
+def store(path: str | PathLike, kind: str, data: Any) -> None:
+    """
+    Store `data` (anything JSON can hold) as the `kind` sidecar of the file `path`. Failing to write the sidecar isn't
+    an error; it's only logged.
+    """
+
+    sidecar = sidecar_path(path, kind)
+    temp = sidecar.with_name(sidecar.name + '.part')
+    try:
+        sidecar.parent.mkdir(parents=True, exist_ok=True)
+        with open(temp, 'w') as f:
+            json.dump({"version": VERSION, "file": fingerprint(path), "data": data}, f, separators=(',', ':'))
+        os.replace(temp, sidecar)
+    except OSError as e:
+        _logger.debug(f"couldn't write {kind} sidecar {repr(str(sidecar))}: {e}")
+        return
+    _logger.debug(f"wrote {kind} sidecar {repr(str(sidecar))}")
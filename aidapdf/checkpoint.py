@@ -0,0 +1,112 @@
+import json
+import os
+import time
+from os import PathLike
+from pathlib import Path
+from typing import Any, Optional, IO
+
+from aidapdf import util
+from aidapdf.log import Logger
+
+
+_logger = Logger(__name__)
+
+
+class CheckpointMismatchException(Exception):
+    pass
+
+
+class Checkpoint:
+    """
+    Records the progress of a long-running job, so that a rerun after a crash can skip the work that's already done.
+
+    The checkpoint is a JSONL file. Its first line describes the job (input file, options); a checkpoint written by a
+    different job is rejected. Every following line records one completed page. The records are flushed as soon as
+    they're written and synced to disk at most once every `SYNC_INTERVAL` seconds. Use with a `with` statement.
+    """
+
+    SYNC_INTERVAL = 1.0
+
+    def __init__(self, path: str | PathLike, job: dict[str, Any]):
+        self.path = Path(path)
+        # normalize through JSON (tuples become lists, ...) so that the job compares equal to the loaded header
+        self.job = json.loads(json.dumps(job))
+        self.pages: dict[int, dict[str, Any]] = {}
+        """Records of the completed pages, by page index."""
+        self.last: Optional[dict[str, Any]] = None
+        """The most recently written record."""
+
+        if self.path.is_file() and self.path.stat().st_size > 0:
+            self._load()
+        else:
+            with open(self.path, 'w') as f:
+                f.write(json.dumps(self.job) + '\n')
+            _logger.debug(f"created checkpoint {repr(str(self.path))}")
+
+        self._file = open(self.path, 'a')
+        self._synced_files: list[IO] = []
+        self._last_sync = time.monotonic()
+
+    def _load(self) -> None:
+        data = self.path.read_bytes()
+        lines = data.split(b'\n')
+        header = json.loads(lines[0])
+        if header != self.job:
+            raise CheckpointMismatchException(f"checkpoint {repr(str(self.path))} was written by a different job "
+                                              f"({header}); remove it to start over")
+
+        # the last line is cut short if the job was killed while writing it. only lines terminated by a newline count
+        end = len(lines[0]) + 1
+        for line in lines[1:-1]:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                _logger.warn(f"ignoring damaged checkpoint record {repr(line)}")
+                break
+            self.pages[record["page"]] = record
+            self.last = record
+            end += len(line) + 1
+        if end < len(data):
+            with open(self.path, 'r+b') as f:
+                f.truncate(end)
+
+        _logger.info(f"resuming from checkpoint {repr(str(self.path))} "
+                     f"({util.pluralize(len(self.pages), 'page')} already done)")
+
+    def sync_with(self, f: IO) -> None:
+        """Sync `f` to disk whenever (and before) the checkpoint itself is synced."""
+        self._synced_files.append(f)
+
+    def is_done(self, page: int) -> bool:
+        return page in self.pages
+
+    def record(self, page: int, **data: Any) -> None:
+        """Record that the page with the index `page` is done. Files passed to `sync_with()` have to be flushed."""
+
+        record = {"page": page, **data}
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        self.pages[page] = record
+        self.last = record
+        if time.monotonic() - self._last_sync >= self.SYNC_INTERVAL:
+            self.sync()
+
+    def sync(self) -> None:
+        # outputs first, so that no synced record refers to output that isn't on the disk yet
+        for f in self._synced_files:
+            if not f.closed and f.seekable():
+                os.fsync(f.fileno())
+        os.fsync(self._file.fileno())
+        self._last_sync = time.monotonic()
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        self.sync()
+        self._file.close()
+
+    def __enter__(self) -> 'Checkpoint':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
@@ -1,19 +1,38 @@
 import argparse
+import asyncio
+import json
 import os
+import shutil
 import sys
+from collections import deque
+from io import BytesIO
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
 from pathlib import Path
 from pprint import pprint
-from typing import Any, Optional, Callable
+from typing import Any, Optional, Callable, Generator
 
 from pypdf.errors import FileNotDecryptedError, WrongPasswordError, PdfReadError
 
 import aidapdf
 import readline
 from aidapdf import util
+from aidapdf.attachments import write_attachments
+from aidapdf.blank import find_blank_pages
+from aidapdf.checkpoint import Checkpoint, CheckpointMismatchException
 from aidapdf.config import Config
-from aidapdf.file import PdfFile, parse_file_specifier
+from aidapdf.dedupe import page_digests, find_duplicates
+from aidapdf.digest import ObjectDigester, image_digest
+from aidapdf.file import PdfFile, parse_file_specifier, expand_file_specifiers, EncryptionContext, \
+    read_owner_password, STDIO
+from aidapdf.impose import Imposer, booklet_order
 from aidapdf.log import Logger
 from aidapdf.pageselector import PageSelector, PageSelectorBakeException
+from aidapdf.progress import Progress
+from aidapdf.stamp import Stamp
+from aidapdf.streamwriter import StreamingPdfWriter, Fragment
+from aidapdf.textscan import TextScanner
+from aidapdf.watch import Watcher, parse_command
 
 _logger = Logger(__name__)
 
@@ -62,7 +81,7 @@ def debug_selector(args: argparse.Namespace):
                 if args.select:
                     raw_select = args.select
                 else:
-                    raw_select = input((bake_file.path.name if bake_file else '') + '> ')
+                    raw_select = input((bake_file.name if bake_file else '') + '> ')
 
                 select = PageSelector.parse(raw_select)
             else:
@@ -97,6 +116,42 @@ def debug_specifier(args: argparse.Namespace):
             break
 
 
+def _scan_info(filename: str, selector: Optional[str], password: Optional[str], targets: list[str]) -> dict[str, Any]:
+    """Collect the info about a single file as a JSON-serializable record. Runs in a worker process."""
+
+    record: dict[str, Any] = {"file": filename, "size": None, "encrypted": None}
+    try:
+        record["size"] = os.path.getsize(filename)
+        file = PdfFile(filename, selector, password, interactive=False)
+        trailer = file.scan_trailer("pages" in targets)
+        if trailer is not None:
+            record["encrypted"] = False
+            if "pages" in targets:
+                record["pages"] = trailer.pages
+            if "metadata" in targets:
+                record["metadata"] = trailer.metadata
+            if "permissions" in targets:
+                # unencrypted files have none
+                record["permissions"] = None
+        else:
+            with file.get_reader() as reader:
+                record["encrypted"] = reader.is_encrypted
+                if "pages" in targets:
+                    record["pages"] = file.get_page_count()
+                if "metadata" in targets:
+                    record["metadata"] = file.get_metadata(resolve=True)
+                if "permissions" in targets:
+                    record["permissions"] = file.get_permissions()
+        record["error"] = None
+    except (FileNotDecryptedError, WrongPasswordError) as e:
+        record["encrypted"] = True
+        record["error"] = f"{type(e).__name__}: {e}"
+    except Exception as e:
+        # a damaged file must not take the whole scan down with it
+        record["error"] = f"{type(e).__name__}: {e}"
+    return record
+
+
 @command
 def info(args: argparse.Namespace) -> bool:
     def print_target(target: str, prefix: str, v: Any):
@@ -112,8 +167,27 @@ def info(args: argparse.Namespace) -> bool:
                 value_text = str(v)
             print(prefix + ': ' + value_text)
 
-    path, selector, password = parse_file_specifier(args.file)
+    try:
+        fsps = expand_file_specifiers(args.file, skip_check=args.jsonl or len(args.file) > 1)
+    except FileNotFoundError as e:
+        _logger.err(e.args[0])
+        return False
+
+    if args.jsonl or len(fsps) > 1:
+        return _info_jsonl(args, fsps)
+
+    path, selector, password = fsps[0]
     file = PdfFile(path, selector, args.decrypt_password or password)
+    trailer = file.scan_trailer("pages" in args.targets)
+    if trailer is not None:
+        if not args.terse:
+            print(str(file))
+        print_target("pages", "Pages", trailer.pages)
+        print_target("metadata", "Metadata", trailer.metadata)
+        # unencrypted files have no permissions
+        print_target("permissions", "Permissions", None)
+        return True
+
     with file.get_reader() as reader:
         pages = file.get_page_count()
         if not args.terse:
@@ -125,52 +199,189 @@ def info(args: argparse.Namespace) -> bool:
     return True
 
 
+def _info_jsonl(args: argparse.Namespace, fsps: list[tuple[str, Optional[str], Optional[str]]]) -> bool:
+    jobs = args.jobs or os.cpu_count() or 1
+    _logger.debug(f"scanning {util.pluralize(len(fsps), 'file')} with {util.pluralize(jobs, 'worker')}")
+
+    failed = 0
+    with ProcessPoolExecutor(jobs, initializer=Config.restore, initargs=(Config.dump(),)) as executor:
+        items = ((path, selector, args.decrypt_password or password, args.targets)
+                 for path, selector, password in fsps)
+        for future in util.as_completed_bounded(executor, _scan_info, items, jobs * 4):
+            record = future.result()
+            if record["error"]:
+                failed += 1
+                _logger.warn(f"{repr(record['file'])}: {record['error']}")
+            print(json.dumps(record, default=str), flush=True)
+
+    if failed:
+        _logger.err(f"{util.pluralize(failed, 'file')} of {len(fsps)} couldn't be read")
+    return failed == 0
+
+
+def _extract_job(args: argparse.Namespace, file: PdfFile, text_file: Optional[str],
+                 image_file_template: Optional[str]) -> dict[str, Any]:
+    """Describe an extraction job for its checkpoint. The file has to be on the disk."""
+
+    stat = file.path.stat()
+    return {
+        "command": "extract",
+        "file": str(file.path.resolve()),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "selector": repr(file.selector),
+        "shard": args.shard,
+        "text_file": text_file,
+        "extract_mode": args.extract_mode,
+        "image_file_template": image_file_template,
+        "dedup_images": args.dedup_images,
+    }
+
+
 @command
 def extract(args: argparse.Namespace) -> bool:
     extract_text = args.text or not not args.text_file
     text_file: str = args.text_file or "stdout"
-    if extract_text:
-        text_file_stream = sys.stdout if text_file == "stdout" else open(text_file, mode='w+')
-    else:
-        text_file_stream = None
-    extract_images = args.images or not not args.image_file_template
+    if args.shard and args.text_file:
+        text_file = text_file.format(shard=args.shard[0])
+    extract_images = args.images or not not args.image_file_template or args.dedup_images
     image_file_template: str = args.image_file_template or "{dir}{name}-{p:03}-{i:03}-{img}"
+    # attachments belong to the document, not to pages, so only the first shard extracts them
+    extract_attachments = (args.attachments or not not args.attachment_file_template) and \
+        (not args.shard or args.shard[0] == 1)
+    attachment_file_template: str = args.attachment_file_template or "{dir}{name}-{i:03}-{att}"
 
     if Config.DEBUG_SHOWN:
-        if not extract_text and not extract_images:
+        if not extract_text and not extract_images and not extract_attachments:
             _logger.err("nothing to extract specified")
             return False
         extracting = []
         if extract_text: extracting.append("text")
         if extract_images: extracting.append("images")
+        if extract_attachments: extracting.append("attachments")
         _logger.debug("extracting " + ', '.join(extracting))
 
+    if args.checkpoint and extract_text and text_file == "stdout":
+        _logger.err("--checkpoint requires --text-file; text written to stdout can't be resumed")
+        return False
+
     try:
         filename, page_spec, password = parse_file_specifier(args.file)
     except FileNotFoundError as e:
         _logger.err(e.args[0])
         return False
 
+    if args.checkpoint and filename == STDIO:
+        _logger.err("--checkpoint can't be used with a file read from the standard input")
+        return False
+
     try:
-        file = PdfFile(filename, page_spec, args.decrypt_password or password)
-        with file.get_reader():
-            text = ""
-            for page in file.get_pages():
+        # attachments are copied from the file on the disk, so it doesn't have to be in memory
+        file = PdfFile(filename, page_spec, args.decrypt_password or password, lazy=True)
+        with file.get_reader(), ExitStack() as stack:
+            if extract_attachments:
+                with Progress("attachments", unit='file') as progress:
+                    _, failed = write_attachments(file, attachment_file_template, args.jobs or os.cpu_count() or 1,
+                                                  progress, shard=args.shard and args.shard[0])
+                if failed:
+                    return False
+
+            checkpoint: Optional[Checkpoint] = None
+            if args.checkpoint:
+                checkpoint = stack.enter_context(Checkpoint(args.checkpoint, _extract_job(
+                    args, file, text_file if extract_text else None, image_file_template if extract_images else None)))
+
+            text_file_stream = None
+            if extract_text:
+                if text_file == "stdout":
+                    text_file_stream = sys.stdout
+                elif checkpoint and checkpoint.last:
+                    # drop whatever was written after the last completed page
+                    text_file_stream = stack.enter_context(open(text_file, mode='r+'))
+                    text_file_stream.truncate(checkpoint.last["text_size"])
+                    text_file_stream.seek(checkpoint.last["text_size"])
+                else:
+                    text_file_stream = stack.enter_context(open(text_file, mode='w+'))
+                if checkpoint:
+                    checkpoint.sync_with(text_file_stream)
+
+            scanner = TextScanner() if args.extract_mode == 'fast' else None
+            digester = ObjectDigester()
+            stored_images: dict[str, str] = {}
+            manifest: list[dict[str, Any]] = []
+            indices = file.get_page_indices()
+            if args.shard:
+                indices = util.shard(indices, *args.shard)
+                _logger.info(f"shard {args.shard[0]}/{args.shard[1]}: {util.pluralize(len(indices), 'page')}" +
+                             (f" ({indices[0]+1}-{indices[-1]+1})" if indices else ""))
+            if checkpoint:
+                for record in checkpoint.pages.values():
+                    for image in record["images"]:
+                        if image["digest"]:
+                            stored_images[image["digest"]] = image["file"]
+                        if args.dedup_images:
+                            manifest.append(image)
+                indices = [i for i in indices if not checkpoint.is_done(i)]
+
+            progress = stack.enter_context(Progress("extract", total=len(indices)))
+            for index, page in progress.track(zip(indices, file.get_pages(indices=indices))):
+                page_images: list[dict[str, Any]] = []
                 if extract_text:
-                    text += page.extract_text(extraction_mode=args.extract_mode)
+                    if scanner:
+                        text = scanner.extract_text(page)
+                    else:
+                        text = page.extract_text(extraction_mode=args.extract_mode)
+                    text_file_stream.write(text)
+                    # the standard output can't tell where it is, so the text is measured as the stream encodes it
+                    progress.add_bytes(len(text.encode(text_file_stream.encoding or 'utf-8', 'replace')))
                 if extract_images:
-                    _logger.debug(f"found {len(page.images)} images on page {page.page_number+1}")
-                    for i, image_object in enumerate(page.images):
-                        ext = image_object.name.split(".")[-1]
-                        fp = image_file_template.format(dir=str(file.path.parent) + os.sep, name=file.path.stem, p=page.page_number+1,
-                                                        i=i+1, img=image_object.name, ext=ext)
-                        image_object.image.save(fp)
-                        _logger.info(f"wrote image {i+1} on page {page.page_number+1} to file {repr(fp)}")
+                    image_keys = page.images.keys()
+                    _logger.debug(f"found {len(image_keys)} images on page {index+1}")
+                    for i, key in enumerate(image_keys):
+                        digest = image_digest(digester, page, key) if args.dedup_images else None
+                        if digest in stored_images:
+                            fp = stored_images[digest]
+                            _logger.debug(f"image {i+1} on page {index+1} is a duplicate of {repr(fp)}")
+                        else:
+                            image_object = page.images[key]
+                            ext = image_object.name.split(".")[-1]
+                            fp = image_file_template.format(**(file.template_fields() | {"ext": ext}),
+                                                            p=index+1, i=i+1, img=image_object.name,
+                                                            shard=args.shard and args.shard[0])
+                            image_object.image.save(fp)
+                            Progress.count_written(fp)
+                            _logger.info(f"wrote image {i+1} on page {index+1} to file {repr(fp)}")
+                            if digest:
+                                stored_images[digest] = fp
+                        page_images.append({"page": index+1, "index": i+1, "file": fp, "digest": digest})
+                if args.dedup_images:
+                    manifest.extend(page_images)
+                if checkpoint:
+                    if text_file_stream:
+                        text_file_stream.flush()
+                    checkpoint.record(index, text_size=text_file_stream and text_file_stream.tell(),
+                                      images=page_images)
+
             if extract_text:
-                print(text, file=text_file_stream)
+                # the text of all the shards concatenated must equal the text of the whole document
+                if not args.shard or args.shard[0] == args.shard[1]:
+                    text_file_stream.write('\n')
+                text_file_stream.flush()
+            if checkpoint:
+                checkpoint.sync()
+            if args.dedup_images:
+                manifest_file = (args.image_manifest or "{dir}{name}-images.json").format(
+                    **file.template_fields(), shard=args.shard and args.shard[0])
+                with open(manifest_file, 'w') as f:
+                    json.dump(manifest, f, indent=2)
+                _logger.info(f"wrote {util.pluralize(len(stored_images), 'unique image')} "
+                             f"({util.pluralize(len(manifest), 'occurrence')}); manifest written to "
+                             f"{repr(manifest_file)}")
         if extract_text:
-            text_file_stream.close()
             _logger.info(f"wrote extracted text to {repr(text_file)}")
+    except CheckpointMismatchException as e:
+        _logger.err(e.args[0])
+        return False
     except PdfReadError as e:
         _logger.err(f"{repr(filename)}: {e.args[0]}")
         return False
@@ -186,53 +397,130 @@ def edit(args: argparse.Namespace) -> bool:
         _logger.err(e.args[0])
         return False
 
-    output_file = filename if args.output_file == '-' else args.output_file
+    output_file = args.output_file or filename
     blank_pages = PageSelector.parse(args.add_blank) if args.add_blank else None
+    if args.booklet and args.nup not in (None, 2):
+        _logger.err(f"a booklet has 2 pages per sheet, not {args.nup}")
+        return False
+
+    stamp_file = None
+    if args.stamp:
+        try:
+            (stamp_filename, stamp_selector, stamp_password) = parse_file_specifier(args.stamp)
+        except FileNotFoundError as e:
+            _logger.err(e.args[0])
+            return False
+        if stamp_filename == STDIO and filename == STDIO:
+            _logger.err("the input file and the stamp can't both be read from the standard input")
+            return False
+        stamp_file = PdfFile(stamp_filename, PageSelector.parse(stamp_selector) if stamp_selector else None,
+                             stamp_password)
 
     try:
         if args.select: page_selector = PageSelector.parse(args.select)
         # open in file
         file = PdfFile(filename, page_selector, args.decrypt_password or password)
         # open out file
-        out = PdfFile(output_file, source_file=file)
+        out = PdfFile(output_file, source_file=file, streaming=args.streaming, linearize=args.linearize,
+                      prune=args.prune)
 
         # open writer
-        with file.get_reader(), out.get_writer() as writer:
-            for page in file.get_pages():
-                # copy every page
-                if args.reverse:
-                    writer.insert_page(page, 0)
-                else:
-                    writer.add_page(page)
-
+        with ExitStack() as stack:
+            reader = stack.enter_context(file.get_reader())
+            page_stamp = None
+            if stamp_file is not None:
+                stack.enter_context(stamp_file.get_reader())
+                stamp_page = next(stamp_file.get_pages(), None)
+                if stamp_page is None:
+                    _logger.err(f"no page of the stamp file {repr(stamp_file.name)} is selected")
+                    return False
+                try:
+                    page_stamp = Stamp(stamp_page, args.stamp_position, args.stamp_opacity, args.stamp_scale)
+                except ValueError as e:
+                    _logger.err(e.args[0])
+                    return False
+            # the output pages are worked out first, so that imposition can reorder them
+            indices = file.get_page_indices()
+            if args.drop_blank:
+                with Progress("blank", total=len(indices)) as blank_progress:
+                    blank = set(find_blank_pages(file, indices, args.blank_threshold / 100, args.jobs, blank_progress))
+                indices = [i for i in indices if i not in blank]
+                _logger.info(f"dropped {util.pluralize(len(blank), 'blank page')}")
+            if args.drop_duplicates:
+                with Progress("digest", total=len(indices)) as digest_progress:
+                    duplicates = find_duplicates(page_digests(file, indices, args.jobs, digest_progress))
+                dropped = {i for group in duplicates.values() for i in group}
+                indices = [i for i in indices if i not in dropped]
+                _logger.info(f"dropped {util.pluralize(len(dropped), 'duplicate page')}")
+            sequence: list[Optional[int]] = list(reversed(indices) if args.reverse else indices)
             if blank_pages:
-                bs = blank_pages.bake(file)
-                for idx in bs:
-                    out.insert_blank_page(idx)
+                for idx in blank_pages.bake(file):
+                    sequence.insert(idx, None)
 
-            page_count = file.get_page_count()
+            page_count = len(sequence)
             if args.pad_to:
                 if args.pad_to <= page_count:
                     _logger.warn(f"file has {util.pluralize(page_count, 'page')}, "
                                  f"which is <= --pad-to {args.pad_to}")
                 else:
-                    out.pad_pages(args.pad_to, args.pad_where)
+                    sequence = _pad_sequence(sequence, args.pad_to, args.pad_where)
             elif (args.pad_to_odd and page_count % 2 == 0) or (args.pad_to_even and page_count % 2 == 1):
-                out.pad_pages(page_count + 1, args.pad_where)
+                sequence = _pad_sequence(sequence, page_count + 1, args.pad_where)
+            if args.booklet:
+                # a booklet is folded from sheets of 4 pages
+                sequence = _pad_sequence(sequence, -(-len(sequence) // 4) * 4, args.pad_where)
+                sequence = [sequence[i] for i in booklet_order(len(sequence))]
+
+            first = next((i for i in sequence if i is not None), None)
+            nup = args.nup or (2 if args.booklet else None)
+            if nup and first is None:
+                _logger.err("no pages to impose")
+                return False
+            units = [sequence[i:i + nup] for i in range(0, len(sequence), nup)] if nup else sequence
+            page_count = len(units)
+            progress = stack.enter_context(Progress("edit", total=len(units)))
+            writer = stack.enter_context(out.get_writer())
+
+            # before any page, a streaming writer encrypts the pages as they're written
+            if args.encrypt or args.encrypt_password or args.encrypt_owner_password:
+                out.encrypt(args.encrypt_owner_password, args.encrypt_password, args.encrypt_algorithm)
+            if page_stamp is not None:
+                page_stamp.add_to(writer)
+
+            if nup:
+                imposer = Imposer(writer, nup, reader.get_page(first))
+                for unit in progress.track(units):
+                    sheet = imposer.sheet([reader.get_page(i) if i is not None else None for i in unit])
+                    # the stamp goes on the output pages, which are the sheets
+                    writer.add_page(page_stamp.stamp(sheet) if page_stamp is not None else sheet)
+            else:
+                size = None
+                for i in progress.track(sequence):
+                    if i is not None:
+                        page = reader.get_page(i)
+                        size = (page.mediabox.width, page.mediabox.height)
+                        writer.add_page(page_stamp.stamp(page) if page_stamp is not None else page)
+                        continue
+                    if size is None:
+                        # blank pages take the size of the page before them; leading ones that of the first page
+                        box = reader.get_page(first if first is not None else 0).mediabox
+                        size = (box.width, box.height)
+                    writer.add_blank_page(*size)
 
             if args.copy_metadata:
                 out.copy_metadata_from_owner()
-            if args.encrypt or args.encrypt_password or args.encrypt_owner_password:
-                out.encrypt(args.encrypt_owner_password, args.encrypt_password)
 
-        if file.path == out.path:
+        if args.output_file is None:
             _logger.info(f"edited file {repr(filename)} ({util.pluralize(page_count, 'page')})")
         else:
-            _logger.info(f"copied {repr(filename)} to {repr(str(out.path))} "
+            _logger.info(f"copied {repr(filename)} to {repr(out.name)} "
                          '(' + util.pluralize(page_count, 'page') + ')')
 
         if args.preview:
-            util.open_file_with_default_program(out.path)
+            if out.path is None:
+                _logger.warn("can't preview a file written to the standard output")
+            else:
+                util.open_file_with_default_program(out.path)
     except WrongPasswordError as e:
         _logger.err(f"{repr(filename)}: {e.args[0]} (password provided: {repr(password)})")
         return False
@@ -245,6 +533,33 @@ def edit(args: argparse.Namespace) -> bool:
     return True
 
 
+def _pad_sequence(sequence: list[Optional[int]], to: int, where: str) -> list[Optional[int]]:
+    """Add blank pages (`None`) to the `start` or the `end` of a page sequence until it has `to` pages."""
+
+    blank: list[Optional[int]] = [None] * max(to - len(sequence), 0)
+    return blank + sequence if where == 'start' else sequence + blank
+
+
+@contextmanager
+def _encryption_context(args: argparse.Namespace, file: PdfFile,
+                        outputs: str) -> Generator[Optional[EncryptionContext], None, None]:
+    """
+    Create the encryption context shared by all output files of a command. Prompts for the owner password here, once,
+    if it's needed and wasn't provided. Yields `None` if the output files shouldn't be encrypted.
+    :param file: The input file, whose password the output files get with `--copy-password`.
+    :param outputs: What the output files are, for the password prompt, e.g. "files split from 'a.pdf'".
+    """
+
+    if not (args.encrypt or args.encrypt_password or args.encrypt_owner_password):
+        yield None
+        return
+
+    owner_password = args.encrypt_owner_password or read_owner_password(outputs)
+    password = args.encrypt_password or (file.password if args.copy_password else None)
+    with EncryptionContext(owner_password, password, args.encrypt_algorithm) as context:
+        yield context
+
+
 @command
 def split(args: argparse.Namespace) -> bool:
     if len(args.select) <= 1:
@@ -257,31 +572,36 @@ def split(args: argparse.Namespace) -> bool:
         _logger.err(e.args[0])
         return False
 
-    fp = Path(filename)
     template = args.output_file_template
 
     try:
         # input file
         file = PdfFile(filename, page_spec, args.decrypt_password or password)
-        with file.get_reader():
-            for i in range(len(args.select)):
-                selector = PageSelector.parse(args.select[i])
-                ofp = template.format(dir=str(fp.parent) + os.sep, name=fp.stem, ext=fp.suffix,
-                                                        i=i+1)
+        with file.get_reader(), _encryption_context(args, file, f"files split from {repr(file.name)}") as encryption, \
+                ExitStack() as stack:
+            selects = list(enumerate(args.select))
+            if args.shard:
+                selects = util.shard(selects, *args.shard)
+                _logger.info(f"shard {args.shard[0]}/{args.shard[1]}: {util.pluralize(len(selects), 'output file')}")
+            selected = [(i, file.get_page_indices(PageSelector.parse(select))) for i, select in selects]
+            progress = stack.enter_context(Progress("split", total=sum(len(indices) for _, indices in selected)))
+            for i, indices in selected:
+                ofp = template.format(**file.template_fields(), i=i+1)
                 # output file
-                outfile = PdfFile(ofp, source_file=file)
+                outfile = PdfFile(ofp, source_file=file, streaming=args.streaming, linearize=args.linearize,
+                                  prune=args.prune)
 
                 with outfile.get_writer() as writer:
+                    if encryption:
+                        outfile.apply_encryption(encryption)
                     # copy selected pages
-                    for page in file.get_pages(selector):
+                    for page in progress.track(file.get_pages(indices=indices)):
                         writer.add_page(page)
 
                     if args.copy_metadata:
                         outfile.copy_metadata_from_owner()
-                    if args.encrypt or args.encrypt_password or args.encrypt_owner_password:
-                        outfile.encrypt(args.encrypt_owner_password, args.encrypt_password)
 
-                _logger.info(f"wrote to {repr(str(outfile.path))}")
+                _logger.info(f"wrote to {repr(outfile.name)}")
     except WrongPasswordError as e:
         _logger.err(f"{repr(filename)}: {e.args[0]} (password provided: {repr(password)})")
         return False
@@ -312,33 +632,30 @@ def explode(args: argparse.Namespace) -> bool:
 
     try:
         file = PdfFile(filename, args.select or page_selector, args.decrypt_password or password)
-        with (file.get_reader()):
-            file_count = file.get_page_count() // count
-            outfiles: list[PdfFile] = []
-            page_limit = file_count * count
-
-            # create files
-            for i in range(file_count):
-                fp = template.format(dir=str(file.path.parent) + os.sep, name=file.path.stem, ext=file.path.suffix, i=i+1)
-                outfiles.append(PdfFile(fp, source_file=file))
-
-            # write pages to file
-            file_idx = 0
-            for i, page in enumerate(file.get_pages()):
-                outfiles[file_idx % file_count].get_writer_unsafe().add_page(page)
-                if (i+1) % count == 0:
-                    file_idx += 1
-                if i+1 >= page_limit:
-                    break
-
-            # close file writers
-            for out in outfiles:
-                if args.copy_metadata:
-                    out.copy_metadata_from_owner()
-                if args.encrypt or args.encrypt_password or args.encrypt_owner_password:
-                    out.encrypt(args.encrypt_owner_password, args.encrypt_password)
-
-                out.close_writer()
+        with file.get_reader(), _encryption_context(args, file, f"files exploded from {repr(file.name)}") as \
+                encryption, ExitStack() as stack:
+            indices = file.get_page_indices()
+            # pages that wouldn't fill a whole file are left out
+            groups = [(i, indices[i*count:(i+1)*count]) for i in range(len(indices) // count)]
+            if args.shard:
+                groups = util.shard(groups, *args.shard)
+                _logger.info(f"shard {args.shard[0]}/{args.shard[1]}: {util.pluralize(len(groups), 'output file')}")
+
+            progress = stack.enter_context(Progress("explode", total=len(groups) * count))
+            for i, group in groups:
+                fp = template.format(**file.template_fields(), i=i+1)
+                out = PdfFile(fp, source_file=file, streaming=args.streaming, linearize=args.linearize,
+                              prune=args.prune)
+                with out.get_writer() as writer:
+                    if encryption:
+                        out.apply_encryption(encryption)
+                    for page in progress.track(file.get_pages(indices=group)):
+                        writer.add_page(page)
+
+                    if args.copy_metadata:
+                        out.copy_metadata_from_owner()
+
+                _logger.info(f"wrote to {repr(out.name)}")
     except WrongPasswordError as e:
         _logger.err(f"{repr(filename)}: {e.args[0]} (password provided: {repr(password)})")
         return False
@@ -354,30 +671,248 @@ def explode(args: argparse.Namespace) -> bool:
 
 @command
 def merge(args: argparse.Namespace) -> bool:
-    if len(args.file) < 1:
+    try:
+        fsps = expand_file_specifiers(args.file)
+    except FileNotFoundError as e:
+        _logger.err(e.args[0])
+        return False
+
+    if len(fsps) < 1:
         _logger.err("need more than one input file")
         return False
-    elif len(args.file) == 1:
+    elif len(fsps) == 1:
         _logger.warn("only one file provided; this action will only create one file which is more idiomatically "
                      "achieved with the `copy` command")
+    if sum(path == STDIO for path, _, _ in fsps) > 1:
+        _logger.err("the standard input can only be read once")
+        return False
+
+    # the pages serialized by the worker processes are copied to a streaming writer as they are (unless the output is
+    # linearized, which needs them parsed)
+    outfile = PdfFile(args.output_file, source_file=None, streaming=args.streaming or bool(args.jobs),
+                      linearize=args.linearize, prune=args.prune)
+
+    try:
+        with Progress("merge", total=len(fsps), unit='file') as progress, outfile.get_writer():
+            if args.jobs:
+                # worker processes can't read the standard input
+                items = [(sys.stdin.buffer.read() if path == STDIO else path, selector,
+                          password or args.decrypt_password, args.prune) for path, selector, password in fsps]
+                with ProcessPoolExecutor(args.jobs, initializer=Config.restore, initargs=(Config.dump(),)) as executor:
+                    asyncio.run(_merge_pipelined(outfile, executor, _merge_serialize, items,
+                                                 args.prefetch or 2 * args.jobs, progress, _merge_append_fragment))
+            elif args.prefetch:
+                # prefetched inputs are opened in worker threads, which mustn't prompt for passwords
+                files = [PdfFile(path, selector, password or args.decrypt_password, interactive=False)
+                         for path, selector, password in fsps]
+                with ThreadPoolExecutor(args.prefetch, thread_name_prefix="merge") as executor:
+                    asyncio.run(_merge_pipelined(outfile, executor, _merge_load, files, args.prefetch, progress))
+            else:
+                for path, selector, password in progress.track(fsps):
+                    file = PdfFile(path, selector, password or args.decrypt_password)
+                    with file.get_reader():
+                        _merge_append(outfile, file)
+    except WrongPasswordError as e:
+        _logger.err(f"{e.args[0]} (password provided)")
+        return False
+    except FileNotDecryptedError as e:
+        _logger.err(f"{e.args[0]} (no password provided)")
+        return False
+    except PdfReadError as e:
+        _logger.err(e.args[0])
+        return False
+
+    return True
+
+
+def _merge_append(outfile: PdfFile, file: PdfFile) -> None:
+    """Append the selected pages of `file` (its reader has to be open) to `outfile`."""
+
+    writer = outfile.get_writer_unsafe()
+    pages_written = 0
+    for page in file.get_pages():
+        writer.add_page(page)
+        pages_written += 1
+    _logger.info(f"wrote {util.pluralize(pages_written, 'page')} from {repr(file.name)} to {repr(outfile.name)}")
+
+
+def _merge_load(file: PdfFile) -> PdfFile:
+    """Read, parse and decrypt a merge input and flatten its page tree. Runs in a worker thread."""
+
+    try:
+        file.get_reader_unsafe()
+        file.get_page_count()
+    except PdfReadError as e:
+        raise type(e)(f"{repr(file.name)}: {e.args[0]}") from e
+    return file
+
+
+def _merge_append_loaded(outfile: PdfFile, file: PdfFile) -> None:
+    """Append a file loaded by `_merge_load()` to `outfile` and close its reader."""
+
+    try:
+        _merge_append(outfile, file)
+    finally:
+        file.close_reader()
+
+
+def _merge_serialize(source: str | bytes, selector: Optional[str], password: Optional[str],
+                     prune: bool) -> tuple[str, Fragment]:
+    """
+    Read, parse and decrypt a merge input and serialize its selected pages into a `Fragment`, so that the parent
+    process only has to copy them. Runs in a worker process.
+    :param prune: Prune the resources of the pages (see `prune.ResourcePruner`).
+    :return: The name of the input and the fragment.
+    """
+
+    file = PdfFile(source, selector, password, interactive=False)
+    name = STDIO if isinstance(source, bytes) else source
+    writer = StreamingPdfWriter(None, prune=prune)
+    try:
+        with file.get_reader():
+            for page in file.get_pages():
+                writer.add_page(page)
+    except PdfReadError as e:
+        raise type(e)(f"{repr(name)}: {e.args[0]}") from e
+    writer.write()
+    return name, writer.fragment
+
+
+def _merge_append_fragment(outfile: PdfFile, serialized: tuple[str, Fragment]) -> None:
+    """Append the pages serialized by `_merge_serialize()` to `outfile`."""
+
+    name, fragment = serialized
+    writer = outfile.get_writer_unsafe()
+    if isinstance(writer, StreamingPdfWriter):
+        writer.add_fragment(fragment)
+        _logger.info(f"wrote {util.pluralize(len(fragment.pages), 'page')} from {repr(name)} to "
+                     f"{repr(outfile.name)}")
+        return
+    # a linearized output is written from parsed pages
+    buffer = BytesIO()
+    stitched = StreamingPdfWriter(buffer)
+    stitched.add_fragment(fragment)
+    stitched.write()
+    file = PdfFile(buffer.getvalue())
+    file.name = name
+    with file.get_reader():
+        _merge_append(outfile, file)
+
+
+async def _merge_pipelined(outfile: PdfFile, executor: Executor, load: Callable[..., Any], items: list[Any],
+                           depth: int, progress: Progress,
+                           append: Callable[[PdfFile, Any], None] = _merge_append_loaded) -> None:
+    """
+    Append merge inputs to `outfile` in order. The inputs are loaded by calling `load` with each item (unpacked, if
+    it's a tuple) in `executor`, up to `depth` inputs ahead of the one being appended.
+    :param append: Appends what `load` returns to `outfile`.
+    """
+
+    loop = asyncio.get_running_loop()
+    upcoming = iter(items)
+    pending: deque[asyncio.Future] = deque()
+
+    def schedule_next() -> None:
+        item = next(upcoming, None)
+        if item is not None:
+            pending.append(loop.run_in_executor(executor, load, *(item if isinstance(item, tuple) else (item,))))
+
+    try:
+        for _ in range(depth):
+            schedule_next()
+        while pending:
+            loaded = await pending.popleft()
+            schedule_next()
+            append(outfile, loaded)
+            progress.advance()
+    finally:
+        for future in pending:
+            future.cancel()
 
+
+@command
+def dedupe(args: argparse.Namespace) -> bool:
     try:
-        fsps: list[tuple[str, Optional[str], Optional[str]]] = list(map(parse_file_specifier, args.file))
+        (filename, page_selector, password) = parse_file_specifier(args.file)
     except FileNotFoundError as e:
         _logger.err(e.args[0])
         return False
 
-    outfile = PdfFile(args.output_file, source_file=None)
+    try:
+        file = PdfFile(filename, PageSelector.parse(page_selector) if page_selector else None,
+                       args.decrypt_password or password)
+        with file.get_reader():
+            indices = file.get_page_indices()
+            with Progress("digest", total=len(indices)) as progress:
+                duplicates = find_duplicates(page_digests(file, indices, args.jobs, progress))
+    except PdfReadError as e:
+        _logger.err(f"{repr(filename)}: {e.args[0]}")
+        return False
+
+    groups = [[first + 1] + [i + 1 for i in others] for first, others in duplicates.items()]
+    if args.json:
+        print(json.dumps(groups))
+    else:
+        for group in groups:
+            print(f"page {group[0]} is repeated as {', '.join(map(str, group[1:]))}")
+    repeats = sum(len(group) - 1 for group in groups)
+    _logger.info(f"{repr(file.name)}: {util.pluralize(repeats, 'duplicate page')} "
+                 f"of {util.pluralize(len(indices), 'page')}")
+    return True
+
+
+@command
+def unshard(args: argparse.Namespace) -> bool:
+    paths = [args.template.format(shard=k) for k in range(1, args.shards + 1)]
+    for path in paths:
+        if not Path(path).is_file():
+            _logger.err(f"output of shard {paths.index(path) + 1}/{args.shards} ({repr(path)}) not found")
+            return False
 
-    with outfile.get_writer() as writer:
-        for fsp in fsps:
-            file = PdfFile(fsp[0], selector=fsp[1], password=fsp[2] or args.decrypt_password)
-            pages_written = 0
-            with file.get_reader():
-                for page in file.get_pages():
-                    writer.add_page(page)
-                    pages_written += 1
-            _logger.info(f"wrote {util.pluralize(pages_written, 'page')} from {repr(str(file.path))} to " +
-                         repr(str(outfile.path)))
+    output = Path(args.output_file)
+    if output.suffix.lower() == '.pdf':
+        outfile = PdfFile(output)
+        try:
+            with outfile.get_writer():
+                for path in paths:
+                    file = PdfFile(path)
+                    with file.get_reader():
+                        _merge_append(outfile, file)
+        except PdfReadError as e:
+            _logger.err(e.args[0])
+            return False
+    elif output.suffix.lower() == '.json':
+        # image manifests
+        combined = []
+        for path in paths:
+            with open(path) as f:
+                combined.extend(json.load(f))
+        with open(output, 'w') as f:
+            json.dump(combined, f, indent=2)
+    else:
+        with open(output, 'wb') as out:
+            for path in paths:
+                with open(path, 'rb') as f:
+                    shutil.copyfileobj(f, out)
 
+    _logger.info(f"concatenated {util.pluralize(len(paths), 'shard output')} into {repr(str(output))}")
     return True
+
+
+@command
+def watch(args: argparse.Namespace) -> bool:
+    directory = Path(args.directory)
+    if not directory.is_dir():
+        _logger.err(f"{repr(args.directory)} isn't a directory")
+        return False
+    try:
+        argv = parse_command(args.run)
+    except ValueError as e:
+        _logger.err(e.args[0])
+        return False
+
+    status_log = Path(args.status_log) if args.status_log else directory / ".aidapdf-watch.jsonl"
+    watcher = Watcher(directory, argv, status_log, args.pattern, args.jobs, args.retries, args.retry_delay,
+                      args.settle, args.interval, args.once)
+    watcher.run()
+    return watcher.failed == 0
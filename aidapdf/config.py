@@ -1,7 +1,7 @@
 import argparse
 import platform
 import sys
-from typing import Optional, Literal
+from typing import Optional, Literal, Any
 
 import colors
 
@@ -15,6 +15,13 @@ class Config:
     DEBUG_SHOWN = False
 
     RAW_FILENAMES = False
+
+    INDEX = False
+    CACHE = False
+    CACHE_DIR: Optional[str] = None
+
+    PROGRESS: Optional[Literal["bar", "json"]] = None
+    PROGRESS_FILE = '-'
     PLATFORM: Optional[Literal["macOS", "Windows"]] = None
 
     @staticmethod
@@ -37,12 +44,32 @@ class Config:
 
         Config.COLOR = args.color
         Config.RAW_FILENAMES = args.raw_filenames
+        Config.INDEX = args.index
+        Config.CACHE = args.cache
+        Config.CACHE_DIR = args.cache_dir
+
+        if args.progress_json:
+            Config.PROGRESS = "json"
+            Config.PROGRESS_FILE = args.progress_json
+        elif args.progress:
+            Config.PROGRESS = "bar"
 
         if "verbosity_level" in args and args.verbosity_level is not None:
             Config.VERBOSITY_LEVEL = args.verbosity_level
             if Config.VERBOSITY_LEVEL >= 3:
                 Config.DEBUG_SHOWN = True
 
+    @staticmethod
+    def dump() -> dict[str, Any]:
+        """Return the current configuration as a picklable dict. Used to initialize worker processes."""
+        return {k: v for k, v in vars(Config).items() if k.isupper()}
+
+    @staticmethod
+    def restore(values: dict[str, Any]) -> None:
+        """Restore a configuration produced by `Config.dump()`."""
+        for k, v in values.items():
+            setattr(Config, k, v)
+
     @staticmethod
     def to_str() -> str:
         return (f"config.platform = {repr(Config.PLATFORM or 'other')}, config.color = {Config.COLOR}, "
@@ -0,0 +1,67 @@
+import hashlib
+from typing import Callable, Optional
+
+from pypdf import PageObject
+from pypdf.generic import ArrayObject
+
+from aidapdf.digest import ObjectDigester
+from aidapdf.file import PdfFile
+from aidapdf.log import Logger
+from aidapdf.pagemap import map_pages
+from aidapdf.progress import Progress
+
+
+_logger = Logger(__name__)
+
+
+DIGEST_VERSION = 1
+"""Version of `page_digest()`. Cached digests of other versions are ignored."""
+
+
+def page_digest(digester: ObjectDigester, page: PageObject) -> str:
+    """
+    Return the hex digest of what a page shows: its decoded content, the digests of its resources (through `digester`,
+    so resources shared between pages are only hashed once) and its visible area. Pages with equal digests look the
+    same, even if their content streams are compressed differently or split in other places.
+    """
+
+    h = hashlib.sha256()
+    h.update(repr([float(x) for x in page.cropbox]).encode())
+    h.update(str(page.rotation % 360).encode())
+    if "/Contents" in page:
+        contents = page.raw_get("/Contents").get_object()
+        for stream in contents if isinstance(contents, ArrayObject) else [contents]:
+            h.update(stream.get_object().get_data())
+    h.update(b"/Resources")
+    if "/Resources" in page:
+        h.update(bytes.fromhex(digester.digest(page.raw_get("/Resources"))))
+    return h.hexdigest()
+
+
+def _make_digest() -> Callable[[PageObject], str]:
+    digester = ObjectDigester()
+    return lambda page: page_digest(digester, page)
+
+
+def page_digests(file: PdfFile, indices: list[int], jobs: Optional[int] = None,
+                 progress: Optional[Progress] = None) -> dict[int, str]:
+    """
+    Return the digests of the pages `indices` of `file`, by index. The reader has to be open. Large files are digested
+    by a process pool; with `Config.CACHE`, the digests are kept in a sidecar (see `map_pages()`).
+    :param jobs: Number of worker processes. Defaults to the number of CPUs.
+    :param progress: Advanced for every page digested.
+    """
+
+    return map_pages(file, indices, _make_digest, 'digests', DIGEST_VERSION, jobs, progress)
+
+
+def find_duplicates(digests: dict[int, str]) -> dict[int, list[int]]:
+    """
+    Group pages with equal digests. Returns the other pages of every group by its first page, for groups of more than
+    one page. Pages are ordered as in `digests`.
+    """
+
+    groups: dict[str, list[int]] = {}
+    for i, digest in digests.items():
+        groups.setdefault(digest, []).append(i)
+    return {group[0]: group[1:] for group in groups.values() if len(group) > 1}
@@ -0,0 +1,75 @@
+import hashlib
+from typing import Optional
+
+from pypdf import PageObject
+from pypdf.generic import PdfObject, IndirectObject, StreamObject, DictionaryObject, ArrayObject
+
+from aidapdf.log import Logger
+
+
+_logger = Logger(__name__)
+
+
+class ObjectDigester:
+    """
+    Computes content digests of PDF objects. Streams are hashed in their raw (still encoded) form, so nothing gets
+    decoded. Digests of indirect objects are cached by their reference, so objects shared between pages (logos, fonts)
+    are only hashed once per digester.
+    """
+
+    def __init__(self):
+        self._cache: dict[tuple[int, int], bytes] = {}
+
+    def digest(self, obj: PdfObject) -> str:
+        """Return the hex digest of `obj`."""
+        return self._digest(obj, ()).hex()
+
+    def _digest(self, obj: PdfObject, stack: tuple[tuple[int, int], ...]) -> bytes:
+        if isinstance(obj, IndirectObject):
+            ref = (obj.idnum, obj.generation)
+            if ref in self._cache:
+                return self._cache[ref]
+            if ref in stack:
+                # a reference cycle (e.g. an annotation pointing back to its page); the reference itself will do
+                return f"R{ref}".encode()
+            value = self._digest(obj.get_object(), stack + (ref,))
+            self._cache[ref] = value
+            return value
+
+        h = hashlib.sha256()
+        if isinstance(obj, DictionaryObject):
+            h.update(b"<<")
+            for k in sorted(obj.keys()):
+                # the length of the raw data is part of the data itself; /Parent only points back up the page tree
+                if k in ("/Length", "/Parent"):
+                    continue
+                h.update(k.encode())
+                h.update(self._digest(obj.raw_get(k), stack))
+            h.update(b">>")
+            if isinstance(obj, StreamObject):
+                h.update(obj._data)
+        elif isinstance(obj, ArrayObject):
+            h.update(b"[")
+            for x in obj:
+                h.update(self._digest(x, stack))
+            h.update(b"]")
+        else:
+            h.update(type(obj).__name__.encode())
+            h.update(repr(obj).encode())
+        return h.digest()
+
+
+def image_digest(digester: ObjectDigester, page: PageObject, key: str | list[str]) -> Optional[str]:
+    """
+    Return the digest of the raw data and the dictionary of the image `key` on the page. Images with equal digests
+    decode to the same picture. Returns `None` for inline images.
+    """
+
+    path = [key] if isinstance(key, str) else list(key)
+    if path[-1].startswith('~'):
+        return None
+    # hash through the reference where there is one, so that the digest is cached
+    obj = page
+    for name in path[:-1]:
+        obj = obj["/Resources"]["/XObject"][name]
+    return digester.digest(obj["/Resources"]["/XObject"].raw_get(path[-1]))
@@ -0,0 +1,150 @@
+import re
+from typing import Any, Callable, Optional, TYPE_CHECKING
+
+from pypdf import PageObject
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject
+
+from aidapdf.log import Logger
+from aidapdf.pagemap import map_pages
+from aidapdf.progress import Progress
+
+
+_logger = Logger(__name__)
+
+if TYPE_CHECKING:
+    from aidapdf.file import PdfFile
+
+
+FEATURES_VERSION = 1
+"""Version of `page_features()`. Cached features of other versions are ignored."""
+
+# an operator is delimited by whitespace or by the end of the operand before it
+_OP = rb"(?:(?<=[\s\]\)>])|^)(%s)(?=[\s\[\(<\/]|$)"
+_PAINT_OPS = re.compile(_OP % rb"S|s|f\*?|F|B\*?|b\*?|sh|Do|Tj|TJ|'|\"|BI")
+_DO = re.compile(rb"/([^\s/\[\]()<>{}%]+)\s+Do(?=[\s\[\(<\/]|$)")
+
+TEXT_OPS = frozenset({b"Tj", b"TJ", b"'", b'"'})
+"""Operators that show text."""
+IMAGE_OPS = frozenset({b"Do", b"BI"})
+"""Operators that draw XObjects (images or forms) and inline images."""
+
+PAPER_SIZES = {
+    "a3": (842, 1191),
+    "a4": (595, 842),
+    "a5": (420, 595),
+    "letter": (612, 792),
+    "legal": (612, 1008),
+}
+"""Paper sizes the selector conditions know, in points, portrait."""
+
+_SIZE_TOLERANCE = 3
+
+
+def page_content(page: PageObject) -> bytes:
+    """Return the decoded content of a page, its content streams joined."""
+
+    if "/Contents" not in page:
+        return b""
+    contents = page.raw_get("/Contents").get_object()
+    streams = contents if isinstance(contents, ArrayObject) else [contents]
+    return b"\n".join(stream.get_object().get_data() for stream in streams)
+
+
+def painting_operators(content: bytes) -> set[bytes]:
+    """Return the operators in `content` that paint something: paths, text, XObjects and inline images."""
+    return set(_PAINT_OPS.findall(content))
+
+
+def drawn_xobjects(content: bytes) -> set[str]:
+    """Return the names of the XObjects `content` draws."""
+    return {"/" + name.decode('latin-1') for name in _DO.findall(content)}
+
+
+def _xobject_features(resources: Optional[DictionaryObject], names: set[str],
+                      seen: set[tuple[int, int]]) -> tuple[int, bool]:
+    """Return the number of images among the XObjects `names` and whether their forms have fonts, recursively."""
+
+    xobjects = resources.get("/XObject") if resources is not None else None
+    if xobjects is None:
+        return 0, False
+    images, text = 0, False
+    for name in names:
+        if name not in xobjects:
+            continue
+        raw = xobjects.raw_get(name)
+        if isinstance(raw, IndirectObject):
+            if (raw.idnum, raw.generation) in seen:
+                continue
+            seen.add((raw.idnum, raw.generation))
+        xobject = raw.get_object()
+        if xobject.get("/Subtype") == "/Image":
+            images += 1
+        elif xobject.get("/Subtype") == "/Form":
+            form_resources = xobject.get("/Resources")
+            text = text or (form_resources is not None and bool(form_resources.get("/Font")))
+            form_images, form_text = _xobject_features(form_resources, drawn_xobjects(xobject.get_data()), seen)
+            images += form_images
+            text = text or form_text
+    return images, text
+
+
+def page_features(page: PageObject) -> dict[str, Any]:
+    """
+    Return the features of a page that page selector conditions look at: its size (of the media box) and rotation, the
+    length of its decoded content, the number of images it draws and of fonts it has, whether it paints anything at
+    all and whether it shows text.
+    """
+
+    content = page_content(page)
+    found = _PAINT_OPS.findall(content)
+    ops = set(found)
+    resources = page.get("/Resources")
+    images, form_text = _xobject_features(resources, drawn_xobjects(content), set())
+    fonts = resources.get("/Font") if resources is not None else None
+    return {
+        "width": float(page.mediabox.width),
+        "height": float(page.mediabox.height),
+        "rotation": page.rotation % 360,
+        "content_length": len(content),
+        "images": images + found.count(b"BI"),
+        "fonts": len(fonts) if fonts is not None else 0,
+        "paints": bool(ops),
+        "text": form_text or bool(ops & TEXT_OPS),
+    }
+
+
+def blank_features(width: float, height: float) -> dict[str, Any]:
+    """Return the features of a blank page of the given size."""
+    return {"width": width, "height": height, "rotation": 0, "content_length": 0, "images": 0, "fonts": 0,
+            "paints": False, "text": False}
+
+
+def shown_size(features: dict[str, Any]) -> tuple[float, float]:
+    """Return the width and height of a page as it's displayed."""
+
+    if features["rotation"] % 180:
+        return features["height"], features["width"]
+    return features["width"], features["height"]
+
+
+def is_paper_size(features: dict[str, Any], paper: str) -> bool:
+    """Return whether a page has the paper size `paper` (one of `PAPER_SIZES`), in either orientation."""
+
+    size = sorted((features["width"], features["height"]))
+    return all(abs(a - b) <= _SIZE_TOLERANCE for a, b in zip(size, PAPER_SIZES[paper]))
+
+
+def _make_features() -> Callable[[PageObject], dict[str, Any]]:
+    return page_features
+
+
+def feature_index(file: 'PdfFile', jobs: Optional[int] = None) -> dict[int, dict[str, Any]]:
+    """
+    Return the features of every page of `file`, by index. The reader has to be open. Large files are read by a
+    process pool; with `Config.CACHE`, the index is kept in a sidecar (see `map_pages()`).
+    :param jobs: Number of worker processes. Defaults to the number of CPUs.
+    """
+
+    indices = list(range(file.get_page_count()))
+    with Progress("features", total=len(indices)) as progress:
+        return map_pages(file, indices, _make_features, 'features', FEATURES_VERSION, jobs, progress)
@@ -1,18 +1,32 @@
 from datetime import datetime
+import glob
+import os
+from io import BytesIO
+import secrets
 import sys
+from concurrent.futures import ThreadPoolExecutor, Future
 from contextlib import contextmanager
 from os import path, PathLike
 from pathlib import Path
-from typing import Iterator, Generator, Any, Optional, Literal
+from typing import Iterator, Generator, Any, Optional, Iterable, BinaryIO
 
 import pypdf
 from pypdf import PdfReader, PageObject, PdfWriter
-from pypdf.generic import IndirectObject
+from pypdf._encryption import Encryption, EncryptAlgorithm
+from pypdf.constants import UserAccessPermissions
+from pypdf.errors import FileNotDecryptedError, WrongPasswordError, PdfReadError
+from pypdf.generic import IndirectObject, ArrayObject, ByteStringObject, DictionaryObject, PdfObject
 
-from aidapdf import util
+from aidapdf import util, cache
 from aidapdf.config import Config, ansicolor
+from aidapdf.index import IndexedPdfReader, build_index
+from aidapdf.linearize import write_linearized
+from aidapdf.prune import prune_writer
 from aidapdf.log import Logger
 from aidapdf.pageselector import PageSelector
+from aidapdf.progress import Progress
+from aidapdf.streamwriter import StreamingPdfWriter
+from aidapdf.trailer import TrailerInfo, scan_trailer
 from aidapdf.util import repr_password
 
 from getpass import getpass
@@ -26,7 +40,13 @@ class InternalFileException(Exception):
         super().__init__(message, kwargs)
 
 
+STDIO = '-'
+"""Path that stands for the standard input (for input files) or the standard output (for output files)."""
+
+
 def check_filename(fp: str) -> str:
+    if fp == STDIO:
+        return fp
     if not Path(fp).is_file():
         raise FileNotFoundError(f"file {repr(fp)} not found")
     return fp
@@ -62,20 +82,184 @@ def parse_file_specifier(fsp: str, skip_check = False) -> tuple[str, Optional[st
     return filepath if skip_check else check_filename(filepath), selector, password
 
 
+def expand_file_specifiers(fsps: Iterable[str], skip_check = False) -> list[tuple[str, Optional[str], Optional[str]]]:
+    """
+    Parse file specifiers, expanding glob patterns (`*`, `?`, `[...]`, `**`) in their path part. The selector and
+    password of a pattern apply to every file it matches. Patterns are not expanded when `Config.RAW_FILENAMES` is set.
+    :param skip_check: If `True`, don't check that the files exist.
+    """
+
+    res = []
+    for fsp in fsps:
+        filepath, selector, password = parse_file_specifier(fsp, skip_check=True)
+        if not Config.RAW_FILENAMES and glob.has_magic(filepath):
+            matches = sorted(m for m in glob.glob(filepath, recursive=True) if Path(m).is_file())
+            if not matches and not skip_check:
+                raise FileNotFoundError(f"pattern {repr(filepath)} matched no files")
+            _logger.debug(f"pattern {repr(filepath)} matched {util.pluralize(len(matches), 'file')}")
+            res.extend((m, selector, password) for m in matches)
+        else:
+            res.append((filepath if skip_check else check_filename(filepath), selector, password))
+    return res
+
+
+def read_owner_password(what: str) -> str:
+    """
+    Prompt for the owner password used to encrypt `what`. Exits the program if the user doesn't provide one.
+    """
+
+    try:
+        return getpass(f"Owner password to encrypt {what}: ")
+    except (EOFError, KeyboardInterrupt):
+        _logger.err("no owner password provided")
+        sys.exit(1)
+
+
+class _PooledEncryption:
+    """
+    Stands in for a writer's `Encryption` object. `PdfWriter` asks for the encrypted objects one by one, in ascending
+    object number order, while it writes them out; they're encrypted ahead of time in a thread pool, at most
+    `LOOKAHEAD` objects in advance.
+    """
+
+    LOOKAHEAD = 64
+
+    def __init__(self, encryption: Encryption, executor: ThreadPoolExecutor, writer: PdfWriter):
+        self._encryption = encryption
+        self._executor = executor
+        self._writer = writer
+        self._pending: dict[int, Future] = {}
+        self._next = 1
+
+    def encrypt_object(self, obj: PdfObject, idnum: int, generation: int) -> PdfObject:
+        objects = self._writer._objects
+        while self._next <= min(idnum + self.LOOKAHEAD, len(objects)):
+            ahead = objects[self._next - 1]
+            if ahead is not None and ahead is not self._writer._encrypt_entry:
+                self._pending[self._next] = self._executor.submit(self._encryption.encrypt_object,
+                                                                  ahead, self._next, 0)
+            self._next += 1
+
+        future = self._pending.pop(idnum, None)
+        if future is None or generation != 0:
+            return self._encryption.encrypt_object(obj, idnum, generation)
+        return future.result()
+
+
+class EncryptionContext:
+    """
+    Encryption shared by many output files (e.g. the outputs of `split` and `explode`). The passwords have to be
+    resolved beforehand; the encryption key and the encryption dictionary are derived once, when the context is
+    created, and `apply()` only attaches them to a writer. The objects of every writer are encrypted in the context's
+    thread pool. Use with a `with` statement.
+    """
+
+    def __init__(self, owner_password: str, password: Optional[str] = None, algorithm: Optional[str] = None,
+                 jobs: Optional[int] = None):
+        """
+        :param owner_password: Password to change the encryption and permissions of the files.
+        :param password: Password to access the files. If `None`, the files can be opened without a password.
+        :param algorithm: One of "RC4-40", "RC4-128", "AES-128", "AES-256-R5" and "AES-256". Defaults to "RC4-128".
+        :param jobs: Number of encryption threads.
+        """
+
+        if not owner_password:
+            raise ValueError("no owner password provided")
+        self.algorithm = algorithm or "RC4-128"
+        try:
+            alg = getattr(EncryptAlgorithm, self.algorithm.replace("-", "_"))
+        except AttributeError:
+            raise ValueError(f"unsupported encryption algorithm {repr(self.algorithm)}")
+
+        # RC4 and AES-128 keys depend on the first file identifier, so all files share it. the second identifier is
+        # generated for each file
+        self._id1 = secrets.token_bytes(16)
+        self._encryption = Encryption.make(alg, UserAccessPermissions.all(), self._id1)
+        self._entry = self._encryption.write_entry(password or "", owner_password)
+        self._executor = ThreadPoolExecutor(jobs, thread_name_prefix="encrypt")
+        _logger.debug(f"encryption context created ({self.algorithm}; password={repr_password(password)}, "
+                      f"owner_password={repr_password(owner_password)})")
+
+    def apply(self, writer: PdfWriter | StreamingPdfWriter) -> None:
+        """Encrypt the writer's output with this context's key."""
+
+        file_id = ArrayObject([ByteStringObject(self._id1), ByteStringObject(secrets.token_bytes(16))])
+        if isinstance(writer, StreamingPdfWriter):
+            # objects are encrypted one by one as they're written, there's nothing to encrypt ahead of time
+            writer.use_encryption(self._encryption, self._entry, file_id)
+            return
+
+        writer._ID = file_id
+        entry = DictionaryObject(self._entry)
+        writer._add_object(entry)
+        writer._encrypt_entry = entry
+        writer._encryption = _PooledEncryption(self._encryption, self._executor, writer)
+
+    def close(self) -> None:
+        self._executor.shutdown()
+
+    def __enter__(self) -> 'EncryptionContext':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
 class PdfFile:
-    def __init__(self, filename: str | PathLike,
+    def __init__(self, filename: str | PathLike | bytes | bytearray | memoryview | BinaryIO,
                  selector: Optional[str | PageSelector] = None,
                  password: Optional[str] = None,
-                 source_file: Optional['PdfFile'] = None):
-        self.path = Path(filename)
+                 source_file: Optional['PdfFile'] = None,
+                 interactive: bool = True,
+                 streaming: bool = False,
+                 lazy: bool = False,
+                 linearize: bool = False,
+                 prune: bool = False):
+        self.path: Optional[Path] = None
+        """Path of the file, or `None` if the file is in memory."""
+        self.buffer: Optional[BinaryIO] = None
+        """The binary stream the file is read from and written to if it's in memory."""
+        self.stdio = isinstance(filename, str) and filename == STDIO
+        """If `True`, the file is read from the standard input or written to the standard output."""
+        if self.stdio:
+            pass
+        elif isinstance(filename, (str, PathLike)):
+            self.path = Path(filename)
+        elif isinstance(filename, (bytes, bytearray, memoryview)):
+            self.buffer = BytesIO(filename)
+        else:
+            self.buffer = filename
+        self.name = STDIO if self.stdio else str(self.path) if self.path is not None else "<memory>"
         self.selector: Optional[PageSelector] = PageSelector.parse(selector) if type(selector) is str else selector or None
         self.source_file = source_file
         self.password = password
+        self.interactive = interactive
+        """If `False`, never prompt for passwords; raise `pypdf.errors.PdfReadError` subclasses instead."""
+        self.streaming = streaming and not linearize
+        """If `True`, write pages out as they're added (see `StreamingPdfWriter`)."""
+        self.linearize = linearize
+        """
+        If `True`, write the file linearized (see `linearize.write_linearized()`). That needs the whole document, so the
+        file isn't streamed.
+        """
+        self.prune = prune
+        """
+        If `True`, drop the fonts, images and other resources the pages of the file don't use, and the objects nothing
+        refers to, before writing it (see `prune.prune_writer()`).
+        """
+        self.lazy = lazy
+        """
+        If `True`, read the file from the disk as objects are needed, instead of reading all of it into memory first.
+        Objects can't be read once the reader is closed.
+        """
 
         self._reader: Optional[PdfReader] = None
         self._reader_open = False
-        self._writer: Optional[PdfWriter] = None
+        self._reader_stream: Optional[BinaryIO] = None
+        self._writer: Optional[PdfWriter | StreamingPdfWriter] = None
         self._writer_open = False
+        self._features: Optional[dict[int, dict[str, Any]]] = None
+        self._trailer_info: Optional[TrailerInfo] = None
 
         self.title: Optional[str] = None
         self.author: Optional[str] = None
@@ -95,21 +279,49 @@ class PdfFile:
         # just making sure...
         assert self._reader is None and not self._reader_open
 
-        self._reader = PdfReader(self.path)
+        if self.stdio and self.buffer is None:
+            # pypdf has to seek, so the standard input is read into memory first
+            self.buffer = BytesIO(sys.stdin.buffer.read())
+        use_index = Config.INDEX and self.path is not None
+        index = cache.load(self.path, 'index') if use_index else None
+        self._reader = None
+        if index is not None:
+            try:
+                self._reader = IndexedPdfReader(self.path, index)
+            except (PdfReadError, KeyError, ValueError) as e:
+                self._logger.warn(f"ignoring broken index: {e}")
+                index = None
+        if self._reader is None and self.lazy and self.path is not None:
+            # pypdf reads a file given by its path into memory, but not an open one
+            self._reader_stream = open(self.path, 'rb')
+            self._reader = PdfReader(self._reader_stream)
+        if self._reader is None:
+            self._reader = PdfReader(self.path if self.path is not None else self.buffer)
         encrypted = self._reader.is_encrypted
         while encrypted:
             # try to decrypt
             res = self._reader.decrypt(self.password or "")
             if res == pypdf.PasswordType.NOT_DECRYPTED:
+                if not self.interactive:
+                    self._reader = None
+                    if self._reader_stream is not None:
+                        self._reader_stream.close()
+                        self._reader_stream = None
+                    if self.password:
+                        raise WrongPasswordError("incorrect password")
+                    raise FileNotDecryptedError("file is encrypted")
                 # password is incorrect
                 self._logger.err("incorrect password")
                 # read password
-                self.password = getpass(f"Password to read file {repr(str(self.path))}: ")
+                self.password = getpass(f"Password to read file {repr(self.name)}: ")
             else:
                 # decrypted successfully
                 encrypted = False
                 self._logger.info("decrypted successfully")
         self._reader_open = True
+        if use_index and index is None:
+            # the page tree can only be walked once the file is decrypted
+            cache.store(self.path, 'index', build_index(self._reader))
         self._derive_basic_metadata()
         self._logger.debug("reader opened")
 
@@ -142,8 +354,16 @@ class PdfFile:
         assert self._reader is not None
         return self._reader
 
+    def _create_writer(self) -> PdfWriter | StreamingPdfWriter:
+        if self.stdio and not self.linearize:
+            # the standard output can't seek, so pages are written to it as they're added
+            return StreamingPdfWriter(sys.stdout.buffer, prune=self.prune)
+        if self.streaming:
+            return StreamingPdfWriter(self.path if self.path is not None else self.buffer, prune=self.prune)
+        return PdfWriter()
+
     @contextmanager
-    def get_writer(self) -> Generator[PdfWriter, None, None]:
+    def get_writer(self) -> Generator[PdfWriter | StreamingPdfWriter, None, None]:
         """
         Create a reader. Use with a `with` statement.
         :return: The created `PdfReader` object.
@@ -152,14 +372,18 @@ class PdfFile:
         if self._writer_open: raise InternalFileException("writer already open")
 
         try:
-            self._writer = PdfWriter()
+            self._writer = self._create_writer()
             self._writer_open = True
             self._logger.debug("writer opened")
             yield self._writer
+        except BaseException:
+            # don't leave a file with the pages written so far behind
+            self.discard_writer()
+            raise
         finally:
             self.close_writer()
 
-    def get_writer_unsafe(self) -> PdfWriter:
+    def get_writer_unsafe(self) -> PdfWriter | StreamingPdfWriter:
         """
         If a writer already exists, return it. Otherwise, create a new one. Should only be used when you can't use
         `get_writer()`. Don't forget to call `close_writer()` after you're finished.
@@ -168,7 +392,7 @@ class PdfFile:
 
         if self._writer is not None:
             return self._writer
-        self._writer = PdfWriter()
+        self._writer = self._create_writer()
         self._writer_open = True
         self._logger.debug("writer opened")
         return self._writer
@@ -189,6 +413,9 @@ class PdfFile:
         if not self._reader_open:
             return
         self._reader.close()
+        if self._reader_stream is not None:
+            self._reader_stream.close()
+            self._reader_stream = None
         self._reader = None
         self._reader_open = False
         self._logger.debug("reader closed")
@@ -199,12 +426,50 @@ class PdfFile:
 
         if not self._writer_open:
             return
-        self._writer.write(self.path)
+        if self.prune and isinstance(self._writer, PdfWriter):
+            # a streaming writer prunes the pages as they're written
+            prune_writer(self._writer)
+        if self.stdio:
+            self._write(sys.stdout.buffer)
+            sys.stdout.buffer.flush()
+        elif self.path is not None:
+            self._write(self.path)
+            Progress.count_written(self.path)
+        else:
+            self._write(self.buffer)
         self._writer_open = False
         self._writer.close()
         self._logger.debug("writer closed")
         self._writer = None
 
+    def discard_writer(self) -> None:
+        """
+        Closes and disposes of the writer if one is open, without writing the file. What a streaming writer has written
+        to a path is removed; what it has written to a stream stays.
+        """
+
+        if not self._writer_open:
+            return
+        self._writer_open = False
+        self._writer.close()
+        self._logger.debug("writer discarded")
+        self._writer = None
+
+    def _write(self, target: Path | BinaryIO) -> None:
+        if not self.linearize:
+            self._writer.write(target)
+            return
+        encryption = self._writer._encryption
+        if isinstance(encryption, _PooledEncryption):
+            # the objects are renumbered, so they can't be encrypted ahead of time
+            encryption = encryption._encryption
+        if isinstance(target, Path):
+            with open(target, 'wb') as f:
+                write_linearized(self._writer, f, encryption)
+        else:
+            write_linearized(self._writer, target, encryption)
+        self._logger.debug("wrote linearized")
+
     @staticmethod
     def _parse_datetime(key: str, raw: str) -> Optional[datetime]:
         if not raw: return None
@@ -219,9 +484,10 @@ class PdfFile:
         except ValueError:
             _logger.warn(f"'{key}' is not a valid date: {repr(raw)}")
 
-    def _derive_basic_metadata(self) -> None:
-        self._ensure_reader_open()
-        metadata = self.get_metadata(resolve=True)
+    def _derive_basic_metadata(self, metadata: Optional[dict[str, Any]] = None) -> None:
+        if metadata is None:
+            self._ensure_reader_open()
+            metadata = self.get_metadata(resolve=True)
         self.title = metadata.get('/Title', None)
         self.author = metadata.get('/Author', None)
         self.subject = metadata.get('/Subject', None)
@@ -246,44 +512,6 @@ class PdfFile:
         self._writer.add_metadata(metadata)
         self._logger.info(f"added metadata {metadata}")
 
-    def add_blank_page(self) -> None:
-        """Add a blank page to the end of the file. The writer has to be opened."""
-        self._ensure_writer_open()
-        self._writer.add_blank_page()
-        self._logger.debug(f"added blank page")
-
-    def insert_blank_page(self, index: int) -> None:
-        """
-        Insert a blank page at the given index. The writer has to be opened.
-        :param index: Index to insert a blank page at. If >= the page count, behaves like `add_blank_page()`.
-        :return:
-        """
-
-        self._ensure_writer_open()
-        if index >= len(self._writer.pages):
-            self._writer.add_blank_page()
-        else:
-            self._writer.insert_blank_page(None, None, index)
-        self._logger.debug(f"inserted blank page @ {index}")
-
-    def pad_pages(self, to: int, where: Literal['start', 'end'] = 'end') -> None:
-        """
-        Add blank pages until the file has `to` pages.
-        :param to: Target number of pages.
-        :param where: Where to add the blank pages. If `start`, they're added to the beginning, if `end` , they're
-        appended to the end.
-        """
-
-        self._ensure_writer_open()
-        diff = to - self.get_page_count()
-        if diff > 0:
-            for i in range(diff):
-                if where == 'end':
-                    self.add_blank_page()
-                else:
-                    self.insert_blank_page(0)
-        self._logger.info(f"padded pages to {to}")
-
     def get_metadata(self, resolve = False) -> dict[str, Any]:
         """
         Return the metadata of the file. The writer has to be opened.
@@ -291,11 +519,11 @@ class PdfFile:
         """
 
         self._ensure_reader_open()
-        meta_raw = self._reader.metadata
+        meta_raw = self._reader.metadata or {}
         if resolve:
             meta = {}
             for k, v in meta_raw.items():
-                meta[k] = str(v) if isinstance(v, IndirectObject) else v
+                meta[k] = v.get_object() if isinstance(v, IndirectObject) else v
             return meta
         else:
             return meta_raw
@@ -310,30 +538,60 @@ class PdfFile:
         if permissions is None: return None
         return permissions.to_dict()
 
-    def encrypt(self, owner_password: str, password: Optional[str] = None) -> None:
+    def encrypt(self, owner_password: str, password: Optional[str] = None, algorithm: Optional[str] = None) -> None:
         """
         Encrypts the file with the provided passwords. The writer has to be opened.
         :param owner_password: Password to change the encryption and permissions of the file.
         :param password: Password to access the file. If `None`, the value is taken from `self.password`.
+        :param algorithm: Encryption algorithm (see `EncryptionContext`). Defaults to "RC4-128".
         """
 
         self._ensure_writer_open()
         password = password or (self.source_file and self.source_file.password)
         # prompt for owner password if not provided
         if not owner_password:
-            try:
-                owner_password = getpass(f"Owner password to encrypt file {repr(str(self.path))}: ")
-            except (EOFError, KeyboardInterrupt):
-                self._logger.err("no owner password provided")
-                sys.exit(1)
+            owner_password = read_owner_password(f"file {repr(self.name)}")
 
-        self._writer.encrypt(password, owner_password)
-        if password == self.source_file.password:
+        self._writer.encrypt(password or "", owner_password, algorithm=algorithm)
+        if self.source_file and password == self.source_file.password:
             self._logger.info(f"encrypted with password taken from {self.source_file} and provided owner_password "
                                f"({repr_password(owner_password)})")
         else:
             self._logger.info("encrypted with the provided passwords")
 
+    def apply_encryption(self, context: EncryptionContext) -> None:
+        """Encrypts the file using a shared `EncryptionContext`. The writer has to be opened."""
+
+        self._ensure_writer_open()
+        context.apply(self._writer)
+        self._logger.debug(f"encrypted with shared {context.algorithm} context")
+
+    def template_fields(self) -> dict[str, str]:
+        """
+        Return the fields describing the file for output file name templates: `dir` (with a trailing separator),
+        `name` (without the extension) and `ext`. Files that aren't on the disk are called "stdin" or "memory".
+        """
+
+        if self.path is None:
+            return {"dir": "", "name": "stdin" if self.stdio else "memory", "ext": ".pdf"}
+        return {"dir": str(self.path.parent) + os.sep, "name": self.path.stem, "ext": self.path.suffix}
+
+    def scan_trailer(self, pages: bool = True) -> Optional[TrailerInfo]:
+        """
+        Read the metadata and, if `pages`, the page count straight from the trailer and the few objects it refers to,
+        without creating a reader (see `trailer.scan_trailer()`), and derive the basic metadata from it. Return `None`
+        if the file isn't on the disk, is encrypted or is damaged; the reader has to be used then.
+        """
+
+        if self.path is None:
+            return None
+        info = scan_trailer(self.path, pages)
+        if info is not None:
+            self._trailer_info = info
+            self._derive_basic_metadata(info.metadata)
+            self._logger.debug("scanned the trailer")
+        return info
+
     def get_page_count(self) -> int:
         """
         Return number of pages in the file. Presupposes that the reader is open.
@@ -342,15 +600,45 @@ class PdfFile:
         self._ensure_reader_open()
         return len(self._reader.pages)
 
-    def get_pages(self, selector: Optional[PageSelector] = None) -> Iterator[PageObject]:
+    def get_page_features(self, index: int) -> dict[str, Any]:
         """
-        Iterates over selected pages. Presupposes that the reader is open.
+        Return the features of the page `index` (see `features.page_features()`). The first call works out the features
+        of all the pages. Presupposes that the reader is open.
+        """
+
+        self._ensure_reader_open()
+        if self._features is None:
+            # imported here because the feature index opens files in worker processes
+            from aidapdf.features import feature_index
+            self._features = feature_index(self)
+        return self._features[index]
+
+    def get_page_indices(self, selector: Optional[PageSelector] = None) -> list[int]:
+        """
+        Return the indices (counted from 0) of the selected pages. Presupposes that the reader is open.
         :param selector: Selector override.
         """
 
         self._ensure_reader_open()
         selector = selector or self.selector
         if selector is None:
+            return list(range(len(self._reader.pages)))
+        return list(selector.bake(self))
+
+    def get_pages(self, selector: Optional[PageSelector] = None,
+                  indices: Optional[Iterable[int]] = None) -> Iterator[PageObject]:
+        """
+        Iterates over selected pages. Presupposes that the reader is open.
+        :param selector: Selector override.
+        :param indices: Page indices (counted from 0) to iterate over instead of the selected pages.
+        """
+
+        self._ensure_reader_open()
+        selector = selector or self.selector
+        if indices is not None:
+            for i in indices:
+                yield self._reader.get_page(i)
+        elif selector is None:
             for page in self._reader.pages:
                 yield page
         else:
@@ -359,12 +647,15 @@ class PdfFile:
 
     def __str__(self) -> str:
         color_value = lambda v: ansicolor(v, stream=sys.stdout, fg=Config.COLOR_VALUE)
-        text = f"PDF file at {color_value(repr(str(self.path)))}"
+        text = f"PDF file at {color_value(repr(self.name))}"
         if self._reader_open:
             if self._reader.is_encrypted:
                 text += " (encrypted)"
             else:
                 text += " (unencrypted)"
+        elif self._trailer_info is not None:
+            # only unencrypted files are scanned
+            text += " (unencrypted)"
         text += '.\n'
         if self.title:
             text += repr(self.title)
@@ -391,4 +682,4 @@ class PdfFile:
         return text
 
     def __repr__(self) -> str:
-        return f"PdfFile({repr(str(self.path))})"
+        return f"PdfFile({repr(self.name)})"
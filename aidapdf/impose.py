@@ -0,0 +1,152 @@
+from typing import Optional
+
+from pypdf import PageObject, PdfWriter
+from pypdf.generic import (ArrayObject, ContentStream, DecodedStreamObject, DictionaryObject, EncodedStreamObject,
+                           FloatObject, IndirectObject, NameObject, StreamObject)
+
+from aidapdf.log import Logger
+from aidapdf.streamwriter import StreamingPdfWriter
+
+
+_logger = Logger(__name__)
+
+
+NUP = [2, 4]
+
+
+def booklet_order(count: int) -> list[int]:
+    """
+    Return the order in which to put `count` pages (a multiple of 4) two per side onto sheets that are folded and
+    stapled in the middle: the outermost sheet first, each sheet's front (last page, first page) before its back.
+    """
+
+    if count % 4:
+        raise ValueError(f"a booklet needs a multiple of 4 pages, not {count}")
+    order = []
+    for i in range(count // 4):
+        order += [count - 1 - 2 * i, 2 * i, 2 * i + 1, count - 2 - 2 * i]
+    return order
+
+
+def _shown_size(page: PageObject) -> tuple[float, float]:
+    box = page.cropbox
+    return (float(box.width), float(box.height)) if page.rotation % 180 == 0 else \
+        (float(box.height), float(box.width))
+
+
+class Imposer:
+    """
+    Puts pages onto sheets, `nup` pages per sheet, in reading order. Every page is wrapped in a form XObject that
+    reuses its content stream as it is, still encoded, so imposing doesn't decode or copy page content; a sheet is
+    just a few bytes drawing the forms, scaled to fit and centered in its cells. Annotations of the pages are lost.
+    """
+
+    def __init__(self, writer: PdfWriter | StreamingPdfWriter, nup: int, page: PageObject):
+        """
+        :param writer: The writer the sheets will be added to.
+        :param nup: Pages per sheet, 2 or 4.
+        :param page: The page that determines the sheet size. Two pages share a sheet of the size of one page turned
+        sideways, four pages a sheet of the size of one page.
+        """
+
+        if nup not in NUP:
+            raise ValueError(f"can't put {nup} pages on a sheet")
+        self.writer = writer
+        self.nup = nup
+
+        width, height = _shown_size(page)
+        if nup == 2:
+            self.size = (height, width)
+            # the sheet is split across its longer side
+            columns, rows = (2, 1) if height >= width else (1, 2)
+        else:
+            self.size = (width, height)
+            columns, rows = 2, 2
+        cell_w, cell_h = self.size[0] / columns, self.size[1] / rows
+        self._cells = [(col * cell_w, (rows - 1 - row) * cell_h, cell_w, cell_h)
+                       for row in range(rows) for col in range(columns)]
+
+    def _form(self, page: PageObject) -> IndirectObject:
+        """Add the form XObject of `page` to the output."""
+
+        contents = page.raw_get("/Contents").get_object() if "/Contents" in page else None
+        if isinstance(contents, ArrayObject) and len(contents) == 1:
+            contents = contents[0].get_object()
+        if isinstance(contents, StreamObject) and not isinstance(contents, ContentStream):
+            form = EncodedStreamObject() if isinstance(contents, EncodedStreamObject) else DecodedStreamObject()
+            form._data = contents._data
+            for key in ("/Filter", "/DecodeParms"):
+                if key in contents:
+                    form[NameObject(key)] = contents.raw_get(key)
+        else:
+            # several content streams have to be joined into one
+            form = DecodedStreamObject()
+            data = page.get_contents()
+            form.set_data(data.get_data() if data is not None else b"")
+            form = form.flate_encode()
+
+        box = page.cropbox
+        form.update({
+            NameObject("/Type"): NameObject("/XObject"),
+            NameObject("/Subtype"): NameObject("/Form"),
+            NameObject("/BBox"): ArrayObject(FloatObject(x) for x in (box.left, box.bottom, box.right, box.top)),
+        })
+        for key in ("/Resources", "/Group"):
+            if key in page:
+                form[NameObject(key)] = page.raw_get(key)
+        if isinstance(self.writer, PdfWriter):
+            # a PdfWriter doesn't copy objects of other documents by itself
+            form = form.clone(self.writer)
+        return self.writer._add_object(form)
+
+    @staticmethod
+    def _matrix(page: PageObject, cell: tuple[float, float, float, float]) -> tuple[float, ...]:
+        """Return the matrix that maps `page`, as it's displayed, into the middle of `cell`."""
+
+        box = page.cropbox
+        x0, y0, w, h = float(box.left), float(box.bottom), float(box.width), float(box.height)
+        rotation = page.rotation % 360
+        # from the page's space to its displayed area, with the lower left corner at the origin
+        a, b, c, d, e, f = {
+            0: (1, 0, 0, 1, -x0, -y0),
+            90: (0, -1, 1, 0, -y0, w + x0),
+            180: (-1, 0, 0, -1, w + x0, h + y0),
+            270: (0, 1, -1, 0, h + y0, -x0),
+        }[rotation]
+
+        shown_w, shown_h = _shown_size(page)
+        cx, cy, cw, ch = cell
+        s = min(cw / shown_w, ch / shown_h)
+        dx = cx + (cw - shown_w * s) / 2
+        dy = cy + (ch - shown_h * s) / 2
+        return a * s, b * s, c * s, d * s, e * s + dx, f * s + dy
+
+    def sheet(self, pages: list[Optional[PageObject]]) -> PageObject:
+        """
+        Return a sheet with `pages` on it, which can be added to the writer. `None` leaves a cell empty.
+        """
+
+        if len(pages) > self.nup:
+            raise ValueError(f"{len(pages)} pages don't fit on a sheet of {self.nup}")
+
+        xobjects = DictionaryObject()
+        data = b""
+        for i, (page, cell) in enumerate(zip(pages, self._cells)):
+            if page is None:
+                continue
+            name = NameObject(f"/Page{i}")
+            xobjects[name] = self._form(page)
+            matrix = " ".join(f"{x:g}" for x in self._matrix(page, cell))
+            data += f"q {matrix} cm {name} Do Q\n".encode()
+
+        stream = DecodedStreamObject()
+        stream.set_data(data)
+        sheet = PageObject()
+        sheet.update({
+            NameObject("/Type"): NameObject("/Page"),
+            NameObject("/MediaBox"): ArrayObject([FloatObject(0), FloatObject(0),
+                                                  FloatObject(self.size[0]), FloatObject(self.size[1])]),
+            NameObject("/Resources"): DictionaryObject({NameObject("/XObject"): xobjects}),
+            NameObject("/Contents"): ArrayObject([self.writer._add_object(stream)]),
+        })
+        return sheet
@@ -0,0 +1,106 @@
+from io import BytesIO
+from os import PathLike
+from typing import Any, Optional
+
+from pypdf import PdfReader, PageObject
+from pypdf.generic import IndirectObject, DictionaryObject
+
+from aidapdf.log import Logger
+
+
+_logger = Logger(__name__)
+
+
+_INHERITABLE = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+
+
+def build_index(reader: PdfReader) -> dict[str, Any]:
+    """
+    Return the index of the document `reader` reads: its cross-reference tables, its trailer and, unless pages inherit
+    attributes from the page tree, the references to its pages in order. The reader has to be decrypted.
+    """
+
+    trailer = BytesIO()
+    reader.trailer.write_to_stream(trailer)
+    return {
+        "startxref": reader._startxref,
+        "xref_index": reader.xref_index,
+        "xref": {gen: list(entries.items()) for gen, entries in reader.xref.items()},
+        "xref_free": {gen: [k for k, free in entries.items() if free]
+                      for gen, entries in reader.xref_free_entry.items()},
+        "xref_objstm": [[k, *v] for k, v in reader.xref_objStm.items()],
+        "trailer": trailer.getvalue().decode('latin-1'),
+        "pages": _page_refs(reader),
+    }
+
+
+def _page_refs(reader: PdfReader) -> Optional[list[tuple[int, int]]]:
+    # pypdf copies attributes inherited from the page tree into the pages when it walks the tree. reading the pages
+    # directly would miss them, so such documents are indexed without their pages
+    stack = [reader.root_object["/Pages"]]
+    while stack:
+        node = stack.pop()
+        if any(attr in node for attr in _INHERITABLE):
+            return None
+        stack.extend(kid.get_object() for kid in node.get("/Kids", ())
+                     if kid.get_object().get("/Type") == "/Pages")
+
+    refs = []
+    for page in reader.pages:
+        if page.indirect_reference is None:
+            return None
+        refs.append((page.indirect_reference.idnum, page.indirect_reference.generation))
+    return refs
+
+
+class _IndexedPages(list):
+    """The pages of an `IndexedPdfReader`. A page is only read when it's first accessed."""
+
+    def __init__(self, reader: PdfReader, refs: list[tuple[int, int]]):
+        super().__init__([None] * len(refs))
+        self._reader = reader
+        self._refs = refs
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        page = super().__getitem__(i)
+        if page is None:
+            ref = IndirectObject(*self._refs[i], self._reader)
+            page = PageObject(self._reader, ref)
+            page.update(ref.get_object())
+            super().__setitem__(i, page)
+        return page
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class IndexedPdfReader(PdfReader):
+    """
+    A `PdfReader` that takes the cross-reference tables, the trailer and the page list from an index built by
+    `build_index()` instead of parsing them. The file isn't read into memory, only the objects that are used are read
+    from it, so opening even a huge file is almost instant. The index has to match the file.
+    """
+
+    def __init__(self, path: str | PathLike, index: dict[str, Any], strict: bool = False):
+        self._index = index
+        super().__init__(path, strict)
+
+    def _initialize_stream(self, stream: str | PathLike) -> None:
+        self.stream = open(stream, 'rb')
+        self._stream_opened = True
+        self.read(self.stream)
+
+    def read(self, stream) -> None:
+        index = self._index
+        self._startxref = index["startxref"]
+        self.xref_index = index["xref_index"]
+        self.xref = {int(gen): dict(entries) for gen, entries in index["xref"].items()}
+        self.xref_free_entry = {int(gen): dict.fromkeys(entries, True) for gen, entries in index["xref_free"].items()}
+        self.xref_objStm = {k: (stm, i) for k, stm, i in index["xref_objstm"]}
+        self.trailer = DictionaryObject.read_from_stream(BytesIO(index["trailer"].encode('latin-1')), self)
+        if index["pages"] is not None:
+            self.flattened_pages = _IndexedPages(self, index["pages"])
+        _logger.debug(f"read {'page list and ' if index['pages'] is not None else ''}cross-reference tables from index")
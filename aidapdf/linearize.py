@@ -0,0 +1,442 @@
+import secrets
+import zlib
+from io import BytesIO
+from typing import Any, BinaryIO, Iterable, Optional
+
+from pypdf import PdfWriter
+from pypdf._encryption import Encryption
+from pypdf.generic import (PdfObject, IndirectObject, DictionaryObject, ArrayObject, StreamObject, EncodedStreamObject,
+                           DecodedStreamObject, ContentStream, ByteStringObject, NameObject, NumberObject, NullObject)
+
+from aidapdf import util
+from aidapdf.log import Logger
+
+
+_logger = Logger(__name__)
+
+
+_OPEN_DOCUMENT_KEYS = ("/ViewerPreferences", "/PageMode", "/Threads", "/OpenAction", "/AcroForm")
+"""Entries of the document catalog a viewer needs to open the document; they go before the first page."""
+
+_INHERITABLE = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+
+_NUMBER_WIDTH = 10
+"""Offsets and lengths that are only known once everything is laid out are written padded to this width."""
+
+
+class _BitWriter:
+    """Packs the unsigned integers of the hint tables, most significant bit first."""
+
+    def __init__(self):
+        self._data = bytearray()
+        self._value = 0
+        self._bits = 0
+
+    def write(self, value: int, bits: int) -> None:
+        if bits == 0:
+            return
+        self._value = (self._value << bits) | value
+        self._bits += bits
+        while self._bits >= 8:
+            self._bits -= 8
+            self._data.append(self._value >> self._bits & 0xff)
+        self._value &= (1 << self._bits) - 1
+
+    def write_all(self, values: Iterable[int], bits: int) -> None:
+        """Write `values` and pad them to a whole byte, as every item of the per-page and per-object entries is."""
+
+        for value in values:
+            self.write(value, bits)
+        self.flush()
+
+    def flush(self) -> None:
+        if self._bits:
+            self.write(0, 8 - self._bits)
+
+    def getvalue(self) -> bytes:
+        self.flush()
+        return bytes(self._data)
+
+
+def _bits(value: int) -> int:
+    return value.bit_length()
+
+
+class _Linearizer:
+    """
+    Lays out the objects of a `PdfWriter` the way a linearized file has them (ISO 32000-1, Annex F), in the order the
+    parts are numbered there:
+
+    1. the linearization parameter dictionary;
+    2. the cross-reference table and trailer of the first page;
+    4. the document catalog and the objects a viewer needs to open the document;
+    5. the primary hint stream;
+    6. the first page and everything it uses;
+    7. every other page with the objects only it uses;
+    8. the objects several of those pages share;
+    9. everything else (the page tree, the outlines, the document information, ...);
+    11. the main cross-reference table and trailer.
+
+    The objects of the second half (parts 7 to 9) are numbered first, so that each cross-reference table covers one
+    contiguous range of numbers. Objects nothing refers to are left out.
+    """
+
+    def __init__(self, writer: PdfWriter, encryption: Optional[Encryption]):
+        self.writer = writer
+        self.encryption = encryption
+        self._refs_cache: dict[int, list[int]] = {}
+
+        self.root = writer.root_object.indirect_reference.idnum
+        self.info = writer._info.indirect_reference.idnum if writer._info is not None else None
+        self.encrypt = writer._encrypt_entry.indirect_reference.idnum if writer._encrypt_entry is not None else None
+        self.pages = [page.indirect_reference.idnum for page in writer.pages]
+        if not self.pages:
+            raise ValueError("a document without pages can't be linearized")
+        if len(set(self.pages)) != len(self.pages):
+            raise ValueError("a document with a page object used more than once can't be linearized")
+
+    def _get(self, idnum: int) -> Optional[PdfObject]:
+        objects = self.writer._objects
+        return objects[idnum - 1] if 0 < idnum <= len(objects) else None
+
+    def _refs(self, idnum: int) -> list[int]:
+        """Return the objects `idnum` refers to, in the order they appear in it, leaving out page tree parents."""
+
+        refs = self._refs_cache.get(idnum)
+        if refs is None:
+            refs = self._refs_cache[idnum] = []
+            self._collect_refs(self._get(idnum), refs)
+        return refs
+
+    def _collect_refs(self, obj: Any, refs: list[int]) -> None:
+        kind = util.object_kind(obj)
+        if kind == util.REFERENCE:
+            refs.append(obj.idnum)
+        elif kind == util.STREAM or kind == util.DICTIONARY:
+            # going up the page tree would reach every page from every other one
+            in_tree = obj.get("/Type") in ("/Page", "/Pages")
+            for k, v in obj.items():
+                if not (in_tree and k == "/Parent"):
+                    self._collect_refs(v, refs)
+        elif kind == util.ARRAY:
+            for v in obj:
+                self._collect_refs(v, refs)
+
+    def _closure(self, start: Iterable[int], stop: set[int]) -> list[int]:
+        """
+        Return the objects reachable from `start`, depth first, without going into the objects in `stop` (other than
+        those in `start`).
+        """
+
+        order = []
+        seen = set()
+        stack = [(idnum, True) for idnum in reversed(list(start))]
+        while stack:
+            idnum, forced = stack.pop()
+            if idnum in seen or (idnum in stop and not forced) or self._get(idnum) is None:
+                continue
+            seen.add(idnum)
+            order.append(idnum)
+            stack.extend((ref, False) for ref in reversed(self._refs(idnum)))
+        return order
+
+    def _page_tree_nodes(self) -> set[int]:
+        nodes = set()
+        stack = [self.writer.root_object.raw_get("/Pages")]
+        while stack:
+            ref = stack.pop()
+            if not isinstance(ref, IndirectObject) or ref.idnum in nodes:
+                continue
+            node = self._get(ref.idnum)
+            if isinstance(node, DictionaryObject) and node.get("/Type") == "/Pages":
+                nodes.add(ref.idnum)
+                stack.extend(node.get("/Kids", ArrayObject()))
+        return nodes
+
+    def partition(self) -> None:
+        """Assign every object that's used to a part."""
+
+        pages = set(self.pages)
+        stop = pages | self._page_tree_nodes()
+        root = self._get(self.root)
+
+        open_refs: list[int] = []
+        for key in _OPEN_DOCUMENT_KEYS:
+            if key in root:
+                self._collect_refs(root.raw_get(key), open_refs)
+        self.part4 = [self.root] + [o for o in self._closure(open_refs, stop | {self.root})]
+        if self.encrypt is not None:
+            self.part4.append(self.encrypt)
+        assigned = set(self.part4)
+
+        first = self._closure([self.pages[0]], stop)
+        if root.get("/PageMode") == "/UseOutlines" and "/Outlines" in root:
+            # the outlines are shown along with the first page
+            outline_refs: list[int] = []
+            self._collect_refs(root.raw_get("/Outlines"), outline_refs)
+            first += self._closure(outline_refs, stop | set(first))
+        self.part6 = [o for o in first if o not in assigned]
+        assigned.update(self.part6)
+
+        self.page_objects: list[list[int]] = [[]]
+        """The objects every page other than the first uses (not only the ones in its part)."""
+        users: dict[int, int] = {}
+        for page in self.pages[1:]:
+            objects = self._closure([page], stop)
+            self.page_objects.append(objects)
+            for o in objects:
+                users[o] = users.get(o, 0) + 1
+        self.part7 = [[o for o in objects if o not in assigned and users[o] == 1] for objects in self.page_objects]
+        for objects in self.part7:
+            assigned.update(objects)
+        self.part8 = []
+        for objects in self.page_objects:
+            for o in objects:
+                if o not in assigned:
+                    assigned.add(o)
+                    self.part8.append(o)
+
+        rest = [self.root] + ([self.info] if self.info is not None else [])
+        self.part9 = [o for o in self._closure(rest, pages) if o not in assigned]
+
+    def number(self) -> None:
+        """Give the objects their new numbers: the second half first, then the first half."""
+
+        self.numbers: dict[int, int] = {}
+        for o in [o for objects in self.part7 for o in objects] + self.part8 + self.part9:
+            self.numbers[o] = len(self.numbers) + 1
+        self.second_half_size = len(self.numbers) + 1
+        self.linearization_number = len(self.numbers) + 1
+        for o in self.part4 + self.part6:
+            self.numbers[o] = len(self.numbers) + 2
+        self.hint_number = len(self.numbers) + 2
+        self.size = self.hint_number + 1
+
+    def _convert(self, obj: PdfObject) -> PdfObject:
+        """Return a copy of the direct object `obj` with the references renumbered."""
+
+        kind = util.object_kind(obj)
+        if kind == util.REFERENCE:
+            num = self.numbers.get(obj.idnum)
+            return IndirectObject(num, 0, self.writer) if num is not None else NullObject()
+        if kind == util.STREAM:
+            res = EncodedStreamObject() if isinstance(obj, EncodedStreamObject) else DecodedStreamObject()
+            # content streams may only hold parsed operations
+            res._data = obj.get_data() if isinstance(obj, ContentStream) else obj._data
+            for k, v in obj.items():
+                # the length is set when the stream is written
+                if k != "/Length":
+                    res[k] = self._convert(v)
+            return res
+        if kind == util.DICTIONARY:
+            res = DictionaryObject()
+            for k, v in obj.items():
+                res[k] = self._convert(v)
+            return res
+        if kind == util.ARRAY:
+            return ArrayObject(self._convert(x) for x in obj)
+        return obj
+
+    def _inherit(self, page: DictionaryObject, res: DictionaryObject) -> None:
+        """Copy the attributes `page` inherits from the page tree into `res`, its copy; a linearized file's pages
+        shouldn't need their ancestors."""
+
+        missing = [key for key in _INHERITABLE if key not in page]
+        node = page
+        seen = set()
+        while missing:
+            parent = node.raw_get("/Parent") if "/Parent" in node else None
+            if not isinstance(parent, IndirectObject) or parent.idnum in seen:
+                break
+            seen.add(parent.idnum)
+            node = self._get(parent.idnum)
+            if not isinstance(node, DictionaryObject):
+                break
+            for key in [key for key in missing if key in node]:
+                res[NameObject(key)] = self._convert(node.raw_get(key))
+                missing.remove(key)
+
+    def _serialize(self, num: int, obj: PdfObject, encrypt: bool = True) -> bytes:
+        if self.encryption is not None and encrypt:
+            obj = self.encryption.encrypt_object(obj, num, 0)
+        buffer = BytesIO()
+        buffer.write(f"{num} 0 obj\n".encode())
+        obj.write_to_stream(buffer)
+        buffer.write(b"\nendobj\n")
+        return buffer.getvalue()
+
+    def serialize(self) -> None:
+        self.blobs: dict[int, bytes] = {}
+        pages = set(self.pages)
+        for o, num in self.numbers.items():
+            obj = self._get(o)
+            res = self._convert(obj)
+            if o in pages:
+                self._inherit(obj, res)
+            # the encryption dictionary itself isn't encrypted
+            self.blobs[o] = self._serialize(num, res, o != self.encrypt)
+
+    def _hint_stream(self, offsets: dict[int, int], ends: list[int]) -> bytes:
+        """
+        Return the primary hint stream: the page offset hint table and the shared object hint table.
+        :param offsets: Offsets of the objects, as if the hint stream weren't there; the hint tables disregard it.
+        :param ends: Where the part of every page ends, likewise.
+        """
+
+        sections = [self.part6] + self.part7[1:]
+        counts = [len(objects) for objects in sections]
+        lengths = [end - offsets[objects[0]] for objects, end in zip(sections, ends)]
+
+        shared = self.part6 + self.part8
+        identifiers = {o: i for i, o in enumerate(shared)}
+        # the shared objects of the first page are all in its own part
+        page_shared = [[]] + [[identifiers[o] for o in objects if o in identifiers]
+                              for objects in self.page_objects[1:]]
+        max_identifier = max((i for ids in page_shared for i in ids), default=0)
+
+        pages = _BitWriter()
+        min_count, min_length = min(counts), min(lengths)
+        count_bits, length_bits = _bits(max(counts) - min_count), _bits(max(lengths) - min_length)
+        shared_count_bits = _bits(max(len(ids) for ids in page_shared))
+        identifier_bits = _bits(max_identifier)
+        pages.write(min_count, 32)
+        pages.write(offsets[self.pages[0]], 32)
+        pages.write(count_bits, 16)
+        pages.write(min_length, 32)
+        pages.write(length_bits, 16)
+        # content stream offsets and lengths aren't used by viewers; like Acrobat, the offsets are 0 and the lengths
+        # are those of the pages
+        pages.write(0, 32)
+        pages.write(0, 16)
+        pages.write(min_length, 32)
+        pages.write(length_bits, 16)
+        pages.write(shared_count_bits, 16)
+        pages.write(identifier_bits, 16)
+        pages.write(0, 16)
+        pages.write(1, 16)
+        pages.write_all((count - min_count for count in counts), count_bits)
+        pages.write_all((length - min_length for length in lengths), length_bits)
+        pages.write_all((len(ids) for ids in page_shared), shared_count_bits)
+        pages.write_all((i for ids in page_shared for i in ids), identifier_bits)
+        pages.write_all((length - min_length for length in lengths), length_bits)
+        page_table = pages.getvalue()
+
+        objects = _BitWriter()
+        sizes = [len(self.blobs[o]) for o in shared]
+        min_size = min(sizes)
+        size_bits = _bits(max(sizes) - min_size)
+        objects.write(self.numbers[self.part8[0]] if self.part8 else 0, 32)
+        objects.write(offsets[self.part8[0]] if self.part8 else 0, 32)
+        objects.write(len(self.part6), 32)
+        objects.write(len(shared), 32)
+        objects.write(0, 16)
+        objects.write(min_size, 32)
+        objects.write(size_bits, 16)
+        objects.write_all((size - min_size for size in sizes), size_bits)
+        # no signatures, and one object per group
+        objects.write_all((0 for _ in sizes), 1)
+
+        stream = DecodedStreamObject()
+        stream.set_data(zlib.compress(page_table + objects.getvalue()))
+        stream[NameObject("/Filter")] = NameObject("/FlateDecode")
+        stream[NameObject("/S")] = NumberObject(len(page_table))
+        return self._serialize(self.hint_number, stream)
+
+    def _first_page_xref(self, offsets: list[int], main_xref: int) -> bytes:
+        trailer = DictionaryObject({
+            NameObject("/Size"): NumberObject(self.size),
+            NameObject("/Root"): IndirectObject(self.numbers[self.root], 0, self.writer),
+            NameObject("/ID"): self.writer._ID or ArrayObject([ByteStringObject(secrets.token_bytes(16))] * 2),
+        })
+        if self.info is not None:
+            trailer[NameObject("/Info")] = IndirectObject(self.numbers[self.info], 0, self.writer)
+        if self.encrypt is not None:
+            trailer[NameObject("/Encrypt")] = IndirectObject(self.numbers[self.encrypt], 0, self.writer)
+        buffer = BytesIO()
+        buffer.write(f"xref\n{self.linearization_number} {len(offsets)}\n".encode())
+        for offset in offsets:
+            buffer.write(f"{offset:010} 00000 n \n".encode())
+        buffer.write(b"trailer\n")
+        trailer.write_to_stream(buffer)
+        # the offset of the main table is written padded, so that the size doesn't depend on it
+        data = buffer.getvalue()
+        return data[:-2] + f"/Prev {main_xref:{_NUMBER_WIDTH}}\n>>\nstartxref\n0\n%%EOF\n".encode()
+
+    def _linearization_dictionary(self, length: int, hint_offset: int, hint_length: int, first_page_end: int,
+                                  main_xref_entries: int) -> bytes:
+        w = _NUMBER_WIDTH
+        return (f"{self.linearization_number} 0 obj\n<< /Linearized 1 /L {length:{w}} /H [ {hint_offset:{w}} "
+                f"{hint_length:{w}} ] /O {self.numbers[self.pages[0]]} /E {first_page_end:{w}} /N {len(self.pages)} "
+                f"/T {main_xref_entries:{w}} >>\nendobj\n").encode()
+
+    def write(self, stream: BinaryIO) -> None:
+        header = f"{self.writer.pdf_header}\n".encode() + b"%\xe2\xe3\xcf\xd3\n"
+        first_half = self.part4 + self.part6
+        linearization_length = len(self._linearization_dictionary(0, 0, 0, 0, 0))
+        xref_length = len(self._first_page_xref([0] * (len(first_half) + 2), 0))
+
+        # lay everything out without the hint stream first, as the hint tables have it
+        position = len(header) + linearization_length + xref_length
+        offsets: dict[int, int] = {}
+        for o in self.part4:
+            offsets[o] = position
+            position += len(self.blobs[o])
+        hint_offset = position
+        second_half = [o for objects in self.part7 for o in objects] + self.part8 + self.part9
+        page_ends = []
+        for objects in [self.part6] + self.part7[1:]:
+            for o in objects:
+                offsets[o] = position
+                position += len(self.blobs[o])
+            page_ends.append(position)
+        for o in self.part8 + self.part9:
+            offsets[o] = position
+            position += len(self.blobs[o])
+
+        hint = self._hint_stream(offsets, page_ends)
+        for o in self.part6 + second_half:
+            offsets[o] += len(hint)
+        first_page_end = page_ends[0] + len(hint)
+        main_xref = position + len(hint)
+        main_header = f"xref\n0 {self.second_half_size}\n".encode()
+
+        main = BytesIO()
+        main.write(main_header)
+        main.write(b"0000000000 65535 f \n")
+        for o in second_half:
+            main.write(f"{offsets[o]:010} 00000 n \n".encode())
+        main.write(f"trailer\n<< /Size {self.second_half_size} >>\nstartxref\n{len(header) + linearization_length}\n"
+                   f"%%EOF\n".encode())
+        length = main_xref + len(main.getvalue())
+
+        first_offsets = [len(header)] + [offsets[o] for o in first_half] + [hint_offset]
+        stream.write(header)
+        stream.write(self._linearization_dictionary(length, hint_offset, len(hint), first_page_end,
+                                                    main_xref + len(main_header) - 1))
+        stream.write(self._first_page_xref(first_offsets, main_xref))
+        for o in self.part4:
+            stream.write(self.blobs[o])
+        stream.write(hint)
+        for o in self.part6 + second_half:
+            stream.write(self.blobs[o])
+        stream.write(main.getvalue())
+
+
+def write_linearized(writer: PdfWriter, stream: BinaryIO, encryption: Optional[Encryption] = None) -> None:
+    """
+    Write the document of `writer` to `stream` linearized ("fast web view"): the first page comes first, along with a
+    hint stream locating every other page, so that a viewer reading the file over HTTP range requests can show any
+    page without fetching the whole file. The objects are renumbered and laid out in memory before anything is
+    written, so the stream doesn't need to be seekable.
+    :param encryption: Encryption of the document. Has to be given if the writer's is wrapped (see
+                       `file._PooledEncryption`), as the objects are encrypted under their new numbers.
+    """
+
+    writer._resolve_links()
+    linearizer = _Linearizer(writer, encryption if encryption is not None else writer._encryption)
+    linearizer.partition()
+    linearizer.number()
+    linearizer.serialize()
+    linearizer.write(stream)
+    _logger.debug(f"wrote {len(linearizer.numbers)} objects linearized ({len(linearizer.part4)} to open the document, "
+                  f"{len(linearizer.part6)} for the first page, {len(linearizer.part8)} shared)")
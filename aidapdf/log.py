@@ -5,6 +5,7 @@ from typing import Optional
 import colors
 
 from aidapdf.config import Config, ansicolor
+from aidapdf.progress import Progress
 
 
 class Logger:
@@ -31,6 +32,8 @@ class Logger:
 
     def _log(self, message: str, level: int) -> None:
         if level <= Config.VERBOSITY_LEVEL:
+            if Progress.current:
+                Progress.current.clear()
             prefix = f"{Logger.LEVELS[level]}:{self._name}"
             print(ansicolor(prefix, fg=Logger.LEVEL_COLORS[level], style='bold') + '  ' +
                   ansicolor(message, fg='white'), file=sys.stderr)
@@ -0,0 +1,88 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Optional, TYPE_CHECKING
+
+from pypdf import PageObject
+
+from aidapdf import cache, util
+from aidapdf.config import Config
+from aidapdf.log import Logger
+from aidapdf.progress import Progress
+
+
+_logger = Logger(__name__)
+
+if TYPE_CHECKING:
+    from aidapdf.file import PdfFile
+
+
+PageFunction = Callable[[PageObject], Any]
+
+_CHUNK_SIZE = 64
+
+
+_worker_state: dict[tuple[str, Optional[str], Callable[[], PageFunction]], tuple['PdfFile', PageFunction]] = {}
+"""The file each worker process has open, with its page function, so that a worker only parses the file once."""
+
+
+def _map_chunk(path: str, password: Optional[str], make: Callable[[], PageFunction],
+               indices: list[int]) -> list[tuple[int, Any]]:
+    """Apply the page function made by `make` to some pages of the file `path`. Runs in a worker process."""
+
+    # imported here because the file module uses this one
+    from aidapdf.file import PdfFile
+
+    key = (path, password, make)
+    if key not in _worker_state:
+        file = PdfFile(path, password=password, interactive=False)
+        file.get_reader_unsafe()
+        _worker_state[key] = (file, make())
+    file, fn = _worker_state[key]
+    return [(i, fn(page)) for i, page in zip(indices, file.get_pages(indices=indices))]
+
+
+def map_pages(file: 'PdfFile', indices: list[int], make: Callable[[], PageFunction], kind: str, version: int,
+              jobs: Optional[int] = None, progress: Optional[Progress] = None) -> dict[int, Any]:
+    """
+    Apply a function to the pages `indices` of `file` and return the results by index. The reader has to be open.
+    Large files on the disk are split into chunks of pages that a process pool works on. With `Config.CACHE`, the
+    results are kept in the `kind` sidecar, so that only pages that weren't seen before are read.
+    :param make: Returns the function to apply. Called once per process, so the function can keep state (e.g. a
+    digester) across pages. Has to be picklable, i.e. a module level function.
+    :param version: Version of the function's results. Cached results of other versions are ignored.
+    :param jobs: Number of worker processes. Defaults to the number of CPUs.
+    :param progress: Advanced for every page.
+    """
+
+    use_cache = Config.CACHE and file.path is not None
+    cached = cache.load(file.path, kind) if use_cache else None
+    results: dict[int, Any] = {}
+    if cached is not None and cached["version"] == version:
+        results = {int(i): r for i, r in cached["pages"].items()}
+    todo = [i for i in indices if i not in results]
+    if progress is not None:
+        progress.advance(len(indices) - len(todo))
+
+    jobs = jobs or os.cpu_count() or 1
+    # a few chunks per worker even out uneven pages without sending every page to a worker on its own
+    size = max(_CHUNK_SIZE, -(-len(todo) // (jobs * 4)))
+    chunks = [todo[i:i + size] for i in range(0, len(todo), size)]
+    if file.path is not None and jobs > 1 and len(chunks) > 1:
+        _logger.debug(f"reading {util.pluralize(len(todo), 'page')} with {util.pluralize(jobs, 'worker')}")
+        with ProcessPoolExecutor(jobs, initializer=Config.restore, initargs=(Config.dump(),)) as executor:
+            items = ((str(file.path), file.password, make, chunk) for chunk in chunks)
+            for future in util.as_completed_bounded(executor, _map_chunk, items, jobs * 2):
+                result = future.result()
+                results.update(result)
+                if progress is not None:
+                    progress.advance(len(result))
+    else:
+        fn = make()
+        for i, page in zip(todo, file.get_pages(indices=todo)):
+            results[i] = fn(page)
+            if progress is not None:
+                progress.advance()
+
+    if use_cache and todo:
+        cache.store(file.path, kind, {"version": version, "pages": results})
+    return {i: results[i] for i in indices}
@@ -1,7 +1,10 @@
-import string
 import abc
-from typing import Iterator, TYPE_CHECKING, Literal
+import re
+from functools import lru_cache
+from typing import Any, Iterator, TYPE_CHECKING, Literal, Optional
 
+from aidapdf.config import Config
+from aidapdf.features import PAPER_SIZES, shown_size, is_paper_size
 from aidapdf.log import Logger
 
 
@@ -12,14 +15,48 @@ if TYPE_CHECKING:
 
 
 class PageSelectorParserException(Exception):
-    pass
+    def __init__(self, message: str, text: str = "", position: int = 0):
+        self.text = text
+        """The page selector that couldn't be parsed."""
+        self.position = position
+        """Index of the character of `text` where the error is."""
+        if text:
+            message = f"{message} at column {position + 1}\n  {text}\n  {' ' * position}^"
+        super().__init__(message)
 
 
 class PageSelectorBakeException(Exception):
     pass
 
 
-class PageSelectorToken(metaclass=abc.ABCMeta):
+_set = object.__setattr__
+
+
+class _Immutable:
+    """Base of the parts of parsed page selectors, which are cached and shared, so they can't be changed."""
+
+    __slots__ = ()
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def _key(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other: object) -> bool:
+        return type(self) is type(other) and self._key() == other._key()
+
+    def __hash__(self) -> int:
+        return hash((type(self), self._key()))
+
+    def __reduce__(self) -> tuple:
+        # the fields are the arguments of the constructors
+        return type(self), self._key()
+
+
+class PageSelectorToken(_Immutable, metaclass=abc.ABCMeta):
+    __slots__ = ()
+
     @abc.abstractmethod
     def bake(self, file: 'PdfFile') -> list[int]:
         raise NotImplementedError()
@@ -30,8 +67,10 @@ def _ntos(n: int) -> str:
 
 
 class PageSelectorNumberToken(PageSelectorToken):
+    __slots__ = ('number',)
+
     def __init__(self, number: int):
-        self.number = number
+        _set(self, 'number', number)
 
     def bake(self, file: 'PdfFile') -> list[int]:
         page_count = file.get_page_count()
@@ -46,41 +85,123 @@ class PageSelectorNumberToken(PageSelectorToken):
         return _ntos(self.number)
 
 
-class PageSelectorCondition:
+class PageSelectorCondition(_Immutable):
     IS_EVEN = 0
     IS_ODD = 1
+    IS_BLANK = 2
+    IS_LANDSCAPE = 3
+    IS_PORTRAIT = 4
+    HAS_IMAGES = 5
+    HAS_TEXT = 6
+    IS_SIZE = 7
+
+    NAMES = {
+        "even": IS_EVEN,
+        "odd": IS_ODD,
+        "blank": IS_BLANK,
+        "landscape": IS_LANDSCAPE,
+        "portrait": IS_PORTRAIT,
+        "hasimages": HAS_IMAGES,
+        "hastext": HAS_TEXT,
+    }
+    """Names of the conditions in page selectors. The paper sizes of `features.PAPER_SIZES` are conditions too."""
+
+    __slots__ = ('call', 'paper')
+
+    def __init__(self, call: int, paper: Optional[str] = None):
+        assert call in self.NAMES.values() or call == self.IS_SIZE
+        assert (call == self.IS_SIZE) == (paper is not None)
+        _set(self, 'call', call)
+        _set(self, 'paper', paper)
+
+    @staticmethod
+    def from_name(name: str) -> Optional['PageSelectorCondition']:
+        """Return the condition called `name`, or `None` if there's none."""
 
-    def __init__(self, call: int):
-        assert call in (self.IS_EVEN, self.IS_ODD)
-        self.call = call
+        if name in PageSelectorCondition.NAMES:
+            return PageSelectorCondition(PageSelectorCondition.NAMES[name])
+        if name in PAPER_SIZES:
+            return PageSelectorCondition(PageSelectorCondition.IS_SIZE, name)
+        return None
 
     def __call__(self, *args, **kwargs) -> bool:
+        """
+        Return whether the page with index `args[0]` meets the condition. Conditions other than odd and even look at the
+        features of the page, so they need the file (`args[1]`) too.
+        """
+
         x = args[0]
         assert type(x) is int
-        x += 1
         if self.call == self.IS_EVEN:
-            return x % 2 == 0
+            return (x + 1) % 2 == 0
         elif self.call == self.IS_ODD:
-            return x % 2 == 1
+            return (x + 1) % 2 == 1
+
+        file: 'PdfFile' = args[1]
+        features = file.get_page_features(x)
+        if self.call == self.IS_BLANK:
+            return not features["paints"]
+        elif self.call == self.IS_LANDSCAPE:
+            width, height = shown_size(features)
+            return width > height
+        elif self.call == self.IS_PORTRAIT:
+            width, height = shown_size(features)
+            return height > width
+        elif self.call == self.HAS_IMAGES:
+            return features["images"] > 0
+        elif self.call == self.HAS_TEXT:
+            return features["text"]
+        elif self.call == self.IS_SIZE:
+            return is_paper_size(features, self.paper)
         else:
             raise NotImplementedError(f"{self.call} not implemented")
 
+    def __str__(self) -> str:
+        if self.call == self.IS_SIZE:
+            return self.paper
+        return next(name for name, call in self.NAMES.items() if call == self.call)
+
+    def __repr__(self) -> str:
+        return '{' + str(self) + '}'
+
+
+class PageSelectorCompoundCondition(_Immutable):
+    """Conditions combined with `and` or `or`."""
+
+    __slots__ = ('op', 'conditions')
+
+    def __init__(self, op: Literal['and', 'or'],
+                 conditions: tuple['PageSelectorCondition | PageSelectorCompoundCondition', ...]):
+        assert op in ('and', 'or') and len(conditions) >= 2
+        _set(self, 'op', op)
+        _set(self, 'conditions', conditions)
+
+    def __call__(self, *args, **kwargs) -> bool:
+        """Return whether the page with index `args[0]` of the file `args[1]` meets the conditions."""
+
+        if self.op == 'and':
+            return all(condition(*args) for condition in self.conditions)
+        return any(condition(*args) for condition in self.conditions)
+
+    def __str__(self) -> str:
+        return f" {self.op} ".join(map(str, self.conditions))
+
     def __repr__(self) -> str:
-        return (
-                '{' + {
-                    PageSelectorCondition.IS_ODD: "odd",
-                    PageSelectorCondition.IS_EVEN: "even"
-                }[self.call] + '}'
-        )
+        return '{' + str(self) + '}'
 
 
 class PageSelectorRangeToken(PageSelectorToken):
     ALL: 'PageSelectorRangeToken'
 
-    def __init__(self, start: int, end: int = -1):
-        self.start = start
-        self.end = end
-        self.condition: PageSelectorCondition | None = None
+    __slots__ = ('start', 'end', 'condition', 'exclude')
+
+    def __init__(self, start: int, end: int = -1,
+                 condition: PageSelectorCondition | PageSelectorCompoundCondition | None = None,
+                 exclude: Optional[PageSelectorToken] = None):
+        _set(self, 'start', start)
+        _set(self, 'end', end)
+        _set(self, 'condition', condition)
+        _set(self, 'exclude', exclude)
 
     def bake(self, file: 'PdfFile'):
         page_count = file.get_page_count()
@@ -97,20 +218,21 @@ class PageSelectorRangeToken(PageSelectorToken):
         end = self.end - 1 if self.end >= 0 else page_count + self.end
 
         # handle condition
-        if self.condition:
-            # is odd condition
-            if self.condition.call == PageSelectorCondition.IS_ODD:
-                if (start+1) % 2 == 0: start += 1
-                return list(range(start, end+1, 2))
-            # is even condition
-            elif self.condition.call == PageSelectorCondition.IS_EVEN:
-                if (start+1) % 2 == 1: start += 1
-                return list(range(start, end+1, 2))
-            # another condition
-            else:
-                return list(filter(self.condition.__call__, range(start, end+1)))
+        if isinstance(self.condition, PageSelectorCondition) and self.condition.call == PageSelectorCondition.IS_ODD:
+            if (start+1) % 2 == 0: start += 1
+            pages = list(range(start, end+1, 2))
+        elif isinstance(self.condition, PageSelectorCondition) and self.condition.call == PageSelectorCondition.IS_EVEN:
+            if (start+1) % 2 == 1: start += 1
+            pages = list(range(start, end+1, 2))
+        elif self.condition:
+            pages = [i for i in range(start, end+1) if self.condition(i, file)]
         else:
-            return list(range(start, end+1))
+            pages = list(range(start, end+1))
+
+        if self.exclude:
+            excluded = set(self.exclude.bake(file))
+            pages = [i for i in pages if i not in excluded]
+        return pages
 
     def __str__(self):
         if self.start == 1 and self.end == -1:
@@ -118,98 +240,31 @@ class PageSelectorRangeToken(PageSelectorToken):
         else:
             rng = _ntos(self.start) + "-" + _ntos(self.end)
 
-        return rng + (repr(self.condition) if self.condition else '')
+        return rng + (repr(self.condition) if self.condition else '') + \
+            ('!' + str(self.exclude) if self.exclude else '')
 
 
 PageSelectorRangeToken.ALL = PageSelectorRangeToken(1)
 
 
-class PageSelector:
+class PageSelector(_Immutable):
     ALL: 'PageSelector'
 
+    __slots__ = ('tokens',)
+
     @staticmethod
     def parse(text: str) -> 'PageSelector':
+        """
+        Parse a page selector (see docs/aida-page-selector.md). Parsed selectors are cached, so parsing the same
+        selector again is almost free.
+        :raise PageSelectorParserException: If `text` isn't a valid page selector.
+        """
+
         assert type(text) is str
+        return _parse(text)
 
-        toks = _lex(text)
-        toktype = None
-        res: list[PageSelectorToken] = []
-        parsing_condition = False
-        condition: PageSelectorCondition | None = None
-
-        for tok in toks:
-            assert type(tok) is str or type(tok) is int
-
-            if parsing_condition:
-                if type(tok) is str:
-                    if tok == '}':
-                        parsing_condition = False
-                        last = res[-1]
-                        if isinstance(last, PageSelectorRangeToken):
-                            last.condition = condition
-                        else:
-                            raise PageSelectorParserException(f"invalid token {repr(tok)}")
-                    elif tok == 'even':
-                        condition = PageSelectorCondition(PageSelectorCondition.IS_EVEN)
-                    elif tok == 'odd':
-                        condition = PageSelectorCondition(PageSelectorCondition.IS_ODD)
-                    else:
-                        raise PageSelectorParserException(f"invalid or unspecified condition expression: {repr(tok)}")
-                else:
-                    raise PageSelectorParserException(f"can't have numbers in condition expression: {repr(tok)}")
-            else:
-                if type(tok) is str:
-                    if tok == ',':
-                        toktype = None
-                    elif tok == '-':
-                        last = res[-1]
-                        if isinstance(last, PageSelectorNumberToken):
-                            toktype = PageSelectorRangeToken
-                            res[-1] = PageSelectorRangeToken(last.number)
-                        else:
-                            raise PageSelectorParserException(f"invalid token {repr(tok)}")
-                    elif tok == '*':
-                        if toktype is None:
-                            res.append(PageSelectorRangeToken.ALL)
-                            toktype = PageSelectorRangeToken
-                        else:
-                            raise PageSelectorParserException(f"invalid token {repr(tok)}")
-                    elif tok == '{':
-                        if toktype is PageSelectorRangeToken and not parsing_condition:
-                            parsing_condition = True
-                        else:
-                            raise PageSelectorParserException(f"invalid token {repr(tok)}; must follow condition and can't nest")
-                    elif tok in ['even', 'odd']:
-                        if toktype is None:
-                            rng = PageSelectorRangeToken(1)
-                            if tok == 'even':
-                                rng.condition = PageSelectorCondition(PageSelectorCondition.IS_EVEN)
-                            else:
-                                rng.condition = PageSelectorCondition(PageSelectorCondition.IS_ODD)
-                            res.append(rng)
-                        else:
-                            raise PageSelectorParserException(f"invalid token {repr(tok)}")
-                    else:
-                        raise PageSelectorParserException(f"invalid token {repr(tok)}")
-                elif type(tok) is int:
-                    if toktype is None:
-                        res.append(PageSelectorNumberToken(tok))
-                    elif toktype is PageSelectorRangeToken:
-                        rng = res[-1]
-                        assert isinstance(rng, PageSelectorRangeToken)
-                        rng.end = tok
-                    else:
-                        raise PageSelectorParserException(f"invalid token {repr(tok)}")
-
-        if len(res) == 0:
-            res = [PageSelectorRangeToken.ALL]
-
-        ret = PageSelector(res)
-        _logger.debug(f"parsed {repr(text)} {toks} as {ret}")
-        return ret
-
-    def __init__(self, tokens: list[PageSelectorToken]):
-        self.tokens = tokens
+    def __init__(self, tokens: Iterator[PageSelectorToken] | list[PageSelectorToken] | tuple[PageSelectorToken, ...]):
+        _set(self, 'tokens', tuple(tokens))
 
     def bake(self, file: 'PdfFile') -> Iterator[int]:
         baked = map(lambda t: t.bake(file), self.tokens)
@@ -223,78 +278,151 @@ class PageSelector:
 
 PageSelector.ALL = PageSelector([PageSelectorRangeToken.ALL])
 
-READING_ANY = 0
-READING_NUM = 1
-READING_ID = 2
-
-def _lex(text: str) -> list[str | int]:
-    reading = READING_ANY
-    tok = ""
-    toks: list[str | int] = []
-
-    def _push(t: str):
-        nonlocal reading
-        if t:
-            if reading == READING_NUM:
-                t = int(t)
-            toks.append(t)
-        reading = READING_ANY
-
-    def push_and_clear(*ts):
-        nonlocal reading, tok
-        if not ts: raise Exception("no tokens supplied")
-        for t in ts:
-            _push(t)
-        tok = ""
-
-    parenthesis_depth = 0
-
-    i = 0
-    for c in text:
-        if c == ',':
-            push_and_clear(tok, ',')
-        elif c in string.digits:
-            reading = READING_NUM
-            tok += c
-        elif c == '^':
-            reading = READING_NUM
-            tok += '-'
-        elif c == '-':
-            if reading in [READING_NUM, READING_ANY]:
-                push_and_clear(tok, '-')
-                reading = READING_NUM
-            else:
-                raise PageSelectorParserException(f"invalid char {repr(c)} # {i}")
-        elif c == '*':
-            if reading == READING_ANY:
-                push_and_clear('*')
-            else:
-                raise PageSelectorParserException(f"invalid char {repr(c)} # {i}")
-        elif c == '{':
-            push_and_clear(tok, '{')
-            parenthesis_depth += 1
-        elif c == '}':
-            push_and_clear(tok, '}')
-            if parenthesis_depth <= 0:
-                raise PageSelectorParserException(f"invalid char {repr(c)} # {i} (no parenthesis to close)")
-            parenthesis_depth -= 1
-        elif c in string.ascii_letters:
-            if reading == READING_ANY or reading == READING_ID:
-                reading = READING_ID
-                tok += c
-            else:
-                raise PageSelectorParserException(f"invalid char {repr(c)} # {i}")
-        elif c in string.whitespace:
-            push_and_clear(tok)
-        else:
-            raise PageSelectorParserException(f"invalid char {repr(c)} # {i}")
 
-        i += 1
+_TOKEN = re.compile(r"\s*(?:(\^?[0-9]+)|([A-Za-z][A-Za-z0-9]*|[,*{}!|&-])|(\S))")
+
+_END = None
+"""The token after the last one."""
 
-    if parenthesis_depth > 0:
-        raise PageSelectorParserException(str(parenthesis_depth) + " unclosed parenthes" + ("is" if parenthesis_depth == 1 else "es"))
 
-    if tok:
-        push_and_clear(tok)
+def _lex(text: str) -> tuple[list[int | str | None], list[int]]:
+    """
+    Split a page selector into tokens: numbers (negative for `^n`), and words and symbols as strings, followed by
+    `_END`. Also return the position of every token in `text`.
+    """
 
-    return toks
+    tokens: list[int | str | None] = []
+    positions = []
+    for m in _TOKEN.finditer(text):
+        number, word, invalid = m.groups()
+        if invalid:
+            raise PageSelectorParserException(f"invalid character {repr(invalid)}", text, m.start(3))
+        if number:
+            tokens.append(-int(number[1:]) if number[0] == "^" else int(number))
+            positions.append(m.start(1))
+        else:
+            tokens.append(word)
+            positions.append(m.start(2))
+    tokens.append(_END)
+    positions.append(len(text))
+    return tokens, positions
+
+
+class _Parser:
+    """A recursive-descent parser for the page selector grammar (see docs/aida-page-selector.md)."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens, self.positions = _lex(text)
+        self.i = 0
+
+    def _accept(self, *values: str) -> bool:
+        token = self.tokens[self.i]
+        if type(token) is str and token in values:
+            self.i += 1
+            return True
+        return False
+
+    def _error(self, message: str) -> PageSelectorParserException:
+        token = self.tokens[self.i]
+        found = "end of selector" if token is _END else repr(_ntos(token) if type(token) is int else token)
+        return PageSelectorParserException(f"{message}, found {found}", self.text, self.positions[self.i])
+
+    def _spaced(self) -> bool:
+        """
+        Return whether whitespace comes before the current token. Whitespace between two tokens separates them like a
+        comma: `1 2` is `1,2`.
+        """
+
+        position = self.positions[self.i]
+        return self.tokens[self.i] is not _END and position > 0 and self.text[position - 1].isspace()
+
+    def spec(self) -> PageSelector:
+        tokens = []
+        while True:
+            # empty elements (leading, repeated or trailing commas) are skipped: "1,,2," is "1,2"
+            separated = not tokens or self._spaced()
+            while self.tokens[self.i] == ",":
+                self.i += 1
+                separated = True
+            if self.tokens[self.i] is _END:
+                break
+            if not separated:
+                raise self._error("expected ',' or end of selector")
+            tokens.append(self.token())
+        return PageSelector(tokens) if tokens else PageSelector.ALL
+
+    def token(self) -> PageSelectorToken:
+        token = self.tokens[self.i]
+        if type(token) is int:
+            self.i += 1
+            if self.tokens[self.i] != "-":
+                return PageSelectorNumberToken(token)
+            self.i += 1
+            end = self.tokens[self.i]
+            if type(end) is int:
+                self.i += 1
+            else:
+                # the end can be left out: "3-" is "3-^1"
+                end = -1
+            return PageSelectorRangeToken(token, end, self._braced_condition(), self._exclude())
+        if token == "*":
+            self.i += 1
+            return PageSelectorRangeToken(1, -1, self._braced_condition(), self._exclude())
+        if token == "{":
+            return PageSelectorRangeToken(1, -1, self._braced_condition(), self._exclude())
+        if token == "!":
+            return PageSelectorRangeToken(1, -1, None, self._exclude())
+        if type(token) is str and token[0].isalpha():
+            return PageSelectorRangeToken(1, -1, self.condition(), self._exclude())
+        raise self._error("expected a page number, a range, a condition or '!'")
+
+    def _braced_condition(self) -> PageSelectorCondition | PageSelectorCompoundCondition | None:
+        if self.tokens[self.i] != "{":
+            return None
+        self.i += 1
+        condition = self.condition()
+        if self.tokens[self.i] != "}":
+            raise self._error("expected '}' or an operator")
+        self.i += 1
+        return condition
+
+    def _exclude(self) -> Optional[PageSelectorToken]:
+        if self.tokens[self.i] != "!":
+            return None
+        self.i += 1
+        return self.token()
+
+    def condition(self) -> PageSelectorCondition | PageSelectorCompoundCondition:
+        # "and" binds tighter than "or"
+        conditions = [self._and_condition()]
+        while self._accept("or", "|"):
+            conditions.append(self._and_condition())
+        return conditions[0] if len(conditions) == 1 else PageSelectorCompoundCondition("or", tuple(conditions))
+
+    def _and_condition(self) -> PageSelectorCondition | PageSelectorCompoundCondition:
+        conditions = [self._keyword()]
+        while self._accept("and", "&"):
+            conditions.append(self._keyword())
+        return conditions[0] if len(conditions) == 1 else PageSelectorCompoundCondition("and", tuple(conditions))
+
+    def _keyword(self) -> PageSelectorCondition:
+        token = self.tokens[self.i]
+        condition = _CONDITIONS.get(token) if type(token) is str else None
+        if condition is None:
+            raise self._error("expected a condition")
+        self.i += 1
+        return condition
+
+
+_CONDITIONS = {name: PageSelectorCondition.from_name(name)
+               for name in [*PageSelectorCondition.NAMES, *PAPER_SIZES]}
+"""The conditions by name. They're immutable, so they're shared by all parsed selectors."""
+
+
+@lru_cache(maxsize=4096)
+def _parse(text: str) -> PageSelector:
+    ret = _Parser(text).spec()
+    if Config.DEBUG_SHOWN:
+        _logger.debug(f"parsed {repr(text)} as {ret}")
+    return ret
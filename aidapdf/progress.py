@@ -0,0 +1,146 @@
+import json
+import os
+import sys
+import time
+from os import PathLike
+from typing import Optional, Iterable, Iterator, TypeVar, IO
+
+from aidapdf.config import Config, ansicolor
+
+
+T = TypeVar('T')
+
+
+def _format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}"
+    return f"{seconds // 60}:{seconds % 60:02}"
+
+
+class Progress:
+    """
+    Reports the progress of a loop: a progress bar on stderr (`--progress`, only if stderr is a terminal) or periodic
+    JSON records (`--progress-json`). When neither is enabled, `track()` returns the iterable as is and the other
+    methods return right away, so disabled progress reporting costs nothing. Use with a `with` statement.
+    """
+
+    BAR_INTERVAL = 0.1
+    JSON_INTERVAL = 1.0
+    BAR_WIDTH = 30
+
+    current: Optional['Progress'] = None
+    """The enabled progress reporter of the running loop, if any."""
+
+    def __init__(self, label: str, total: Optional[int] = None, unit: str = 'page'):
+        self.label = label
+        self.total = total
+        self.unit = unit
+        self.done = 0
+        self.bytes_written = 0
+
+        self.mode = Config.PROGRESS
+        if self.mode == 'bar' and not sys.stderr.isatty():
+            self.mode = None
+        self.enabled = self.mode is not None
+        self._stream: IO = sys.stderr
+        if self.mode == 'json' and Config.PROGRESS_FILE != '-':
+            self._stream = open(Config.PROGRESS_FILE, 'a')
+        self._interval = self.BAR_INTERVAL if self.mode == 'bar' else self.JSON_INTERVAL
+        self._start = time.monotonic()
+        self._next_report = self._start
+        if self.enabled:
+            Progress.current = self
+
+    def track(self, iterable: Iterable[T]) -> Iterable[T]:
+        """Iterate over `iterable`, counting every item as one unit done."""
+        if not self.enabled:
+            return iterable
+        return self._track(iterable)
+
+    def _track(self, iterable: Iterable[T]) -> Iterator[T]:
+        for x in iterable:
+            yield x
+            self.advance()
+
+    def advance(self, n: int = 1) -> None:
+        if not self.enabled:
+            return
+        self.done += n
+        now = time.monotonic()
+        if now >= self._next_report:
+            self._report(now)
+
+    def add_bytes(self, n: int) -> None:
+        """Count `n` bytes as written."""
+        if not self.enabled:
+            return
+        self.bytes_written += n
+
+    @staticmethod
+    def count_written(path: str | PathLike) -> None:
+        """Count the size of the written file `path` as written bytes of the current loop, if there is one."""
+        if Progress.current is not None:
+            Progress.current.add_bytes(os.path.getsize(path))
+
+    def _rates(self, now: float) -> tuple[float, float, Optional[float], Optional[float]]:
+        elapsed = max(now - self._start, 1e-9)
+        rate = self.done / elapsed
+        eta = (self.total - self.done) / rate if self.total is not None and rate > 0 else None
+        return elapsed, rate, self.bytes_written / elapsed / 1e6, eta
+
+    def _report(self, now: float, finished: bool = False) -> None:
+        self._next_report = now + self._interval
+        elapsed, rate, mb_rate, eta = self._rates(now)
+        if self.mode == 'json':
+            record = {
+                "event": "done" if finished else "progress",
+                "label": self.label,
+                "unit": self.unit,
+                "done": self.done,
+                "total": self.total,
+                "elapsed": round(elapsed, 3),
+                "rate": round(rate, 3),
+                "bytes": self.bytes_written,
+                "mb_per_sec": round(mb_rate, 3),
+                "eta": round(eta, 3) if eta is not None else None,
+            }
+            self._stream.write(json.dumps(record) + '\n')
+            self._stream.flush()
+            return
+
+        if self.total:
+            filled = self.BAR_WIDTH * min(self.done, self.total) // self.total
+            bar = f"[{'#' * filled}{'.' * (self.BAR_WIDTH - filled)}] {100 * self.done // self.total:3}% "
+            count = f"{self.done}/{self.total}"
+        else:
+            bar = ""
+            count = str(self.done)
+        text = (f"{self.label} {bar}{count} {self.unit}s  {rate:.1f} {self.unit}s/s  {mb_rate:.2f} MB/s  " +
+                (f"elapsed {_format_duration(elapsed)}" if finished or eta is None else f"ETA {_format_duration(eta)}"))
+        self._stream.write('\r\033[K' + ansicolor(text, stream=self._stream, fg=Config.COLOR_VALUE))
+        if finished:
+            self._stream.write('\n')
+        self._stream.flush()
+
+    def clear(self) -> None:
+        """Erase the progress bar, so that something else can be printed on its line. It's redrawn later."""
+        if self.mode == 'bar':
+            self._stream.write('\r\033[K')
+            self._next_report = 0
+
+    def close(self) -> None:
+        if not self.enabled:
+            return
+        self._report(time.monotonic(), finished=True)
+        self.enabled = False
+        if Progress.current is self:
+            Progress.current = None
+        if self._stream is not sys.stderr:
+            self._stream.close()
+
+    def __enter__(self) -> 'Progress':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
@@ -0,0 +1,275 @@
+import re
+from typing import Any, Optional
+
+from pypdf import PdfWriter
+from pypdf.generic import DictionaryObject, NameObject
+
+from aidapdf import util
+from aidapdf.log import Logger
+
+
+_logger = Logger(__name__)
+
+
+RESOURCE_CATEGORIES = ("/Font", "/XObject", "/ExtGState", "/ColorSpace", "/Pattern", "/Shading", "/Properties")
+"""Entries of a resource dictionary that map names used in content streams to resources."""
+
+_APPEARANCES = ("/N", "/R", "/D")
+
+_NAME = re.compile(rb"/([^\s/\[\]()<>{}%]*)")
+_ESCAPE = re.compile(rb"#([0-9A-Fa-f]{2})")
+
+
+def content_names(data: bytes) -> set[str]:
+    """
+    Return the names a content stream uses. Every name token counts, including the operands of inline images and the
+    ones inside strings, so some names that aren't resources are returned too, but never too few.
+    """
+
+    names = set()
+    for raw in set(_NAME.findall(data)):
+        if b"#" in raw:
+            raw = _ESCAPE.sub(lambda m: bytes([int(m.group(1), 16)]), raw)
+        names.add("/" + raw.decode('utf-8', 'replace'))
+    return names
+
+
+class ResourcePruner:
+    """
+    Removes the resources pages don't use from their resource dictionaries, so that a few pages of a large document
+    whose pages all share one resource dictionary (with every font and image of the document) don't carry all of it.
+
+    The resource dictionary of a page is replaced by a copy of its own, with only the named resources its content
+    streams use (see `content_names()`), and those used by the form XObjects and annotation appearances that inherit
+    the page's resources. Resources whose name can't be told apart from others (non-ASCII names) are always kept, as are
+    the resource dictionaries of content that can't be decoded.
+    """
+
+    def __init__(self, prune_forms: bool = True, written: Any = None):
+        """
+        :param prune_forms: Also prune the resource dictionaries of the form XObjects the pages use, in place. Only
+                            for objects owned by a `PdfWriter`; the objects of a reader must not be changed.
+        :param written: A `StreamingPdfWriter` whose objects are in the pages (e.g. those of a `Stamp` or an
+                        `Imposer`). It can't read back the objects it has written, so they're left as they are:
+                        resources it wrote are always kept, and content streams it wrote are taken to use only
+                        resources it wrote, as those of stamps and sheets do.
+        """
+
+        self.prune_forms = prune_forms
+        self.written = written
+        self.kept = 0
+        self.dropped = 0
+        self._names: dict[int, tuple[Any, Optional[set[str]]]] = {}
+        """Names used by content streams (see `_stream_names()`), by the id of the stream, kept alive along with it."""
+        self._pruned_forms: dict[int, Any] = {}
+        """Forms whose resources have been pruned, by id, kept alive so that the ids aren't reused."""
+
+    def _is_written(self, obj: Any) -> bool:
+        """Return whether `obj` refers to an object of `written`."""
+        return self.written is not None and util.object_kind(obj) == util.REFERENCE and obj.pdf is self.written
+
+    def _stream_names(self, stream: Any, cache: bool = True) -> Optional[set[str]]:
+        """
+        Return the names a content stream uses, or `None` if it can't be decoded.
+        :param cache: Remember the names, which keeps the stream alive as long as the pruner.
+        """
+
+        cached = self._names.get(id(stream))
+        if cached is not None and cached[0] is stream:
+            return cached[1]
+        try:
+            names: Optional[set[str]] = content_names(stream.get_data())
+        except Exception as e:
+            _logger.debug(f"can't decode a content stream ({type(e).__name__}: {e}); keeping its resources")
+            names = None
+        if cache:
+            self._names[id(stream)] = (stream, names)
+        return names
+
+    def _contents_names(self, contents: Any) -> Optional[set[str]]:
+        if contents is None or self._is_written(contents):
+            return set()
+        contents = contents.get_object()
+        if contents is None:
+            return set()
+        kind = util.object_kind(contents)
+        if kind == util.STREAM:
+            return self._stream_names(contents)
+        if kind != util.ARRAY:
+            return None
+        names: set[str] = set()
+        for part in contents:
+            if self._is_written(part):
+                continue
+            part = part.get_object()
+            part_names = self._stream_names(part) if util.object_kind(part) == util.STREAM else None
+            if part_names is None:
+                return None
+            names |= part_names
+        return names
+
+    def _appearance_names(self, page: DictionaryObject) -> Optional[set[str]]:
+        """Return the names used by the annotation appearances of `page` that don't have resources of their own."""
+
+        names: set[str] = set()
+        annots = page.get("/Annots")
+        if self._is_written(annots):
+            return None
+        annots = annots.get_object() if annots is not None else None
+        if annots is None or util.object_kind(annots) != util.ARRAY:
+            return names
+        for annot in annots:
+            if self._is_written(annot):
+                return None
+            annot = annot.get_object()
+            appearances = annot.get("/AP") if util.object_kind(annot) == util.DICTIONARY else None
+            appearances = appearances.get_object() if appearances is not None else None
+            if appearances is None or util.object_kind(appearances) != util.DICTIONARY:
+                continue
+            for key in _APPEARANCES:
+                appearance = appearances.get(key)
+                appearance = appearance.get_object() if appearance is not None else None
+                if appearance is None:
+                    continue
+                # an appearance is a stream, or a dictionary of streams by appearance state
+                streams = [appearance] if util.object_kind(appearance) == util.STREAM else \
+                    [s.get_object() for s in appearance.values()] if util.object_kind(appearance) == util.DICTIONARY \
+                    else []
+                for stream in streams:
+                    if util.object_kind(stream) != util.STREAM or "/Resources" in stream:
+                        continue
+                    stream_names = self._stream_names(stream)
+                    if stream_names is None:
+                        return None
+                    names |= stream_names
+        return names
+
+    def _pruned(self, resources: DictionaryObject, names: set[str]) -> Optional[DictionaryObject]:
+        """
+        Return a copy of `resources` with only the resources named in `names` and those used by the forms among them
+        that inherit the resources, or `None` if the content of one of those forms can't be decoded.
+        """
+
+        names = set(names)
+        xobjects = resources.get("/XObject")
+        xobjects = xobjects.get_object() if xobjects is not None and not self._is_written(xobjects) else None
+        if xobjects is not None and util.object_kind(xobjects) == util.DICTIONARY:
+            pending = [name for name in xobjects if name in names]
+            while pending:
+                xobject = xobjects.raw_get(pending.pop())
+                if self._is_written(xobject):
+                    continue
+                xobject = xobject.get_object()
+                if util.object_kind(xobject) != util.STREAM or xobject.get("/Subtype") != "/Form":
+                    continue
+                if "/Resources" in xobject:
+                    if self.prune_forms:
+                        if id(xobject) not in self._pruned_forms:
+                            self._pruned_forms[id(xobject)] = xobject
+                            self.prune_form(xobject)
+                    continue
+                form_names = self._stream_names(xobject)
+                if form_names is None:
+                    return None
+                new = form_names - names
+                names |= new
+                pending.extend(name for name in xobjects if name in new)
+
+        out = DictionaryObject(resources)
+        for category in RESOURCE_CATEGORIES:
+            entries = resources.get(category)
+            entries = entries.get_object() if entries is not None and not self._is_written(entries) else None
+            if entries is None or util.object_kind(entries) != util.DICTIONARY:
+                continue
+            kept = DictionaryObject({k: v for k, v in entries.items()
+                                     if k in names or not k.isascii() or self._is_written(v)})
+            self.kept += len(kept)
+            self.dropped += len(entries) - len(kept)
+            out[NameObject(category)] = kept
+        return out
+
+    def prune_form(self, form: Any) -> bool:
+        """
+        Replace the resource dictionary of the form XObject `form` with a pruned copy, in place. Return whether it was.
+        The names the form uses aren't remembered, so that forms made for one page (see `Imposer`) don't pile up.
+        """
+
+        resources = form.get("/Resources")
+        resources = resources.get_object() if resources is not None and not self._is_written(resources) else None
+        if resources is None or util.object_kind(resources) != util.DICTIONARY:
+            return False
+        names = self._stream_names(form, cache=False)
+        if names is None:
+            return False
+        pruned = self._pruned(resources, names)
+        if pruned is None:
+            return False
+        form[NameObject("/Resources")] = pruned
+        return True
+
+    def prune_page(self, page: DictionaryObject) -> bool:
+        """
+        Replace the resource dictionary of `page` with a pruned copy. Return whether it was; the resources of pages
+        whose content can't be decoded are left alone.
+        """
+
+        resources = page.get("/Resources")
+        resources = resources.get_object() if resources is not None and not self._is_written(resources) else None
+        if resources is None or util.object_kind(resources) != util.DICTIONARY:
+            return False
+        names = self._contents_names(page.get("/Contents"))
+        appearance_names = self._appearance_names(page) if names is not None else None
+        if names is None or appearance_names is None:
+            return False
+        pruned = self._pruned(resources, names | appearance_names)
+        if pruned is None:
+            return False
+        page[NameObject("/Resources")] = pruned
+        return True
+
+
+def drop_unreachable(writer: PdfWriter) -> int:
+    """
+    Remove the objects of `writer` that can't be reached from the document catalog, the document information or the
+    encryption dictionary, e.g. resources no page uses anymore. `PdfWriter.write()` writes every object it has, even
+    those nothing refers to. Return how many objects were removed.
+    """
+
+    objects = writer._objects
+    roots = [writer.root_object, writer._info, writer._encrypt_entry]
+    stack = [root.indirect_reference.idnum for root in roots
+             if root is not None and root.indirect_reference is not None]
+    reachable = set()
+    while stack:
+        idnum = stack.pop()
+        if idnum in reachable or not 0 < idnum <= len(objects):
+            continue
+        reachable.add(idnum)
+        direct = [objects[idnum - 1]]
+        while direct:
+            obj = direct.pop()
+            kind = util.object_kind(obj)
+            if kind == util.REFERENCE:
+                if obj.idnum not in reachable:
+                    stack.append(obj.idnum)
+            elif kind == util.STREAM or kind == util.DICTIONARY:
+                direct.extend(obj.values())
+            elif kind == util.ARRAY:
+                direct.extend(obj)
+
+    dropped = 0
+    for i, obj in enumerate(objects):
+        if obj is not None and i + 1 not in reachable:
+            objects[i] = None
+            dropped += 1
+    return dropped
+
+
+def prune_writer(writer: PdfWriter) -> None:
+    """Prune the resources of every page of `writer` (see `ResourcePruner`) and drop the objects left unused."""
+
+    pruner = ResourcePruner()
+    pruned = sum(pruner.prune_page(page) for page in writer.pages)
+    dropped = drop_unreachable(writer)
+    _logger.debug(f"pruned the resources of {util.pluralize(pruned, 'page')} ({pruner.kept} kept, "
+                  f"{pruner.dropped} dropped); removed {util.pluralize(dropped, 'unused object')}")
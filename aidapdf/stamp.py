@@ -0,0 +1,168 @@
+from typing import Literal, Optional
+
+from pypdf import PageObject, PdfWriter
+from pypdf.generic import (ArrayObject, DecodedStreamObject, DictionaryObject, FloatObject, IndirectObject, NameObject,
+                           StreamObject)
+
+from aidapdf.log import Logger
+from aidapdf.streamwriter import StreamingPdfWriter
+
+
+_logger = Logger(__name__)
+
+
+POSITIONS = ["center", "top-left", "top", "top-right", "left", "right", "bottom-left", "bottom", "bottom-right"]
+
+Position = Literal["center", "top-left", "top", "top-right", "left", "right", "bottom-left", "bottom", "bottom-right"]
+
+
+def _unique_name(resources: Optional[DictionaryObject], base: str) -> NameObject:
+    name = base
+    i = 1
+    while resources is not None and name in resources:
+        name = f"{base}{i}"
+        i += 1
+    return NameObject(name)
+
+
+class Stamp:
+    """
+    Draws a page of another PDF file (a watermark, a logo) onto pages. The page is added to the output once, as a form
+    XObject; a stamped page only references it from its resources and draws it with a few bytes of content stream,
+    which pages of the same size and rotation share as well. So stamping adds next to nothing per page.
+    """
+
+    def __init__(self, page: PageObject, position: Position = "center", opacity: float = 1.0, scale: float = 1.0):
+        """
+        :param page: The page to stamp onto other pages.
+        :param position: Where to put the stamp on the visible area of a page, as it's displayed.
+        :param opacity: Opacity of the stamp, from 0 to 1.
+        :param scale: Size of the stamp relative to the size of `page`.
+        """
+
+        if position not in POSITIONS:
+            raise ValueError(f"invalid stamp position {repr(position)}")
+        if not 0 <= opacity <= 1:
+            raise ValueError(f"stamp opacity {opacity} isn't between 0 and 1")
+        if scale <= 0:
+            raise ValueError(f"stamp scale {scale} isn't positive")
+        self.page = page
+        self.position = position
+        self.opacity = opacity
+        self.scale = scale
+
+        self._writer: Optional[PdfWriter | StreamingPdfWriter] = None
+        self._form: Optional[IndirectObject] = None
+        self._gs: Optional[IndirectObject] = None
+        self._save: Optional[IndirectObject] = None
+        self._draws: dict[tuple, IndirectObject] = {}
+
+    def add_to(self, writer: PdfWriter | StreamingPdfWriter) -> None:
+        """Add the stamp to the output of `writer`. Has to be called before pages are stamped."""
+
+        box = self.page.mediabox
+        form = DecodedStreamObject()
+        contents = self.page.get_contents()
+        form.set_data(contents.get_data() if contents is not None else b"")
+        form.update({
+            NameObject("/Type"): NameObject("/XObject"),
+            NameObject("/Subtype"): NameObject("/Form"),
+            NameObject("/BBox"): ArrayObject(FloatObject(x) for x in (box.left, box.bottom, box.right, box.top)),
+        })
+        for key in ("/Resources", "/Group"):
+            if key in self.page:
+                form[NameObject(key)] = self.page.raw_get(key)
+        form = form.flate_encode()
+        if isinstance(writer, PdfWriter):
+            # a PdfWriter doesn't copy objects of other documents by itself
+            form = form.clone(writer)
+        self._form = writer._add_object(form)
+
+        if self.opacity < 1:
+            self._gs = writer._add_object(DictionaryObject({
+                NameObject("/Type"): NameObject("/ExtGState"),
+                NameObject("/CA"): FloatObject(self.opacity),
+                NameObject("/ca"): FloatObject(self.opacity),
+            }))
+        self._save = writer._add_object(self._stream(b"q\n"))
+        self._writer = writer
+        _logger.debug(f"added stamp ({self.position}, opacity {self.opacity}, scale {self.scale})")
+
+    @staticmethod
+    def _stream(data: bytes) -> StreamObject:
+        stream = DecodedStreamObject()
+        stream.set_data(data)
+        return stream
+
+    def _matrix(self, page: PageObject) -> tuple[float, ...]:
+        """Return the matrix that maps the stamp into the visible area of `page`."""
+
+        box = self.page.mediabox
+        width, height = float(box.width) * self.scale, float(box.height) * self.scale
+        crop = page.cropbox
+        x0, y0, w, h = float(crop.left), float(crop.bottom), float(crop.width), float(crop.height)
+        rotation = page.rotation % 360
+        shown_w, shown_h = (w, h) if rotation in (0, 180) else (h, w)
+
+        # lower left corner of the stamp, as the page is displayed
+        horizontal, vertical = {
+            "center": (1, 1), "top-left": (0, 2), "top": (1, 2), "top-right": (2, 2), "left": (0, 1),
+            "right": (2, 1), "bottom-left": (0, 0), "bottom": (1, 0), "bottom-right": (2, 0),
+        }[self.position]
+        dx = (shown_w - width) * horizontal / 2
+        dy = (shown_h - height) * vertical / 2
+
+        s = self.scale
+        if rotation == 90:
+            return 0, s, -s, 0, x0 + w - dy, y0 + dx
+        if rotation == 180:
+            return -s, 0, 0, -s, x0 + w - dx, y0 + h - dy
+        if rotation == 270:
+            return 0, -s, s, 0, x0 + dy, y0 + h - dx
+        return s, 0, 0, s, x0 + dx, y0 + dy
+
+    def stamp(self, page: PageObject) -> PageObject:
+        """Return a copy of `page` with the stamp drawn over it. The copy can be added to the writer."""
+
+        if self._writer is None:
+            raise RuntimeError("stamp hasn't been added to a writer")
+
+        out = PageObject(page.pdf, page.indirect_reference)
+        out.update(page)
+
+        resources = page.get("/Resources")
+        resources = DictionaryObject(resources) if resources is not None else DictionaryObject()
+        xobjects = resources.get("/XObject")
+        xobjects = DictionaryObject(xobjects) if xobjects is not None else DictionaryObject()
+        form_name = _unique_name(xobjects, "/AidaStamp")
+        xobjects[form_name] = self._form
+        resources[NameObject("/XObject")] = xobjects
+        gs_name = None
+        if self._gs is not None:
+            states = resources.get("/ExtGState")
+            states = DictionaryObject(states) if states is not None else DictionaryObject()
+            gs_name = _unique_name(states, "/AidaStampGS")
+            states[gs_name] = self._gs
+            resources[NameObject("/ExtGState")] = states
+        out[NameObject("/Resources")] = resources
+
+        matrix = self._matrix(page)
+        key = (matrix, form_name, gs_name)
+        if key not in self._draws:
+            box = self.page.mediabox
+            data = b"Q\nq\n"
+            if gs_name is not None:
+                data += gs_name.encode() + b" gs\n"
+            data += " ".join(f"{x:g}" for x in matrix).encode() + b" cm\n"
+            data += f"1 0 0 1 {-float(box.left):g} {-float(box.bottom):g} cm\n".encode()
+            data += form_name.encode() + b" Do\nQ\n"
+            self._draws[key] = self._writer._add_object(self._stream(data))
+
+        # the page's own content is wrapped in q/Q, so that whatever state it leaves doesn't affect the stamp
+        contents = []
+        if "/Contents" in page:
+            raw = page.raw_get("/Contents")
+            resolved = raw.get_object()
+            contents = list(resolved) if isinstance(resolved, ArrayObject) else [raw]
+        out[NameObject("/Contents")] = ArrayObject([self._save, *contents, self._draws[key]])
+        return out
@@ -0,0 +1,384 @@
+import os
+from io import BytesIO
+import secrets
+from os import PathLike
+from pathlib import Path
+from typing import Any, Optional, BinaryIO
+from weakref import WeakKeyDictionary
+
+from pypdf import PageObject
+from pypdf._encryption import Encryption, EncryptAlgorithm
+from pypdf.constants import UserAccessPermissions
+from pypdf.errors import PageSizeNotDefinedError
+from pypdf.generic import (PdfObject, IndirectObject, DictionaryObject, ArrayObject, StreamObject,
+                           EncodedStreamObject, DecodedStreamObject, ContentStream, ByteStringObject, NameObject,
+                           NumberObject, NullObject, create_string_object)
+
+from aidapdf import util
+from aidapdf.log import Logger
+from aidapdf.prune import ResourcePruner
+
+
+_logger = Logger(__name__)
+
+
+class Fragment:
+    """
+    Pages written by a `StreamingPdfWriter` without a target: their objects, serialized with the references left
+    unresolved, so that another streaming writer can copy them with `add_fragment()` without parsing them, only filling
+    in the object numbers. Meant to be written in one process and copied in another; it pickles as plain data.
+    """
+
+    def __init__(self):
+        self.objects: list[Optional[tuple[list[bytes], list[int]]]] = []
+        """
+        The serialized objects; object `n` of the fragment is at index `n - 1`, `None` if it wasn't written (object 1,
+        the page tree, is that of the writer the fragment is added to). An object is the parts of its body and the
+        numbers (in the fragment) of the objects referred to between them.
+        """
+        self.pages: list[int] = []
+        """Numbers of the page objects, in order."""
+        self.page_sizes: list[tuple[float, float]] = []
+
+
+def _serialize(obj: PdfObject, buffer: BytesIO, parts: list[bytes], refs: list[int]) -> None:
+    """
+    Write `obj` like `obj.write_to_stream(buffer)` does, but end the current part at every reference: the part written
+    so far is moved from `buffer` to `parts` and the number of the object referred to is appended to `refs`.
+    """
+
+    kind = util.object_kind(obj)
+    if kind == util.REFERENCE:
+        parts.append(buffer.getvalue())
+        buffer.seek(0)
+        buffer.truncate()
+        refs.append(obj.idnum)
+    elif kind == util.DICTIONARY or kind == util.STREAM:
+        buffer.write(b"<<\n")
+        for key, value in obj.items():
+            if kind == util.STREAM and key == "/Length":
+                continue
+            key.write_to_stream(buffer)
+            buffer.write(b" ")
+            _serialize(value, buffer, parts, refs)
+            buffer.write(b"\n")
+        if kind == util.STREAM:
+            buffer.write(f"/Length {len(obj._data)}\n>>\nstream\n".encode())
+            buffer.write(obj._data)
+            buffer.write(b"\nendstream")
+        else:
+            buffer.write(b">>")
+    elif kind == util.ARRAY:
+        buffer.write(b"[")
+        for item in obj:
+            buffer.write(b" ")
+            _serialize(item, buffer, parts, refs)
+        buffer.write(b" ]")
+    else:
+        obj.write_to_stream(buffer)
+
+
+class StreamingPdfWriter:
+    """
+    Stands in for `PdfWriter`, but writes every page to the output file as soon as it's added, instead of keeping the
+    whole document in memory until `write()`. Objects shared between pages (fonts, images) are written once per source
+    document. Only the object offsets, the page references and the numbers of the copied objects are kept, so the memory
+    needed doesn't grow with the size of the output.
+
+    Supports the part of the `PdfWriter` interface the commands use. Pages can't be changed once they're added, and
+    encryption has to be set up before anything is written. References to pages that aren't in the output (yet), e.g.
+    link destinations, are replaced by `null`.
+
+    A document written to a path is written to a temporary file next to it and moved into place by `write()`. A
+    document written to a binary stream is written to it directly, so the stream doesn't need to be seekable. Without a
+    target, the pages are written to a `Fragment` (see `fragment`) instead of a document.
+    """
+
+    def __init__(self, target: Optional[str | PathLike | BinaryIO], prune: bool = False):
+        self.fragment: Optional[Fragment] = Fragment() if target is None else None
+        """The pages written, if there's no target. Complete once `write()` is called."""
+        if isinstance(target, (str, PathLike)):
+            self.path: Optional[Path] = Path(target)
+            self._temp_path: Optional[Path] = self.path.with_name(self.path.name + '.part')
+            self._stream: Optional[BinaryIO] = open(self._temp_path, 'wb')
+        else:
+            self.path = None
+            self._temp_path = None
+            self._stream = target
+        self._position = 0
+        self._finished = False
+        if self.fragment is None:
+            self._out(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+        self._offsets: list[Optional[int]] = []
+        """Offsets of the objects in the output; object number `n` is at index `n - 1`."""
+        self._written = 0
+        self._copied: WeakKeyDictionary[Any, dict[tuple[int, int], int]] = WeakKeyDictionary()
+        """Output object numbers of the copied objects, by source document and source reference."""
+
+        self._pages_ref = IndirectObject(self._reserve(), 0, self)
+        self._page_refs: list[IndirectObject] = []
+        self._page_sizes: list[tuple[float, float]] = []
+        self._info = DictionaryObject()
+        self._pruner: Optional[ResourcePruner] = ResourcePruner(prune_forms=False, written=self) if prune else None
+        """
+        If set, the resource dictionaries of the pages, and of the forms added with `_add_object()` (those of a `Stamp`
+        or an `Imposer`, which wrap pages), are pruned as they're written. Forms of the source documents are left alone.
+        """
+
+        self._ID: Optional[ArrayObject] = None
+        self._encryption: Optional[Encryption] = None
+        self._encrypt_ref: Optional[IndirectObject] = None
+
+    @property
+    def pages(self) -> list[IndirectObject]:
+        """References to the pages of the output. Don't modify."""
+        return self._page_refs
+
+    def add_page(self, page: PageObject) -> None:
+        """Write a copy of `page` and append it."""
+        self.insert_page(page, len(self._page_refs))
+
+    def insert_page(self, page: PageObject, index: int = 0) -> None:
+        """Write a copy of `page` and insert it at `index`."""
+
+        num = self._reserve()
+        # references to the source page (e.g. from its annotations) lead to the copy
+        source = page.indirect_reference
+        if source is not None:
+            self._copied.setdefault(source.pdf, {})[(source.idnum, source.generation)] = num
+        out = DictionaryObject(page)
+        out[NameObject("/Parent")] = self._pages_ref
+        if self._pruner is not None:
+            self._pruner.prune_page(out)
+        self._write(num, self._convert(out))
+
+        self._page_refs.insert(index, IndirectObject(num, 0, self))
+        self._page_sizes.insert(index, (float(page.mediabox.width), float(page.mediabox.height)))
+
+    def add_blank_page(self, width: Optional[float] = None, height: Optional[float] = None) -> None:
+        """Append a blank page. Its size defaults to the size of the last page."""
+        self.insert_blank_page(width, height, len(self._page_refs))
+
+    def insert_blank_page(self, width: Optional[float] = None, height: Optional[float] = None,
+                          index: int = 0) -> None:
+        """Insert a blank page at `index`. Its size defaults to the size of the page currently at `index`."""
+
+        if width is None or height is None:
+            if not self._page_sizes:
+                raise PageSizeNotDefinedError
+            width, height = self._page_sizes[min(index, len(self._page_sizes) - 1)]
+        page = DictionaryObject({
+            NameObject("/Type"): NameObject("/Page"),
+            NameObject("/Parent"): self._pages_ref,
+            NameObject("/MediaBox"): ArrayObject([NumberObject(0), NumberObject(0),
+                                                  NumberObject(width), NumberObject(height)]),
+            NameObject("/Resources"): DictionaryObject(),
+        })
+        self._page_refs.insert(index, self._add_object(page))
+        self._page_sizes.insert(index, (width, height))
+
+    def add_metadata(self, infos: dict[str, Any]) -> None:
+        """Add entries to the document information dictionary. Values are converted to strings."""
+
+        if isinstance(infos, PdfObject):
+            infos = infos.get_object()
+        for key, value in infos.items():
+            if isinstance(value, PdfObject):
+                value = value.get_object()
+            self._info[NameObject(key)] = create_string_object(str(value))
+
+    def encrypt(self, user_password: str, owner_password: Optional[str] = None,
+                algorithm: Optional[str] = None) -> None:
+        """Encrypt the output like `PdfWriter.encrypt()`. Has to be called before anything is written."""
+
+        alg = getattr(EncryptAlgorithm, (algorithm or "RC4-128").replace("-", "_"))
+        id1 = secrets.token_bytes(16)
+        encryption = Encryption.make(alg, UserAccessPermissions.all(), id1)
+        entry = encryption.write_entry(user_password, owner_password or user_password)
+        self.use_encryption(encryption, entry, ArrayObject([ByteStringObject(id1),
+                                                            ByteStringObject(secrets.token_bytes(16))]))
+
+    def use_encryption(self, encryption: Encryption, entry: DictionaryObject, file_id: ArrayObject) -> None:
+        """
+        Encrypt the output with a ready `Encryption`. Has to be called before anything is written.
+        :param entry: The encryption dictionary written by `encryption`.
+        :param file_id: The file identifier `encryption` was made for.
+        """
+
+        if self._written:
+            raise RuntimeError("encryption has to be set up before anything is written")
+        self._ID = file_id
+        self._encrypt_ref = self._add_object(DictionaryObject(entry))
+        self._encryption = encryption
+
+    def _reserve(self) -> int:
+        self._offsets.append(None)
+        return len(self._offsets)
+
+    def _add_object(self, obj: PdfObject) -> IndirectObject:
+        """Write `obj` right away and return a reference to it."""
+        if self._pruner is not None and isinstance(obj, StreamObject) and obj.get("/Subtype") == "/Form":
+            self._pruner.prune_form(obj)
+        num = self._reserve()
+        self._write(num, self._convert(obj))
+        return IndirectObject(num, 0, self)
+
+    def _write(self, num: int, obj: PdfObject) -> None:
+        if self._encryption is not None:
+            obj = self._encryption.encrypt_object(obj, num, 0)
+        if self.fragment is not None:
+            buffer = BytesIO()
+            parts: list[bytes] = []
+            refs: list[int] = []
+            _serialize(obj, buffer, parts, refs)
+            parts.append(buffer.getvalue())
+            objects = self.fragment.objects
+            objects.extend([None] * (num - len(objects)))
+            objects[num - 1] = (parts, refs)
+            self._written += 1
+            return
+        buffer = BytesIO()
+        buffer.write(f"{num} 0 obj\n".encode())
+        obj.write_to_stream(buffer)
+        buffer.write(b"\nendobj\n")
+        self._write_body(num, buffer.getvalue())
+
+    def _write_body(self, num: int, body: bytes) -> None:
+        """Write an object serialized already, with `num 0 obj` and `endobj`."""
+        self._offsets[num - 1] = self._position
+        self._out(body)
+        self._written += 1
+
+    def add_fragment(self, fragment: Fragment) -> None:
+        """
+        Append the pages of `fragment`. Its objects are written as they are, with the references renumbered; nothing is
+        parsed, so they aren't pruned, and can't be encrypted.
+        """
+
+        if self._encryption is not None:
+            raise RuntimeError("a fragment can't be added to an encrypted document")
+        if self.fragment is not None:
+            raise RuntimeError("a fragment can't be added to a fragment")
+        # object 1 of a fragment is the page tree
+        numbers = [self._pages_ref.idnum] + [self._reserve() for _ in fragment.objects[1:]]
+        for num, obj in zip(numbers[1:], fragment.objects[1:]):
+            if obj is None:
+                continue
+            parts, refs = obj
+            body = [f"{num} 0 obj\n".encode(), parts[0]]
+            for ref, part in zip(refs, parts[1:]):
+                body.append(b"%d 0 R" % numbers[ref - 1])
+                body.append(part)
+            body.append(b"\nendobj\n")
+            self._write_body(num, b"".join(body))
+        self._page_refs.extend(IndirectObject(numbers[num - 1], 0, self) for num in fragment.pages)
+        self._page_sizes.extend(fragment.page_sizes)
+
+    def _out(self, data: bytes) -> None:
+        self._stream.write(data)
+        self._position += len(data)
+
+    def _convert(self, obj: PdfObject) -> PdfObject:
+        """Return a copy of the direct object `obj` in which references to other documents point to copies."""
+
+        if isinstance(obj, IndirectObject):
+            return self._copy_ref(obj)
+        if isinstance(obj, StreamObject):
+            res = EncodedStreamObject() if isinstance(obj, EncodedStreamObject) else DecodedStreamObject()
+            # content streams may only hold parsed operations
+            res._data = obj.get_data() if isinstance(obj, ContentStream) else obj._data
+            for k, v in obj.items():
+                # the length is set when the stream is written
+                if k != "/Length":
+                    res[k] = self._convert(v)
+            return res
+        if isinstance(obj, DictionaryObject):
+            res = DictionaryObject()
+            for k, v in obj.items():
+                res[k] = self._convert(v)
+            return res
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self._convert(x) for x in obj)
+        return obj
+
+    def _copy_ref(self, ref: IndirectObject) -> IndirectObject | NullObject:
+        if ref.pdf is self:
+            return ref
+        copied = self._copied.setdefault(ref.pdf, {})
+        num = copied.get((ref.idnum, ref.generation))
+        if num is not None:
+            return IndirectObject(num, 0, self)
+
+        target = ref.get_object()
+        if isinstance(target, DictionaryObject) and target.get("/Type") in ("/Page", "/Pages"):
+            # following it would copy the page (and through its /Parent, the whole document)
+            return NullObject()
+        num = self._reserve()
+        # registered before the target is converted, so that reference cycles end here
+        copied[(ref.idnum, ref.generation)] = num
+        self._write(num, self._convert(target) if target is not None else NullObject())
+        return IndirectObject(num, 0, self)
+
+    def write(self, target: Optional[str | PathLike | BinaryIO] = None) -> None:
+        """
+        Finish the document and, if it's written to a path, move it there. Without a target, finish the fragment.
+        :param target: Has to be the writer's target, if given. Accepted for compatibility with `PdfWriter.write()`.
+        """
+
+        if self.fragment is not None:
+            self.fragment.pages = [ref.idnum for ref in self._page_refs]
+            self.fragment.page_sizes = list(self._page_sizes)
+            self._finished = True
+            return
+        if target is not None and target is not self._stream and \
+                not (self.path is not None and isinstance(target, (str, PathLike)) and Path(target) == self.path):
+            raise ValueError(f"streaming writer can't write to {repr(target)}")
+
+        self._write(self._pages_ref.idnum, DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): ArrayObject(self._page_refs),
+            NameObject("/Count"): NumberObject(len(self._page_refs)),
+        }))
+        root = self._add_object(DictionaryObject({
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): self._pages_ref,
+        }))
+        info = self._add_object(self._info) if self._info else None
+
+        trailer = DictionaryObject({
+            NameObject("/Size"): NumberObject(len(self._offsets) + 1),
+            NameObject("/Root"): root,
+            NameObject("/ID"): self._ID or ArrayObject([ByteStringObject(secrets.token_bytes(16))] * 2),
+        })
+        if info is not None:
+            trailer[NameObject("/Info")] = info
+        if self._encrypt_ref is not None:
+            trailer[NameObject("/Encrypt")] = self._encrypt_ref
+
+        xref = BytesIO()
+        xref.write(f"xref\n0 {len(self._offsets) + 1}\n0000000000 65535 f \n".encode())
+        for offset in self._offsets:
+            # every reserved number is written by now; the check just keeps the table valid if one isn't
+            if offset is None:
+                xref.write(b"0000000000 00000 f \n")
+            else:
+                xref.write(f"{offset:010} 00000 n \n".encode())
+        xref.write(b"trailer\n")
+        trailer.write_to_stream(xref)
+        xref.write(f"\nstartxref\n{self._position}\n%%EOF\n".encode())
+        self._out(xref.getvalue())
+        self._finished = True
+        if self.path is not None:
+            self._stream.close()
+            os.replace(self._temp_path, self.path)
+        _logger.debug(f"wrote {len(self._offsets)} objects to {repr(str(self.path or self._stream))}")
+
+    def close(self) -> None:
+        """Discard the output written to a path if `write()` wasn't called. Streams are left as they are."""
+
+        if self._finished or self.path is None:
+            return
+        self._finished = True
+        self._stream.close()
+        self._temp_path.unlink(missing_ok=True)
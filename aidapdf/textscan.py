@@ -0,0 +1,283 @@
+import re
+from typing import Any, Optional
+
+from pypdf import PageObject
+from pypdf._cmap import get_encoding
+from pypdf.generic import DictionaryObject, IndirectObject
+
+from aidapdf.log import Logger
+
+
+_logger = Logger(__name__)
+
+
+_TOKEN = re.compile(rb"""
+    (?P<space>(?:\s+|%[^\r\n]*)+)
+  | (?P<string>\()
+  | <(?P<hex>[0-9A-Fa-f\s]*)>
+  | (?P<dict><<|>>)
+  | (?P<array>[\[\]])
+  | /(?P<name>[^\s/\[\]()<>{}%]*)
+  | (?P<number>[+-]?(?:\d+\.?\d*|\.\d+))
+  | (?P<op>[^\s/\[\]()<>{}%]+)
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+_ESCAPES = {ord('n'): b"\n", ord('r'): b"\r", ord('t'): b"\t", ord('b'): b"\b", ord('f'): b"\f"}
+
+_INLINE_IMAGE_END = re.compile(rb"\sEI(?=[\s]|$)")
+
+_TJ_SPACE = -200
+"""A `TJ` adjustment below this (in thousandths of the font size) separates words."""
+
+_GLYPH_WIDTH = 0.5
+"""A guess of the average width of a glyph, in font sizes, since the widths of the fonts aren't looked at."""
+_GAP = 0.15
+"""A move to the right this much (in font sizes) beyond the guessed width of the text before it separates words."""
+
+_LINE_TOLERANCE = 0.5
+"""Strings shown less than this far apart vertically (in font sizes) are on the same line, e.g. with superscripts."""
+
+_MAX_FORM_DEPTH = 8
+
+Matrix = tuple[float, float, float, float, float, float]
+
+_IDENTITY: Matrix = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+
+def _multiply(m: Matrix, n: Matrix) -> Matrix:
+    """Return the product of two transformation matrices, `m` applied first."""
+    return (m[0] * n[0] + m[1] * n[2], m[0] * n[1] + m[1] * n[3],
+            m[2] * n[0] + m[3] * n[2], m[2] * n[1] + m[3] * n[3],
+            m[4] * n[0] + m[5] * n[2] + n[4], m[4] * n[1] + m[5] * n[3] + n[5])
+
+
+def _numbers(operands: list[Any], count: int) -> bool:
+    return len(operands) >= count and all(isinstance(x, float) for x in operands[-count:])
+
+
+def _read_string(data: bytes, i: int) -> tuple[bytes, int]:
+    """Read a literal string whose opening parenthesis is just before `i`. Returns the string and the index after it."""
+
+    out = bytearray()
+    depth = 1
+    n = len(data)
+    while i < n:
+        c = data[i]
+        if c == 0x5c:  # backslash
+            i += 1
+            if i >= n:
+                break
+            c = data[i]
+            if c in _ESCAPES:
+                out += _ESCAPES[c]
+            elif 0x30 <= c <= 0x37:
+                # up to three octal digits
+                j = i
+                while j < n and j < i + 3 and 0x30 <= data[j] <= 0x37:
+                    j += 1
+                out.append(int(data[i:j], 8) & 0xff)
+                i = j
+                continue
+            elif c == 0x0d:
+                # an escaped line break is no character at all
+                if i + 1 < n and data[i + 1] == 0x0a:
+                    i += 1
+            elif c != 0x0a:
+                out.append(c)
+        elif c == 0x28:
+            depth += 1
+            out.append(c)
+        elif c == 0x29:
+            depth -= 1
+            if depth == 0:
+                return bytes(out), i + 1
+            out.append(c)
+        else:
+            out.append(c)
+        i += 1
+    return bytes(out), i
+
+
+class _Font:
+    """Decodes the strings shown with a font the same way pypdf does: through its encoding, then its ToUnicode map."""
+
+    def __init__(self, font: Optional[DictionaryObject]):
+        if font is None:
+            self._encoding: str | dict[int, str] = "charmap"
+            self._map: dict[Any, Any] = {}
+        else:
+            self._encoding, self._map = get_encoding(font)
+
+    def decode(self, data: bytes) -> str:
+        if isinstance(self._encoding, str):
+            try:
+                text = data.decode(self._encoding, "surrogatepass")
+            except (UnicodeDecodeError, LookupError):
+                text = data.decode("utf-16-be" if self._encoding == "charmap" else "charmap", "surrogatepass")
+        else:
+            text = "".join(self._encoding.get(x, chr(x)) for x in data)
+        if not self._map:
+            return text
+        return "".join(self._map.get(c, c) for c in text)
+
+
+class TextScanner:
+    """
+    Extracts the text of pages by scanning their content streams for the operators that show text, without working out
+    where each glyph goes. Strings are decoded through the fonts' encodings and ToUnicode maps, like pypdf does; a
+    string shown lower or higher than the last one starts a new line, and large gaps in `TJ` arrays become spaces. Much
+    faster than pypdf's extraction, but the order of the text is the order of the content stream, which isn't always the
+    reading order.
+
+    Fonts are cached by their reference, so a scanner should be kept for the whole document.
+    """
+
+    def __init__(self):
+        self._fonts: dict[tuple[int, int], _Font] = {}
+        self._last_y: Optional[float] = None
+
+    def extract_text(self, page: PageObject) -> str:
+        """Return the text of `page`, ending with a line break if it isn't empty."""
+
+        out: list[str] = []
+        self._last_y = None
+        contents = page.get_contents()
+        if contents is not None:
+            self._scan(contents.get_data(), page.get("/Resources"), out, 0)
+        text = "".join(out).strip(" ")
+        return text + "\n" if text and not text.endswith("\n") else text
+
+    def _font(self, resources: Optional[DictionaryObject], name: str) -> _Font:
+        fonts = resources.get("/Font") if resources is not None else None
+        if fonts is None or name not in fonts:
+            return _Font(None)
+        raw = fonts.raw_get(name)
+        if not isinstance(raw, IndirectObject):
+            return _Font(raw.get_object())
+        key = (raw.idnum, raw.generation)
+        if key not in self._fonts:
+            self._fonts[key] = _Font(raw.get_object())
+        return self._fonts[key]
+
+    def _show(self, out: list[str], text: str, y: float, size: float) -> None:
+        # a string shown on another line than the last starts a new line; this is all the layout there is
+        if self._last_y is not None and abs(y - self._last_y) > _LINE_TOLERANCE * size and out \
+                and not out[-1].endswith("\n"):
+            out.append("\n")
+        self._last_y = y
+        out.append(text)
+
+    def _scan(self, data: bytes, resources: Optional[DictionaryObject], out: list[str], depth: int,
+              ctm: Matrix = _IDENTITY) -> None:
+        font = _Font(None)
+        operands: list[Any] = []
+        stack: list[list[Any]] = []
+        saved: list[Matrix] = []
+        tlm = _IDENTITY
+        leading = 0.0
+        pos = 0
+        n = len(data)
+
+        font_size = 1.0
+        shown = 0
+
+        def show(text: str) -> None:
+            nonlocal shown
+            shown += len(text)
+            y = tlm[4] * ctm[1] + tlm[5] * ctm[3] + ctm[5]
+            scale = abs(tlm[2] * ctm[1] + tlm[3] * ctm[3])
+            self._show(out, text, y, font_size * scale)
+
+        while pos < n:
+            m = _TOKEN.match(data, pos)
+            pos = m.end()
+            kind = m.lastgroup
+            if kind == "space" or kind == "other":
+                continue
+            if kind == "string":
+                value, pos = _read_string(data, pos)
+            elif kind == "hex":
+                digits = re.sub(rb"\s", b"", m.group("hex"))
+                value = bytes.fromhex((digits + b"0" * (len(digits) % 2)).decode())
+            elif kind == "name":
+                value = "/" + m.group("name").decode('latin-1')
+            elif kind == "number":
+                value = float(m.group("number"))
+            elif kind == "array" or kind == "dict":
+                if m.group(kind) in (b"[", b"<<"):
+                    stack.append(operands)
+                    operands = []
+                else:
+                    value, operands = operands, stack.pop() if stack else []
+                    operands.append(value)
+                continue
+            else:
+                op = m.group("op")
+                if op == b"Tj" and operands and isinstance(operands[-1], bytes):
+                    show(font.decode(operands[-1]))
+                elif op == b"TJ" and operands and isinstance(operands[-1], list):
+                    for item in operands[-1]:
+                        if isinstance(item, bytes):
+                            show(font.decode(item))
+                        elif isinstance(item, float) and item < _TJ_SPACE and out \
+                                and not out[-1].endswith((" ", "\n")):
+                            out.append(" ")
+                elif op in (b"'", b'"') and operands:
+                    shown = 0
+                    tlm = _multiply((1, 0, 0, 1, 0, -leading), tlm)
+                    if isinstance(operands[-1], bytes):
+                        show(font.decode(operands[-1]))
+                elif op == b"Tf" and len(operands) >= 2 and isinstance(operands[-2], str):
+                    font = self._font(resources, operands[-2])
+                    if isinstance(operands[-1], float):
+                        font_size = operands[-1]
+                elif op in (b"Td", b"TD") and _numbers(operands, 2):
+                    # moving right on the same line past (a guess of) the width of what was shown since the start of
+                    # the line leaves a gap
+                    if operands[-1] == 0 and operands[-2] > (shown * _GLYPH_WIDTH + _GAP) * font_size and out \
+                            and not out[-1].endswith((" ", "\n")):
+                        out.append(" ")
+                    shown = 0
+                    tlm = _multiply((1, 0, 0, 1, operands[-2], operands[-1]), tlm)
+                    if op == b"TD":
+                        leading = -operands[-1]
+                elif op == b"T*":
+                    shown = 0
+                    tlm = _multiply((1, 0, 0, 1, 0, -leading), tlm)
+                elif op == b"TL" and _numbers(operands, 1):
+                    leading = operands[-1]
+                elif op == b"Tm" and _numbers(operands, 6):
+                    shown = 0
+                    tlm = tuple(operands[-6:])
+                elif op == b"BT":
+                    tlm = _IDENTITY
+                elif op == b"cm" and _numbers(operands, 6):
+                    ctm = _multiply(tuple(operands[-6:]), ctm)
+                elif op == b"q":
+                    saved.append(ctm)
+                elif op == b"Q" and saved:
+                    ctm = saved.pop()
+                elif op == b"Do" and operands and isinstance(operands[-1], str) and depth < _MAX_FORM_DEPTH:
+                    self._scan_form(resources, operands[-1], out, depth, ctm)
+                elif op == b"BI":
+                    # skip the inline image; its data can contain anything
+                    end = _INLINE_IMAGE_END.search(data, pos)
+                    pos = end.end() if end else n
+                operands = []
+                continue
+            operands.append(value)
+
+    def _scan_form(self, resources: Optional[DictionaryObject], name: str, out: list[str], depth: int,
+                   ctm: Matrix) -> None:
+        xobjects = resources.get("/XObject") if resources is not None else None
+        if xobjects is None or name not in xobjects:
+            return
+        xobject = xobjects[name]
+        if xobject.get("/Subtype") != "/Form":
+            return
+        matrix = xobject.get("/Matrix")
+        if matrix is not None and len(matrix) == 6:
+            ctm = _multiply(tuple(float(x) for x in matrix), ctm)
+        # a form without resources of its own uses those of the page
+        self._scan(xobject.get_data(), xobject.get("/Resources", resources), out, depth + 1, ctm)
@@ -0,0 +1,317 @@
+import re
+from io import BytesIO
+from os import PathLike
+from typing import Any, BinaryIO, Optional
+
+from pypdf.generic import DictionaryObject, IndirectObject, StreamObject, read_object
+
+from aidapdf.log import Logger
+
+
+_logger = Logger(__name__)
+
+
+_TAIL_SIZE = 1024
+"""The `startxref` keyword is searched for within this many bytes of the end of the file."""
+
+_STARTXREF = re.compile(rb"startxref\s+(\d+)")
+_OBJECT_HEADER = re.compile(rb"\s*(\d+)\s+(\d+)\s+obj\s*")
+_XREF_KEYWORD = re.compile(rb"\s*xref")
+_SUBSECTION = re.compile(rb"\s*(\d+)\s+(\d+)[ \t]*(?:\r\n|\r|\n)")
+_TRAILER_KEYWORD = re.compile(rb"\s*trailer\s*")
+_ENTRY = re.compile(rb"(\d{10}) (\d{5}) ([fn])(?: \r| \n|\r\n)")
+_ENTRY_SIZE = 20
+_KIDS = re.compile(rb"/Kids\s*\[[\d\sR]*\]")
+_ENDOBJ = b"endobj"
+_CHUNK_SIZE = 1 << 16
+_MAX_OBJECT_SIZE = 1 << 26
+
+_MAX_SECTIONS = 1024
+
+
+class TrailerScanError(Exception):
+    """The file doesn't have the structure the scanner expects; it has to be read by the full reader."""
+
+
+class _Section:
+    """A cross-reference section: a table or a cross-reference stream, and its trailer."""
+
+    def __init__(self, trailer: DictionaryObject):
+        self.trailer = trailer
+        self.table: list[tuple[int, int, int]] = []
+        """The subsections of a table: their first object number, number of entries and offset of the first entry."""
+        self.widths: Optional[list[int]] = None
+        """The field widths of a cross-reference stream, or `None` if this is a table."""
+        self.ranges: list[tuple[int, int]] = []
+        self.data = b""
+        self.stream: Optional['_Section'] = None
+        """The cross-reference stream of a hybrid file, searched after the table."""
+
+
+class TrailerScanner:
+    """
+    Reads single objects of a PDF file by following its trailer and cross-reference sections, without parsing more
+    of the file than it has to. Table entries are read by their offset instead of all being parsed, and cross-reference
+    and object streams are only decoded when they're needed, so looking up a few objects takes about the same time
+    however big the file is. Raises `TrailerScanError` (or whatever pypdf raises while parsing objects) if the file is
+    damaged.
+    """
+
+    strict = True
+    """Read by pypdf while parsing objects. Damaged objects aren't repaired, they fail the scan."""
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.xref: dict[int, dict[int, int]] = {}
+        """Read by pypdf only to repair damaged objects, which it doesn't do here."""
+        self._objects: dict[int, Any] = {}
+        self._object_streams: dict[int, tuple[bytes, list[int]]] = {}
+        self._sections = self._read_sections()
+        self.trailer = DictionaryObject()
+        """The merged trailer, newest entries first."""
+        for section in reversed(self._sections):
+            self.trailer.update(section.trailer)
+
+    def _read_sections(self) -> list[_Section]:
+        self.stream.seek(0, 2)
+        size = self.stream.tell()
+        self.stream.seek(max(0, size - _TAIL_SIZE))
+        matches = list(_STARTXREF.finditer(self.stream.read()))
+        if not matches:
+            raise TrailerScanError("no startxref")
+        offset: Optional[int] = int(matches[-1].group(1))
+        sections = []
+        seen = set()
+        while offset is not None:
+            if offset in seen or offset >= size or len(sections) >= _MAX_SECTIONS:
+                raise TrailerScanError(f"bad cross-reference offset {offset}")
+            seen.add(offset)
+            section = self._read_section(offset)
+            sections.append(section)
+            prev = section.trailer.get("/Prev")
+            offset = int(prev) if prev is not None else None
+        return sections
+
+    def _read_section(self, offset: int) -> _Section:
+        self.stream.seek(offset)
+        head = self.stream.read(16)
+        if _XREF_KEYWORD.match(head):
+            section = self._read_table(offset + _XREF_KEYWORD.match(head).end())
+            if "/XRefStm" in section.trailer:
+                section.stream = self._read_xref_stream(int(section.trailer["/XRefStm"]))
+            return section
+        return self._read_xref_stream(offset)
+
+    def _read_table(self, offset: int) -> _Section:
+        subsections = []
+        while True:
+            self.stream.seek(offset)
+            head = self.stream.read(64)
+            m = _SUBSECTION.match(head)
+            if m is None:
+                break
+            start, count = int(m.group(1)), int(m.group(2))
+            offset += m.end()
+            # the entries are found by their offset, so the first and the last have to be where they're expected
+            for i in {0, count - 1} if count else ():
+                self.stream.seek(offset + i * _ENTRY_SIZE)
+                if not _ENTRY.fullmatch(self.stream.read(_ENTRY_SIZE)):
+                    raise TrailerScanError(f"bad cross-reference entry {start + i}")
+            subsections.append((start, count, offset))
+            offset += count * _ENTRY_SIZE
+        m = _TRAILER_KEYWORD.match(head)
+        if m is None:
+            raise TrailerScanError("no trailer after the cross-reference table")
+        self.stream.seek(offset + m.end())
+        trailer = read_object(self.stream, self)
+        if not isinstance(trailer, DictionaryObject):
+            raise TrailerScanError("the trailer isn't a dictionary")
+        section = _Section(trailer)
+        section.table = subsections
+        return section
+
+    def _read_xref_stream(self, offset: int) -> _Section:
+        stream = self._read_object_at(offset)
+        if not isinstance(stream, StreamObject) or stream.get("/Type") != "/XRef":
+            raise TrailerScanError(f"no cross-reference stream at offset {offset}")
+        section = _Section(stream)
+        section.widths = [int(w) for w in stream["/W"]]
+        index = stream.get("/Index", [0, stream["/Size"]])
+        section.ranges = [(int(index[i]), int(index[i + 1])) for i in range(0, len(index) - 1, 2)]
+        section.data = stream.get_data()
+        return section
+
+    def _lookup_table(self, section: _Section, idnum: int) -> Optional[tuple[int, ...]]:
+        entry = None
+        for start, count, offset in section.table:
+            if start <= idnum < start + count:
+                self.stream.seek(offset + (idnum - start) * _ENTRY_SIZE)
+                m = _ENTRY.fullmatch(self.stream.read(_ENTRY_SIZE))
+                if m is None:
+                    raise TrailerScanError(f"bad cross-reference entry {idnum}")
+                entry = (1, int(m.group(1))) if m.group(3) == b"n" else (0,)
+        return entry
+
+    @staticmethod
+    def _lookup_stream(section: _Section, idnum: int) -> Optional[tuple[int, ...]]:
+        widths = section.widths
+        row = 0
+        for start, count in section.ranges:
+            if start <= idnum < start + count:
+                row += idnum - start
+                break
+            row += count
+        else:
+            return None
+        position = row * sum(widths)
+        if position + sum(widths) > len(section.data):
+            raise TrailerScanError(f"cross-reference stream too short for object {idnum}")
+        fields = []
+        for width in widths:
+            fields.append(int.from_bytes(section.data[position:position + width], 'big'))
+            position += width
+        # an absent type field means type 1
+        kind = fields[0] if widths[0] else 1
+        if kind == 1:
+            return 1, fields[1]
+        if kind == 2:
+            return 2, fields[1], fields[2]
+        return (0,)
+
+    def _lookup(self, idnum: int) -> Optional[tuple[int, ...]]:
+        """Return the newest entry of object `idnum`: `(1, offset)`, `(2, object stream, index)` or `(0,)` if it's
+        free, or `None` if there isn't one."""
+
+        for section in self._sections:
+            if section.widths is not None:
+                entry = self._lookup_stream(section, idnum)
+            else:
+                entry = self._lookup_table(section, idnum)
+                # hybrid files list the objects in object streams as free in the table
+                if (entry is None or entry[0] == 0) and section.stream is not None:
+                    entry = self._lookup_stream(section.stream, idnum) or entry
+            if entry is not None:
+                return entry
+        return None
+
+    def _read_object_at(self, offset: int, idnum: Optional[int] = None, skip_kids: bool = False) -> Any:
+        """
+        Read the object at `offset`, checking that it's object `idnum`.
+        :param skip_kids: If `True`, leave the `/Kids` array of a page tree node empty. Parsing it is most of the work
+                          when the tree is flat, and the page count doesn't need it.
+        """
+
+        self.stream.seek(offset)
+        head = self.stream.read(64)
+        m = _OBJECT_HEADER.match(head)
+        if m is None or (idnum is not None and int(m.group(1)) != idnum):
+            raise TrailerScanError(f"no object {idnum} at offset {offset}" if idnum is not None else
+                                   f"no object at offset {offset}")
+        self.stream.seek(offset + m.end())
+        if not skip_kids:
+            return read_object(self.stream, self)
+        data = b""
+        while _ENDOBJ not in data[-_CHUNK_SIZE - len(_ENDOBJ):]:
+            chunk = self.stream.read(_CHUNK_SIZE)
+            if not chunk or len(data) > _MAX_OBJECT_SIZE:
+                raise TrailerScanError(f"object {idnum} doesn't end")
+            data += chunk
+        return read_object(BytesIO(_KIDS.sub(b"/Kids[]", data, count=1)), self)
+
+    def _read_from_object_stream(self, stmnum: int, index: int, skip_kids: bool = False) -> Any:
+        if stmnum not in self._object_streams:
+            entry = self._lookup(stmnum)
+            if entry is None or entry[0] != 1:
+                raise TrailerScanError(f"no object stream {stmnum}")
+            stream = self._read_object_at(entry[1], stmnum)
+            if not isinstance(stream, StreamObject):
+                raise TrailerScanError(f"object {stmnum} isn't an object stream")
+            data = stream.get_data()
+            first = int(stream["/First"])
+            header = [int(n) for n in data[:first].split()]
+            self._object_streams[stmnum] = data, [first + offset for offset in header[1::2]]
+        data, offsets = self._object_streams[stmnum]
+        if index >= len(offsets):
+            raise TrailerScanError(f"object stream {stmnum} has no object {index}")
+        if skip_kids:
+            return read_object(BytesIO(_KIDS.sub(b"/Kids[]", data[offsets[index]:], count=1)), self)
+        stream = BytesIO(data)
+        stream.seek(offsets[index])
+        return read_object(stream, self)
+
+    def get_object(self, ref: int | IndirectObject) -> Any:
+        """Return the object `ref` refers to, or `None` if it's free or doesn't exist."""
+
+        idnum = ref.idnum if isinstance(ref, IndirectObject) else ref
+        if idnum not in self._objects:
+            self._objects[idnum] = self._read_object(idnum)
+        return self._objects[idnum]
+
+    def _read_object(self, idnum: int, skip_kids: bool = False) -> Any:
+        entry = self._lookup(idnum)
+        if entry is None or entry[0] == 0:
+            return None
+        if entry[0] == 1:
+            return self._read_object_at(entry[1], idnum, skip_kids)
+        return self._read_from_object_stream(entry[1], entry[2], skip_kids)
+
+    def resolve(self, obj: Any) -> Any:
+        return self.get_object(obj) if isinstance(obj, IndirectObject) else obj
+
+    @property
+    def encrypted(self) -> bool:
+        return "/Encrypt" in self.trailer
+
+    def get_page_count(self) -> int:
+        """Return the page count the page tree root declares."""
+
+        root = self.resolve(self.trailer.get("/Root"))
+        if not isinstance(root, DictionaryObject):
+            raise TrailerScanError("no document catalog")
+        pages = root.get("/Pages")
+        if isinstance(pages, IndirectObject):
+            # not cached, as its kids are missing
+            pages = self._read_object(pages.idnum, skip_kids=True)
+        if not isinstance(pages, DictionaryObject):
+            raise TrailerScanError("no page tree")
+        count = self.resolve(pages.get("/Count"))
+        if not isinstance(count, int) or count < 0:
+            raise TrailerScanError(f"bad page count {count}")
+        return int(count)
+
+    def get_metadata(self) -> dict[str, Any]:
+        """Return the document information dictionary, with its indirect values resolved."""
+
+        info = self.resolve(self.trailer.get("/Info"))
+        if not isinstance(info, DictionaryObject):
+            return {}
+        return {k: self.resolve(v) for k, v in info.items()}
+
+
+class TrailerInfo:
+    """What `scan_trailer()` found."""
+
+    def __init__(self, pages: Optional[int], metadata: dict[str, Any]):
+        self.pages = pages
+        """The page count, or `None` if it wasn't asked for."""
+        self.metadata = metadata
+
+
+def scan_trailer(path: str | PathLike, pages: bool = True) -> Optional[TrailerInfo]:
+    """
+    Read the metadata and, if `pages`, the page count of the unencrypted file at `path` with a `TrailerScanner`. That
+    takes a few milliseconds even for huge files, as opposed to reading the whole file and walking its page tree.
+    Return `None` if the file is encrypted, or damaged in a way that only the full reader can make sense of.
+    """
+
+    try:
+        with open(path, 'rb') as f:
+            scanner = TrailerScanner(f)
+            if scanner.encrypted:
+                _logger.debug(f"{repr(str(path))} is encrypted; the trailer isn't enough")
+                return None
+            return TrailerInfo(scanner.get_page_count() if pages else None, scanner.get_metadata())
+    except Exception as e:
+        # anything a damaged file can make the parser raise
+        _logger.debug(f"can't scan the trailer of {repr(str(path))} ({type(e).__name__}: {e}); reading all of it")
+        return None
@@ -1,11 +1,17 @@
 import subprocess
 import os
+from concurrent.futures import Executor, Future, wait, FIRST_COMPLETED
 from datetime import datetime
-from typing import Optional, Any
+from typing import Optional, Any, Callable, Iterable, Iterator, Sequence, TypeVar
+
+from pypdf.generic import IndirectObject, DictionaryObject, ArrayObject, StreamObject
 
 from aidapdf.config import Config
 
 
+T = TypeVar('T')
+
+
 def str_password(passwd: Any) -> Any:
     if type(passwd) is str:
         return '*' * 8 if passwd else None
@@ -31,3 +37,60 @@ def pluralize(n: int, noun: str) -> str:
 
 def format_date(date: datetime) -> str:
     return date.strftime('on %b %d %Y at %I:%M')
+
+
+def as_completed_bounded(executor: Executor, fn: Callable[..., Any], items: Iterable[tuple],
+                         max_pending: int) -> Iterator[Future]:
+    """
+    Submit `fn(*item)` for every item to the executor and yield the futures as they complete. At most `max_pending`
+    calls are in flight at a time, so huge (or lazy) `items` iterables don't have to be submitted all at once.
+    """
+
+    pending: set[Future] = set()
+    for item in items:
+        if len(pending) >= max_pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from done
+        pending.add(executor.submit(fn, *item))
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        yield from done
+
+
+def parse_shard(text: str) -> tuple[int, int]:
+    """Parse a shard specifier `K/N` (the K-th of N shards, counted from 1) into `(K, N)`."""
+
+    k, sep, n = text.partition('/')
+    if not sep:
+        raise ValueError(f"shard {repr(text)} isn't in the K/N format")
+    k, n = int(k), int(n)
+    if n < 1 or not 1 <= k <= n:
+        raise ValueError(f"shard {repr(text)} is out of range")
+    return k, n
+
+
+def shard(items: Sequence[T], k: int, n: int) -> Sequence[T]:
+    """
+    Return the `k`-th (counted from 1) of `n` contiguous parts of `items`. The sizes of the parts differ by at most 1
+    and only depend on `len(items)`, so every machine running the same job gets the same partition.
+    """
+
+    return items[len(items) * (k - 1) // n:len(items) * k // n]
+
+
+REFERENCE, STREAM, DICTIONARY, ARRAY, OTHER = range(5)
+"""Kinds of PDF objects, as returned by `object_kind()`."""
+_kinds: dict[type, int] = {}
+
+
+def object_kind(obj: Any) -> int:
+    """Return what kind of PDF object `obj` is. `isinstance()` is slow with pypdf's classes, and walking a document
+    checks every object a few times, so the kinds are looked up by type."""
+
+    t = type(obj)
+    kind = _kinds.get(t)
+    if kind is None:
+        kind = _kinds[t] = (REFERENCE if issubclass(t, IndirectObject) else STREAM if issubclass(t, StreamObject)
+                            else DICTIONARY if issubclass(t, DictionaryObject) else ARRAY
+                            if issubclass(t, ArrayObject) else OTHER)
+    return kind
@@ -0,0 +1,317 @@
+import ctypes
+import fnmatch
+import heapq
+import json
+import os
+import re
+import select
+import shlex
+import signal
+import struct
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+
+from aidapdf import util
+from aidapdf.config import Config
+from aidapdf.file import PdfFile
+from aidapdf.log import Logger
+
+
+_logger = Logger(__name__)
+
+
+_FIELD = re.compile(r"\{(file|dir|name|ext)}")
+
+_EOF_MARKER = b"%%EOF"
+_EOF_SEARCH = 1024
+"""A complete PDF file has an end-of-file marker within this many bytes of its end."""
+
+
+def parse_command(command: str) -> list[str]:
+    """
+    Split the command run for every file into arguments. Raise `ValueError` if it isn't a command of aidapdf (parsed
+    with the file in place), or if it's `watch` itself.
+    """
+
+    argv = shlex.split(command)
+    if not argv:
+        raise ValueError("the command is empty")
+    from aidapdf import commands
+    from aidapdf.__main__ import build_parser
+    try:
+        args = build_parser().parse_args(expand_command(argv, Path("file.pdf")))
+    except SystemExit:
+        # argparse has printed why already
+        raise ValueError(f"{repr(command)} isn't a valid command")
+    if "func" not in args:
+        raise ValueError(f"{repr(command)} isn't a command")
+    if args.func is commands.watch:
+        raise ValueError("watch can't run watch")
+    return argv
+
+
+def expand_command(argv: list[str], path: Path) -> list[str]:
+    """
+    Fill in the fields of the command run for the file `path`: `{file}` (its path) and those of
+    `PdfFile.template_fields()`. Other braces (e.g. of page selector conditions) are left alone. If the command doesn't
+    have `{file}`, the path is passed as the first argument after the command name.
+    """
+
+    fields = PdfFile(path).template_fields() | {"file": str(path)}
+    expanded = [_FIELD.sub(lambda m: fields[m.group(1)], arg) for arg in argv]
+    if any("{file}" in arg for arg in argv):
+        return expanded
+    return [expanded[0], str(path), *expanded[1:]]
+
+
+def _run_command(argv: list[str]) -> tuple[bool, Optional[str], float]:
+    """Run a command in a worker process. Return whether it succeeded, why not and how long it took."""
+
+    from aidapdf.__main__ import build_parser
+    start = time.monotonic()
+    try:
+        args = build_parser().parse_args(argv)
+        ok, error = bool(args.func(args)), None
+        if not ok:
+            # the command has logged why
+            error = "command failed"
+    except SystemExit as e:
+        ok, error = False, f"exited with {e.code}"
+    except Exception as e:
+        ok, error = False, f"{type(e).__name__}: {e}"
+    return ok, error, round(time.monotonic() - start, 3)
+
+
+def _init_worker(config: dict[str, Any]) -> None:
+    # an interrupt stops the watcher, which lets the running commands finish rather than leave half-written outputs
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    Config.restore(config)
+
+
+def _looks_complete(path: Path) -> bool:
+    """Return whether a PDF file has an end-of-file marker at its end, as fully written ones do."""
+
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - _EOF_SEARCH))
+            return _EOF_MARKER in f.read()
+    except OSError:
+        return False
+
+
+class _Inotify:
+    """Reports the files closed after writing or moved into a directory. Linux only."""
+
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self, directory: Path):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), self.IN_CLOSE_WRITE | self.IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch failed")
+
+    def wait(self, timeout: float) -> set[str]:
+        """Wait up to `timeout` seconds for events. Return the names of the files they're about."""
+
+        names: set[str] = set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        while readable:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset + self._EVENT.size <= len(data):
+                _, _, _, length = self._EVENT.unpack_from(data, offset)
+                offset += self._EVENT.size
+                names.add(os.fsdecode(data[offset:offset + length].rstrip(b"\0")))
+                offset += length
+        return names
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class Watcher:
+    """
+    Watches a directory for PDF files and runs a command on each of them in a pool of worker processes.
+
+    A file is picked up once it's fully written: when its size and modification time haven't changed for `settle`
+    seconds, or, where inotify is available, as soon as it's closed after writing (or moved in) and ends with an
+    end-of-file marker. At most twice as many files as there are workers are handed to the pool at once; the rest
+    wait, so a burst of files doesn't pile up in memory. Failed runs are retried after a growing delay.
+
+    Every event is appended to a JSON lines status log. Files the log records as done (or as having failed for
+    good) aren't run again unless they change, so the watcher can be restarted.
+    """
+
+    def __init__(self, directory: Path, argv: list[str], status_log: Path, pattern: str = "*.pdf",
+                 jobs: Optional[int] = None, retries: int = 2, retry_delay: float = 5.0, settle: float = 2.0,
+                 interval: float = 1.0, once: bool = False):
+        self.directory = directory
+        self.argv = argv
+        self.status_log = status_log
+        self.pattern = pattern.lower()
+        self.jobs = jobs or os.cpu_count() or 1
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.settle = settle
+        self.interval = interval
+        self.once = once
+
+        self._finished: dict[Path, tuple[int, int]] = {}
+        """Files that are done or have failed for good, with their size and modification time at the time."""
+        self._changing: dict[Path, tuple[tuple[int, int], float]] = {}
+        """Files that are being written, with their last size and modification time and since when they've had them."""
+        self._queue: deque[tuple[Path, tuple[int, int], int]] = deque()
+        self._retries: list[tuple[float, Path, tuple[int, int], int]] = []
+        self._running: dict[Future, tuple[Path, tuple[int, int], int]] = {}
+        self._busy: set[Path] = set()
+        self.failed = 0
+
+    def _log(self, path: Path, event: str, stat: tuple[int, int], attempt: int, **extra: Any) -> None:
+        record = {"time": datetime.now().astimezone().isoformat(timespec='seconds'), "file": str(path),
+                  "event": event, "attempt": attempt, "size": stat[0], "mtime": stat[1]} | extra
+        with open(self.status_log, 'a') as f:
+            f.write(json.dumps(record) + "\n")
+
+    def _load_status_log(self) -> None:
+        if not self.status_log.exists():
+            return
+        with open(self.status_log) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record.get("event") in ("done", "failed"):
+                    self._finished[Path(record["file"])] = (record["size"], record["mtime"])
+        _logger.debug(f"{len(self._finished)} files already processed according to {repr(str(self.status_log))}")
+
+    def _scan(self, closed: set[str]) -> None:
+        now = time.monotonic()
+        present = set()
+        for entry in os.scandir(self.directory):
+            if not fnmatch.fnmatch(entry.name.lower(), self.pattern) or not entry.is_file():
+                continue
+            path = Path(entry.path)
+            present.add(path)
+            if path in self._busy:
+                continue
+            st = entry.stat()
+            stat = (st.st_size, st.st_mtime_ns)
+            if self._finished.get(path) == stat:
+                continue
+            previous = self._changing.get(path)
+            if entry.name in closed and _looks_complete(path):
+                ready = True
+            elif previous is None or previous[0] != stat:
+                self._changing[path] = (stat, now)
+                ready = False
+            else:
+                ready = now - previous[1] >= self.settle
+            if ready:
+                self._changing.pop(path, None)
+                self._busy.add(path)
+                self._queue.append((path, stat, 1))
+                self._log(path, "queued", stat, 1)
+        # forget files that were removed before they settled
+        for path in self._changing.keys() - present:
+            del self._changing[path]
+
+    def _dispatch(self, executor: ProcessPoolExecutor) -> None:
+        now = time.monotonic()
+        while self._retries and self._retries[0][0] <= now:
+            _, path, stat, attempt = heapq.heappop(self._retries)
+            self._queue.append((path, stat, attempt))
+        while self._queue and len(self._running) < self.jobs * 2:
+            path, stat, attempt = self._queue.popleft()
+            future = executor.submit(_run_command, expand_command(self.argv, path))
+            self._running[future] = (path, stat, attempt)
+
+    def _collect(self) -> bool:
+        """Handle the finished runs. Return `False` if the pool broke."""
+
+        broken = False
+        for future in [future for future in self._running if future.done()]:
+            path, stat, attempt = self._running.pop(future)
+            try:
+                ok, error, seconds = future.result()
+            except BrokenProcessPool as e:
+                ok, error, seconds = False, f"worker died: {e}", None
+                broken = True
+            if ok:
+                _logger.info(f"processed {repr(str(path))} in {seconds} s")
+                self._log(path, "done", stat, attempt, seconds=seconds)
+            elif attempt <= self.retries:
+                delay = self.retry_delay * attempt
+                _logger.warn(f"processing {repr(str(path))} failed ({error}); retrying in "
+                             f"{delay:g} s")
+                self._log(path, "retry", stat, attempt, seconds=seconds, error=error)
+                heapq.heappush(self._retries, (time.monotonic() + delay, path, stat, attempt + 1))
+                continue
+            else:
+                _logger.err(f"processing {repr(str(path))} failed ({error}); giving up after "
+                            f"{attempt} attempts")
+                self._log(path, "failed", stat, attempt, seconds=seconds, error=error)
+                self.failed += 1
+            self._finished[path] = stat
+            self._busy.discard(path)
+        return not broken
+
+    def _idle(self) -> bool:
+        return not (self._changing or self._queue or self._retries or self._running)
+
+    def _executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(self.jobs, initializer=_init_worker, initargs=(Config.dump(),))
+
+    def run(self) -> None:
+        """Watch the directory until interrupted, or with `once`, until the files present at the start are done."""
+
+        self._load_status_log()
+        inotify: Optional[_Inotify] = None
+        if sys.platform.startswith("linux"):
+            try:
+                inotify = _Inotify(self.directory)
+            except (OSError, AttributeError) as e:
+                _logger.debug(f"inotify isn't available ({e}); polling")
+        _logger.info(f"watching {repr(str(self.directory))} for {self.pattern} with {self.jobs} workers" +
+                     (" (inotify)" if inotify else ""))
+
+        executor = self._executor()
+        try:
+            closed: set[str] = set()
+            while True:
+                self._scan(closed)
+                self._dispatch(executor)
+                if not self._collect():
+                    _logger.warn("the worker pool broke; starting a new one")
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    executor = self._executor()
+                if self.once and self._idle():
+                    break
+                if inotify:
+                    closed = inotify.wait(self.interval)
+                else:
+                    time.sleep(self.interval)
+        except KeyboardInterrupt:
+            running = sum(not future.done() for future in self._running)
+            _logger.info("stopped watching" + (f"; waiting for {util.pluralize(running, 'running command')}" if running
+                                               else ""))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            if inotify:
+                inotify.close()
@@ -0,0 +1,63 @@
+"""
+Times the text extraction modes of `aidapdf extract` on a corpus of PDF files: pypdf's 'plain' and 'layout' modes and
+aida's 'fast' mode. For each file, prints the time per mode and how much of the words of 'plain' mode 'fast' mode finds.
+
+    python benchmarks/extract_text.py FILE...
+"""
+
+import argparse
+import difflib
+import sys
+import time
+from pathlib import Path
+
+from pypdf import PdfReader
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from aidapdf.textscan import TextScanner  # noqa: E402
+
+
+MODES = ['plain', 'layout', 'fast']
+
+
+def _extract(path: Path, mode: str) -> tuple[float, str]:
+    reader = PdfReader(path)
+    scanner = TextScanner()
+    start = time.perf_counter()
+    if mode == 'fast':
+        text = "".join(scanner.extract_text(page) for page in reader.pages)
+    else:
+        # layout mode fails on pages without content
+        text = "".join(page.extract_text(extraction_mode=mode) for page in reader.pages if "/Contents" in page)
+    return time.perf_counter() - start, text
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="benchmark the text extraction modes")
+    parser.add_argument('files', nargs='+', type=Path)
+    parser.add_argument('-r', '--repeat', type=int, default=3, help="best of this many runs. defaults to 3")
+    args = parser.parse_args()
+
+    print(f"{'file':<32} {'pages':>6} " + " ".join(f"{mode + ' (s)':>11}" for mode in MODES) +
+          f" {'speedup':>8} {'words':>6}")
+    totals = {mode: 0.0 for mode in MODES}
+    for path in args.files:
+        times = {}
+        texts = {}
+        for mode in MODES:
+            runs = [_extract(path, mode) for _ in range(args.repeat)]
+            times[mode] = min(t for t, _ in runs)
+            texts[mode] = runs[0][1]
+            totals[mode] += times[mode]
+        # share of the words of plain mode that fast mode finds, in order
+        words = difflib.SequenceMatcher(None, texts['plain'].split(), texts['fast'].split(), autojunk=False)
+        print(f"{path.name[:32]:<32} {len(PdfReader(path).pages):>6} " +
+              " ".join(f"{times[mode]:>11.3f}" for mode in MODES) +
+              f" {times['plain'] / max(times['fast'], 1e-9):>7.1f}x {words.ratio():>6.2f}")
+    print(f"{'total':<32} {'':>6} " + " ".join(f"{totals[mode]:>11.3f}" for mode in MODES) +
+          f" {totals['plain'] / max(totals['fast'], 1e-9):>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
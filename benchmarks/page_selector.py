@@ -0,0 +1,74 @@
+"""
+Times parsing page selectors, as batch jobs do: a set of distinct selectors parsed once (cold, every one a cache miss)
+and then parsed over and over (warm, served from the cache).
+
+    python benchmarks/page_selector.py [-n COUNT] [-r ROUNDS]
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from aidapdf import pageselector  # noqa: E402
+from aidapdf.pageselector import PageSelector  # noqa: E402
+
+
+def _selectors(count: int, seed: int = 0) -> list[str]:
+    """Return `count` distinct selectors mixing numbers, ranges, conditions and exclusions."""
+
+    rng = random.Random(seed)
+    conditions = ["odd", "even", "blank", "hastext", "a4", "landscape"]
+    selectors: set[str] = set()
+    while len(selectors) < count:
+        parts = []
+        for _ in range(rng.randint(1, 6)):
+            start = rng.randint(1, 500)
+            shape = rng.randrange(5)
+            if shape == 0:
+                parts.append(str(start))
+            elif shape == 1:
+                parts.append(f"^{start}")
+            elif shape == 2:
+                parts.append(f"{start}-{start + rng.randint(0, 500)}")
+            elif shape == 3:
+                parts.append(f"{start}-^1{{{rng.choice(conditions)}}}")
+            else:
+                parts.append(f"*{{{rng.choice(conditions)} or {rng.choice(conditions)}}}!{start}")
+        selectors.add(", ".join(parts))
+    return list(selectors)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="benchmark parsing page selectors")
+    parser.add_argument('-n', '--count', type=int, default=20000,
+                        help="number of distinct selectors. defaults to 20000")
+    parser.add_argument('-r', '--rounds', type=int, default=10, help="number of warm rounds. defaults to 10")
+    args = parser.parse_args()
+
+    selectors = _selectors(args.count)
+    pageselector._parse.cache_clear()
+
+    start = time.perf_counter()
+    for text in selectors:
+        PageSelector.parse(text)
+    cold = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        for text in selectors:
+            PageSelector.parse(text)
+    warm = (time.perf_counter() - start) / args.rounds
+
+    info = pageselector._parse.cache_info()
+    print(f"{len(selectors)} selectors, {sum(map(len, selectors)) / len(selectors):.0f} characters on average")
+    print(f"cold: {cold:.3f} s ({cold / len(selectors) * 1e6:.1f} us per selector)")
+    print(f"warm: {warm:.3f} s ({warm / len(selectors) * 1e6:.1f} us per selector; cache size {info.maxsize}, "
+          f"{info.hits} hits, {info.misses} misses)")
+
+
+if __name__ == '__main__':
+    main()
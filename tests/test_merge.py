@@ -0,0 +1,69 @@
+"""
+Regression checks for `merge --jobs`: the pages serialized by the worker processes (see `streamwriter.Fragment`) are
+copied to the output without being parsed again, and have to come out as they do from a serial merge.
+
+    python -m pytest tests
+"""
+
+from pathlib import Path
+
+import pytest
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+from aidapdf.__main__ import build_parser
+
+
+FILES = 5
+PAGES = 3
+
+
+@pytest.fixture
+def inputs(tmp_path: Path) -> list[Path]:
+    """Encrypted documents whose pages share a font."""
+
+    paths = []
+    for n in range(FILES):
+        writer = PdfWriter()
+        font = writer._add_object(DictionaryObject({
+            NameObject("/Type"): NameObject("/Font"),
+            NameObject("/Subtype"): NameObject("/Type1"),
+            NameObject("/BaseFont"): NameObject("/Helvetica"),
+        }))
+        for p in range(PAGES):
+            page = writer.add_blank_page(612, 792)
+            contents = DecodedStreamObject()
+            contents.set_data(f"BT /F1 12 Tf 72 700 Td (File {n} page {p}) Tj ET".encode())
+            page[NameObject("/Contents")] = writer._add_object(contents)
+            page[NameObject("/Resources")] = DictionaryObject({
+                NameObject("/Font"): DictionaryObject({NameObject("/F1"): font}),
+            })
+        writer.encrypt("secret", algorithm="AES-256")
+        paths.append(tmp_path / f"in{n}.pdf")
+        writer.write(paths[-1])
+    return paths
+
+
+def _run(*argv: str) -> bool:
+    args = build_parser().parse_args(list(argv))
+    return args.func(args)
+
+
+def _texts(path: Path) -> list[str]:
+    return [page.extract_text() for page in PdfReader(path).pages]
+
+
+@pytest.mark.parametrize("options", [[], ["--prune"], ["--linearize"]])
+def test_merge_jobs(tmp_path: Path, inputs: list[Path], options: list[str]):
+    serial, parallel = tmp_path / "serial.pdf", tmp_path / "parallel.pdf"
+    files = [str(path) for path in inputs] + [f"{inputs[0]}:2"]
+    assert _run("merge", *files, "--dpass", "secret", "-o", str(serial), *options)
+    assert _run("merge", *files, "--dpass", "secret", "-o", str(parallel), "-j", "2", *options)
+
+    assert _texts(parallel) == _texts(serial)
+    assert len(_texts(parallel)) == FILES * PAGES + 1
+    reader = PdfReader(parallel)
+    # the font is written once per input
+    fonts = {page["/Resources"].raw_get("/Font").raw_get("/F1").idnum for page in reader.pages}
+    assert len(fonts) == FILES + 1
+    assert all(page["/Parent"].indirect_reference == reader.root_object.raw_get("/Pages") for page in reader.pages)
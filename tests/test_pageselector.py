@@ -0,0 +1,70 @@
+"""
+Regression checks for the page selector parser: selectors the parser before the rewrite accepted keep their meaning.
+
+    python -m pytest tests
+"""
+
+import pytest
+
+from aidapdf.pageselector import PageSelector, PageSelectorParserException
+
+
+class _File:
+    """Stands in for a `PdfFile` of `PAGES` pages; enough to bake selectors without conditions on page content."""
+
+    PAGES = 20
+
+    def get_page_count(self) -> int:
+        return self.PAGES
+
+
+def _pages(selector: str) -> list[int]:
+    return [i + 1 for i in PageSelector.parse(selector).bake(_File())]
+
+
+@pytest.mark.parametrize("selector, pages", [
+    ("1", [1]),
+    ("1,2,3", [1, 2, 3]),
+    ("1-3", [1, 2, 3]),
+    ("^1", [20]),
+    ("18-", [18, 19, 20]),
+    ("*{odd}", list(range(1, 21, 2))),
+    ("even", list(range(2, 21, 2))),
+    ("1-10!5", [1, 2, 3, 4, 6, 7, 8, 9, 10]),
+    ("", list(range(1, 21))),
+    # empty elements are skipped
+    ("1,", [1]),
+    ("2,5,", [2, 5]),
+    (",1", [1]),
+    ("1,,2", [1, 2]),
+    (",", list(range(1, 21))),
+    # whitespace separates tokens like a comma
+    ("1 2", [1, 2]),
+    (" 1 ,2 ", [1, 2]),
+    ("1 - 3", [1, 2, 3]),
+    ("1-3 5", [1, 2, 3, 5]),
+    ("odd 4", [*range(1, 21, 2), 4]),
+])
+def test_parse(selector: str, pages: list[int]):
+    assert _pages(selector) == pages
+
+
+@pytest.mark.parametrize("selector, same", [("1,", "1"), (",1,,2,", "1,2"), ("1 2", "1,2"), ("1-3 5", "1-3,5")])
+def test_equivalent(selector: str, same: str):
+    assert PageSelector.parse(selector) == PageSelector.parse(same)
+
+
+@pytest.mark.parametrize("selector, found, column", [
+    ("-3", "'-'", 1),
+    ("1-2-3", "'-'", 4),
+    ("*{^3}", "'^3'", 3),
+    ("1 }", "'}'", 3),
+    ("odd and", "end of selector", 8),
+    ("1$", "'$'", 2),
+])
+def test_errors(selector: str, found: str, column: int):
+    with pytest.raises(PageSelectorParserException) as e:
+        PageSelector.parse(selector)
+    message = str(e.value)
+    assert found in message
+    assert f"column {column}" in message
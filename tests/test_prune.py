@@ -0,0 +1,128 @@
+"""
+Regression checks for `--prune`, with the streaming writer in particular: pages rebuilt by a stamp or by imposition
+refer to objects the streaming writer has written already, which it can't read back.
+
+    python -m pytest tests
+"""
+
+from pathlib import Path
+
+import pytest
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ArrayObject, DecodedStreamObject, DictionaryObject, NameObject, NumberObject
+
+from aidapdf.__main__ import build_parser
+from aidapdf.streamwriter import StreamingPdfWriter
+
+
+PAGES = 8
+IMAGE_SIZE = 4000
+
+
+def _stream(writer: PdfWriter, data: bytes, **entries) -> DecodedStreamObject:
+    stream = DecodedStreamObject()
+    stream.set_data(data)
+    stream.update({NameObject(k): v for k, v in entries.items()})
+    return writer._add_object(stream)
+
+
+def _font(writer: PdfWriter, name: str):
+    return writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject(name),
+    }))
+
+
+@pytest.fixture
+def shared(tmp_path: Path) -> Path:
+    """A document whose pages share one resource dictionary with a font and an image for every page."""
+
+    writer = PdfWriter()
+    fonts, images = DictionaryObject(), DictionaryObject()
+    for i in range(PAGES):
+        fonts[NameObject(f"/F{i}")] = _font(writer, "/Helvetica")
+        images[NameObject(f"/Im{i}")] = _stream(
+            writer, bytes(i for i in range(256)) * (IMAGE_SIZE // 256), **{
+                "/Type": NameObject("/XObject"), "/Subtype": NameObject("/Image"), "/Width": NumberObject(16),
+                "/Height": NumberObject(IMAGE_SIZE // 256 * 16), "/ColorSpace": NameObject("/DeviceGray"),
+                "/BitsPerComponent": NumberObject(8)})
+    resources = writer._add_object(DictionaryObject({NameObject("/Font"): fonts, NameObject("/XObject"): images}))
+    for i in range(PAGES):
+        page = writer.add_blank_page(612, 792)
+        page[NameObject("/Contents")] = _stream(
+            writer, f"BT /F{i} 12 Tf 72 700 Td (Page {i + 1}) Tj ET q 16 0 0 16 72 72 cm /Im{i} Do Q".encode())
+        page[NameObject("/Resources")] = resources
+    path = tmp_path / "shared.pdf"
+    writer.write(path)
+    return path
+
+
+@pytest.fixture
+def stamp(tmp_path: Path) -> Path:
+    writer = PdfWriter()
+    page = writer.add_blank_page(100, 100)
+    page[NameObject("/Contents")] = _stream(writer, b"BT /S 10 Tf 10 10 Td (Stamp) Tj ET")
+    page[NameObject("/Resources")] = DictionaryObject({
+        NameObject("/Font"): DictionaryObject({NameObject("/S"): _font(writer, "/Courier")}),
+        NameObject("/ProcSet"): ArrayObject([NameObject("/PDF")]),
+    })
+    path = tmp_path / "stamp.pdf"
+    writer.write(path)
+    return path
+
+
+def _run(*argv: str) -> bool:
+    args = build_parser().parse_args(list(argv))
+    return args.func(args)
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+@pytest.mark.parametrize("layout, sheets", [([], PAGES), (["--booklet"], PAGES // 2), (["--nup", "4"], PAGES // 4)])
+@pytest.mark.parametrize("stamped", [True, False])
+def test_prune_edit(tmp_path: Path, shared: Path, stamp: Path, streaming: bool, layout: list[str], sheets: int,
+                    stamped: bool):
+    output = tmp_path / "out.pdf"
+    argv = ["edit", str(shared), "-o", str(output), "--prune", *layout]
+    if streaming:
+        argv.append("--streaming")
+    if stamped:
+        argv += ["--stamp", str(stamp)]
+    assert _run(*argv)
+
+    reader = PdfReader(output)
+    assert len(reader.pages) == sheets
+    text = " ".join(page.extract_text() for page in reader.pages)
+    assert all(f"Page {i + 1}" in text for i in range(PAGES))
+    assert ("Stamp" in text) == stamped
+    # every image is written once, wherever the pages are put
+    assert output.stat().st_size < shared.stat().st_size * 1.5
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_prune_selected_pages(tmp_path: Path, shared: Path, streaming: bool):
+    output = tmp_path / "out.pdf"
+    assert _run("edit", str(shared), "-s", "2", "-o", str(output), "--prune", *(["--streaming"] if streaming else []))
+
+    page = PdfReader(output).pages[0]
+    assert page.extract_text().strip() == "Page 2"
+    assert list(page["/Resources"]["/Font"]) == ["/F1"]
+    assert list(page["/Resources"]["/XObject"]) == ["/Im1"]
+    assert output.stat().st_size < IMAGE_SIZE * 2
+
+
+def test_failed_streaming_edit_leaves_no_file(tmp_path: Path, shared: Path, monkeypatch: pytest.MonkeyPatch):
+    output = tmp_path / "out.pdf"
+    insert_page = StreamingPdfWriter.insert_page
+    inserted = []
+
+    def failing_insert_page(self, page, index=0):
+        if inserted:
+            raise RuntimeError("insert_page failed")
+        inserted.append(page)
+        insert_page(self, page, index)
+
+    monkeypatch.setattr(StreamingPdfWriter, "insert_page", failing_insert_page)
+    with pytest.raises(RuntimeError):
+        _run("edit", str(shared), "-o", str(output), "--streaming", "--prune")
+    assert list(tmp_path.iterdir()) == [shared]